@@ -0,0 +1,172 @@
+"""
+Text attachments as prompt context
+
+Discord attachments and Slack file shares are downloaded as a stream and
+stop at max_bytes, so a large file is never held in memory whole. Downloaded
+text is cached by content hash (and each file's ID maps to its hash), so asking
+about the same file again doesn't download it again. Files too long to include
+directly are summarized once per content hash, and the cached summary is
+used from then on.
+"""
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+import requests
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+TEXT_EXTENSIONS = {
+    '.txt', '.log', '.md', '.rst', '.csv', '.tsv', '.json', '.yaml', '.yml', '.toml', '.ini', '.cfg',
+    '.conf', '.xml', '.html', '.css', '.sql', '.sh', '.py', '.js', '.ts', '.go', '.rs', '.java',
+    '.c', '.h', '.cpp', '.hpp', '.rb', '.php', '.diff', '.patch',
+}
+TEXT_CONTENT_TYPES = ('text/', 'application/json', 'application/xml', 'application/x-yaml', 'application/toml')
+
+DEFAULT_FILE_PROMPT = "Summarize the attached file."
+
+class Attachment:
+    """A file attached to a chat message"""
+    __slots__ = ('file_id', 'name', 'url', 'size', 'content_type', 'headers')
+
+    def __init__(self, file_id, name, url, size=None, content_type=None, headers=None):
+        self.file_id = file_id
+        self.name = name
+        self.url = url
+        self.size = size
+        self.content_type = content_type or ""
+        self.headers = headers or {}  # e.g. Slack's bearer token for private file URLs
+
+    def is_text(self):
+        """Guess whether the file is text from its content type or extension"""
+        if self.content_type.startswith(TEXT_CONTENT_TYPES):
+            return True
+        return os.path.splitext(self.name.lower())[1] in TEXT_EXTENSIONS
+
+class AttachmentStore:
+    def __init__(self, config=None, summarize=None):
+        self.summarize = summarize  # summarize(text) -> summary or None on error; without it long files are trimmed
+        self.session = requests.Session()
+        self._lock = threading.Lock()
+        self._hashes = OrderedDict()     # key: file ID, value: content hash
+        self._texts = OrderedDict()      # key: content hash, value: (text, truncated)
+        self._summaries = OrderedDict()  # key: content hash, value: summary
+        self.configure(config)
+
+    def configure(self, config=None):
+        """Apply [attachments] settings, keeping cached files"""
+        config = config or {}
+        self.enabled = config.get('enabled', True)
+        self.max_bytes = config.get('max_bytes', 256 * 1024)   # Download cap per file
+        self.max_files = config.get('max_files', 3)            # Files read per message
+        self.max_chars = config.get('max_chars', 6000)         # Longer text is summarized
+        self.timeout = config.get('timeout', 15)
+        self.cache_size = config.get('cache_size', 128)
+
+        with self._lock:
+            # Summaries depend on the model, which may have changed
+            self._summaries.clear()
+
+    def add_to_prompt(self, prompt, attachments):
+        """Append the text of a message's attachments to its prompt"""
+        if not self.enabled:
+            return prompt
+
+        sections = []
+        for attachment in [a for a in attachments if a.is_text()][:self.max_files]:
+            text = self.file_context(attachment)
+            if text:
+                sections.append(f"File {attachment.name}:\n```\n{text}\n```")
+
+        if not sections:
+            return prompt
+        return "\n\n".join([prompt or DEFAULT_FILE_PROMPT] + sections)
+
+    def file_context(self, attachment):
+        """The text to include for a file: its contents, or a summary if it is long"""
+        content_hash = self._cached(self._hashes, attachment.file_id)
+        cached = self._cached(self._texts, content_hash) if content_hash else None
+        if cached is not None:
+            metrics.incr("attachment_cache_hits")
+        else:
+            cached = self.download(attachment)
+            if cached is None:
+                return None
+            content_hash, text, truncated = cached
+            cached = (text, truncated)
+            self._remember(self._hashes, attachment.file_id, content_hash)
+            self._remember(self._texts, content_hash, cached)
+
+        text, truncated = cached
+        note = f"\n[only the first {self.max_bytes} bytes were read]" if truncated else ""
+        if len(text) <= self.max_chars:
+            return text + note
+
+        summary = self._cached(self._summaries, content_hash)
+        if summary is not None:
+            metrics.incr("attachment_summary_cache_hits")
+        elif self.summarize is not None:
+            summary = self.summarize(text)
+            if summary is not None:
+                metrics.incr("attachment_summaries")
+                self._remember(self._summaries, content_hash, summary)
+
+        if summary is None:
+            return text[:self.max_chars] + f"\n[trimmed to {self.max_chars} characters]"
+        return f"[summary of a long file]\n{summary}{note}"
+
+    def download(self, attachment):
+        """Stream a file, hashing it as it arrives and stopping at max_bytes.
+
+        Returns (content hash, text, truncated), or None if it isn't usable text.
+        """
+        if attachment.size and attachment.size > self.max_bytes:
+            logger.info(f"{attachment.name} is {attachment.size} bytes, reading the first {self.max_bytes}")
+
+        digest = hashlib.sha256()
+        data = bytearray()
+        truncated = False
+        try:
+            with self.session.get(attachment.url, headers=attachment.headers,
+                                  timeout=self.timeout, stream=True) as response:
+                if response.status_code != 200:
+                    logger.warning(f"Could not download {attachment.name}: HTTP {response.status_code}")
+                    return None
+                for chunk in response.iter_content(chunk_size=16 * 1024):
+                    room = self.max_bytes - len(data)
+                    if len(chunk) > room:
+                        chunk = chunk[:room]
+                        truncated = True
+                    digest.update(chunk)
+                    data.extend(chunk)
+                    if truncated:
+                        break
+        except requests.RequestException as e:
+            logger.warning(f"Could not download {attachment.name}: {e}")
+            return None
+
+        metrics.incr("attachments_downloaded")
+        metrics.incr("attachment_bytes", len(data))
+
+        if b'\x00' in data:
+            logger.info(f"Skipping {attachment.name}: not a text file")
+            return None
+        # A cut at max_bytes can split a multi-byte character
+        text = data.decode('utf-8', errors='replace' if not truncated else 'ignore')
+        return digest.hexdigest(), text, truncated
+
+    def _cached(self, cache, key):
+        with self._lock:
+            if key not in cache:
+                return None
+            cache.move_to_end(key)
+            return cache[key]
+
+    def _remember(self, cache, key, value):
+        with self._lock:
+            cache[key] = value
+            cache.move_to_end(key)
+            while len(cache) > self.cache_size:
+                cache.popitem(last=False)
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Ollama option sweep benchmark
+
+Runs a fixed prompt set against every combination of the given Ollama options
+and reports generation speed (tokens/s), time to first token and model memory,
+then recommends the fastest settings as a config.toml snippet.
+
+Usage:
+    python benchmark.py config.toml --set num_ctx=2048,4096 --set num_thread=4,8
+"""
+import argparse
+import itertools
+import json
+import statistics
+import sys
+import time
+import toml
+import requests
+from ollama_client import OllamaClient
+
+DEFAULT_PROMPTS = [
+    "What is the capital of France?",
+    "Explain what a hash table is in two sentences.",
+    "Write a haiku about servers.",
+    "Summarize the plot of Romeo and Juliet in one paragraph.",
+]
+
+def parse_value(value):
+    """Parse an option value as int, float or string"""
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    return value
+
+def parse_sweep(settings):
+    """Turn ["num_ctx=2048,4096", ...] into {"num_ctx": [2048, 4096], ...}"""
+    sweep = {}
+    for setting in settings:
+        name, _, values = setting.partition('=')
+        if not values:
+            raise ValueError(f"Expected name=value[,value...], got '{setting}'")
+        sweep[name.strip()] = [parse_value(value.strip()) for value in values.split(',')]
+    return sweep
+
+def combinations(sweep):
+    """Yield every combination of the swept options as a dict"""
+    names = list(sweep)
+    for values in itertools.product(*(sweep[name] for name in names)):
+        yield dict(zip(names, values))
+
+def run_prompt(client, prompt, max_tokens):
+    """Stream one generation, returning (tokens/s, time to first token) or None on error"""
+    path, payload = client._build_request(prompt, max_tokens, None, client.model, True)
+    start = time.perf_counter()
+    first_token = None
+    final = {}
+
+    try:
+        response = client.session.post(f"{client.base_url}{path}", json=payload, timeout=client.timeout, stream=True)
+        if response.status_code != 200:
+            print(f"  Ollama API error: {response.status_code}")
+            return None
+        for line in response.iter_lines():
+            if not line:
+                continue
+            data = json.loads(line)
+            if first_token is None and data.get("response"):
+                first_token = time.perf_counter() - start
+            if data.get("done"):
+                final = data
+                break
+    except (requests.RequestException, json.JSONDecodeError) as e:
+        print(f"  Request failed: {e}")
+        return None
+
+    # Ollama reports decode time itself, which excludes prompt processing and network
+    eval_count = final.get("eval_count", 0)
+    eval_duration = final.get("eval_duration", 0) / 1e9
+    tokens_per_second = eval_count / eval_duration if eval_duration else 0.0
+    return tokens_per_second, first_token or (time.perf_counter() - start)
+
+def benchmark(client, prompts, max_tokens, repeat):
+    """Benchmark one set of options, returning a result dict or None if it failed"""
+    # The first request loads the model with the new options; don't time it
+    if run_prompt(client, prompts[0], 8) is None:
+        return None
+
+    speeds, first_tokens = [], []
+    for _ in range(repeat):
+        for prompt in prompts:
+            sample = run_prompt(client, prompt, max_tokens)
+            if sample is None:
+                return None
+            speeds.append(sample[0])
+            first_tokens.append(sample[1])
+
+    memory = client.model_memory(client.model)
+    return {
+        "tokens_per_second": statistics.median(speeds),
+        "time_to_first_token": statistics.median(first_tokens),
+        "memory": memory[0] if memory else None,
+        "vram": memory[1] if memory else None,
+    }
+
+def format_bytes(size):
+    """Format a byte count for the report"""
+    if size is None:
+        return "?"
+    return f"{size / 1024 ** 3:.1f}G"
+
+def format_options(options):
+    """Format swept options for the report"""
+    return " ".join(f"{name}={value}" for name, value in options.items()) or "(config defaults)"
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep Ollama options and recommend the fastest settings")
+    parser.add_argument('config_file', nargs='?', default='config.toml',
+                        help="Configuration file (default: config.toml)")
+    parser.add_argument('--model', help="Model to benchmark (default: [ollama].model)")
+    parser.add_argument('--set', dest='sweep', action='append', default=[], metavar='OPTION=V1,V2',
+                        help="Option values to sweep, e.g. num_ctx=2048,4096 (repeatable)")
+    parser.add_argument('--prompts', help="File with one prompt per line (default: built-in set)")
+    parser.add_argument('--max-tokens', type=int, default=128, help="Tokens to generate per prompt (default: 128)")
+    parser.add_argument('--repeat', type=int, default=2, help="Runs of the prompt set per combination (default: 2)")
+    args = parser.parse_args()
+
+    try:
+        with open(args.config_file, 'r') as f:
+            config = toml.load(f)
+        sweep = parse_sweep(args.sweep)
+    except (OSError, toml.TomlDecodeError, ValueError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    ollama_config = config['ollama']
+    model = args.model or ollama_config['model']
+    base_client = OllamaClient(
+        base_url=ollama_config['base_url'],
+        model=model,
+        timeout=ollama_config.get('timeout', 30),
+        options=ollama_config.get('options'),
+        model_options=ollama_config.get('model_options')
+    )
+    base_options = base_client.options_for(model)
+
+    prompts = DEFAULT_PROMPTS
+    if args.prompts:
+        with open(args.prompts, 'r') as f:
+            prompts = [line.strip() for line in f if line.strip()]
+
+    if not base_client.probe():
+        print(f"❌ Ollama is not reachable at {ollama_config['base_url']}")
+        sys.exit(1)
+
+    print(f"Benchmarking {model}: {len(prompts)} prompts x {args.repeat}, {args.max_tokens} tokens each")
+    print(f"Base options: {format_options(base_options)}")
+    print("=" * 50)
+
+    results = []
+    for options in combinations(sweep):
+        print(f"▶ {format_options(options)}")
+        client = OllamaClient(
+            base_url=base_client.base_url,
+            model=model,
+            timeout=base_client.timeout,
+            options={**base_options, **options}
+        )
+        result = benchmark(client, prompts, args.max_tokens, args.repeat)
+        if result is None:
+            print("  Skipped after errors")
+            continue
+        print(f"  {result['tokens_per_second']:.1f} tok/s, first token {result['time_to_first_token']:.2f}s, "
+              f"memory {format_bytes(result['memory'])} (VRAM {format_bytes(result['vram'])})")
+        results.append((options, result))
+
+    if not results:
+        print("❌ No combination completed")
+        sys.exit(1)
+
+    results.sort(key=lambda item: item[1]['tokens_per_second'], reverse=True)
+    print("=" * 50)
+    print(f"{'tok/s':>8} {'TTFT':>7} {'memory':>7}  options")
+    for options, result in results:
+        print(f"{result['tokens_per_second']:8.1f} {result['time_to_first_token']:6.2f}s "
+              f"{format_bytes(result['memory']):>7}  {format_options(options)}")
+
+    best_options, best = results[0]
+    print("=" * 50)
+    print(f"✅ Fastest: {format_options(best_options)} ({best['tokens_per_second']:.1f} tok/s)")
+    if best_options:
+        print("Add to config.toml:")
+        print(toml.dumps({'ollama': {'model_options': {model: best_options}}}).strip())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Idle-time pre-warming of the response cache
+
+When no user generation has started for idle_after seconds and nothing is
+waiting for a scheduler slot or a worker process, the warmer regenerates answers to the most
+frequently asked prompts whose cached answers have expired or are about to,
+one at a time. Warming generations are background generations: the moment a
+user's generation starts, the warming one is cancelled and the warmer waits
+for the bot to be idle again. Hits on warmed answers are counted, so !stats
+shows how much generation warming saved.
+"""
+import logging
+import threading
+import time
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+class CacheWarmer:
+    def __init__(self, cache, generator, generations, scheduler=None, config=None, workers=None):
+        self.cache = cache
+        self.generator = generator      # Anything with generate_response(), e.g. a WorkerPool
+        self.generations = generations
+        self.scheduler = scheduler
+        self.workers = workers          # The WorkerPool, whose processes have their own schedulers
+        self._attempted = {}            # key: cache key, value: monotonic time of the last failed attempt
+        self._thread = None
+        self.configure(config)
+
+    def configure(self, config=None):
+        """Apply the warming settings from [cache]"""
+        config = config or {}
+        self.enabled = config.get('warm', False)
+        self.idle_after = config.get('warm_idle', 60)          # Seconds without user generations
+        self.min_asks = config.get('warm_min_asks', 2)         # Times a prompt was asked before it is warmed
+        self.horizon = config.get('warm_horizon', 600)         # Warm answers expiring within this many seconds
+        self.max_age = config.get('warm_max_age', 86400)       # Only warm prompts asked within this many seconds
+        self.interval = config.get('warm_interval', 10)        # Seconds between idle checks
+
+    def start(self):
+        """Start the warming thread"""
+        self._thread = threading.Thread(target=self._run, name="cache-warmer", daemon=True)
+        self._thread.start()
+
+    def idle(self):
+        """Whether the bot has had no user traffic for idle_after seconds"""
+        if len(self.generations) or time.monotonic() - self.generations.last_started < self.idle_after:
+            return False
+        return all(source is None or source.queue_depth() == 0 for source in (self.scheduler, self.workers))
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            if not self.enabled or not self.cache.enabled:
+                continue
+            try:
+                while self.idle() and self.warm_next():
+                    pass
+            except Exception as e:
+                logger.error(f"Error warming the response cache: {e}")
+
+    def warm_next(self):
+        """Regenerate the most wanted missing answer; returns False when there is nothing (more) to do"""
+        now = time.monotonic()
+        # Capped at half the ttl so freshly warmed answers aren't candidates again right away
+        horizon = min(self.horizon, self.cache.ttl / 2)
+        candidate = next(
+            (candidate for candidate in self.cache.warm_candidates(self.min_asks, horizon, self.max_age)
+             if now - self._attempted.get(candidate[0], float('-inf')) >= self.cache.ttl),
+            None
+        )
+        if candidate is None:
+            return False
+        key, prompt, context = candidate
+
+        handle = self.generations.start_background(context)
+        if handle is None:
+            return False
+        start = time.perf_counter()
+        try:
+            result = self.generator.generate_response(context, prompt, handle)
+        finally:
+            self.generations.finish(handle)
+
+        if result is None:
+            metrics.incr("cache_warm_preempted")
+            return False
+        if not result["done"] or result["error"]:
+            # Don't retry answers that can't be cached until their ttl would have passed
+            self._attempted[key] = now
+            if len(self._attempted) > self.cache.history_size:
+                self._attempted.clear()
+            return True
+
+        self.cache.put(key, result["text"], warmed=True)
+        metrics.incr("cache_warmed")
+        metrics.observe("cache_warm", time.perf_counter() - start)
+        logger.info(f"Warmed cached answer for: {prompt[:60]}")
+        return True
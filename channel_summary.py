@@ -0,0 +1,154 @@
+"""
+Rolling summaries of channel activity
+
+Recent messages are kept per channel in a bounded ring buffer. Each channel
+has a rolling summary that is updated incrementally: an update only sends the
+model the previous summary plus the messages since the last update, and
+updates also run in the background every update_every messages. A "summarize"
+request therefore only has to fold in the last few messages, so its latency
+stays flat however busy the channel is.
+"""
+import logging
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+SUMMARIZE_COMMANDS = ['!summarize', 'summarize', 'summarise']
+
+INITIAL_PROMPT = (
+    "Summarize this chat conversation in a few sentences, covering the main "
+    "topics, questions and decisions:\n\n{messages}"
+)
+
+UPDATE_PROMPT = (
+    "Here is a summary of a chat conversation so far:\n\n{summary}\n\n"
+    "New messages since then:\n\n{messages}\n\n"
+    "Rewrite the summary in a few sentences to include the new messages, "
+    "keeping the main topics, questions and decisions."
+)
+
+STALE_NOTE = "(I couldn't include the latest messages just now.)"
+
+class _Channel:
+    __slots__ = ('messages', 'seen', 'summary', 'summarized', 'updating', 'lock')
+
+    def __init__(self, buffer_size):
+        self.messages = deque(maxlen=buffer_size)  # (sequence number, user, text)
+        self.seen = 0                              # Messages recorded so far
+        self.summary = ""
+        self.summarized = 0                        # Messages folded into the summary
+        self.updating = False                      # A background update is queued or running
+        self.lock = threading.Lock()               # Serializes summary updates
+
+class ChannelSummaries:
+    def __init__(self, config=None, complete=None):
+        self.complete = complete  # complete(prompt, max_tokens) -> text, or None on error
+        self._lock = threading.Lock()
+        self._channels = OrderedDict()  # key: channel, value: _Channel (LRU order)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="channel-summary")
+        self.configure(config)
+
+    def configure(self, config=None):
+        """Apply [summaries] settings, keeping buffered messages"""
+        config = config or {}
+        self.enabled = config.get('enabled', True)
+        self.buffer_size = config.get('buffer_size', 200)      # Messages kept per channel
+        self.max_channels = config.get('max_channels', 500)
+        self.update_every = config.get('update_every', 50)     # Background update interval, in messages
+        self.summary_tokens = config.get('summary_tokens', 300)
+        self.max_message_chars = config.get('max_message_chars', 500)
+
+    @staticmethod
+    def is_summarize(message):
+        """Check if a message is a summarize command"""
+        return message.lower().strip() in SUMMARIZE_COMMANDS
+
+    def record(self, channel, user, text):
+        """Add a channel message to the buffer"""
+        if not self.enabled or not text:
+            return
+
+        with self._lock:
+            state = self._channels.get(channel)
+            if state is None:
+                state = self._channels[channel] = _Channel(self.buffer_size)
+                while len(self._channels) > self.max_channels:
+                    self._channels.popitem(last=False)
+            self._channels.move_to_end(channel)
+
+            state.seen += 1
+            state.messages.append((state.seen, user, text[:self.max_message_chars]))
+            # A failed or slow update leaves more than update_every pending, so
+            # the next message after it tries again
+            start_update = self.update_every and not state.updating \
+                and state.seen - state.summarized >= self.update_every
+            if start_update:
+                state.updating = True
+
+        if start_update:
+            self._executor.submit(self._background_update, state)
+
+    def summarize(self, channel):
+        """Return the channel's summary, folding in any messages since the last update"""
+        with self._lock:
+            state = self._channels.get(channel)
+        if state is None:
+            return "I haven't seen any messages here yet."
+
+        summary = self._update(state)
+        if summary is None:
+            with self._lock:
+                summary = state.summary
+            if not summary:
+                return "Sorry, I couldn't summarize this channel right now."
+            return f"{summary}\n{STALE_NOTE}"
+        return summary or "I haven't seen any messages here yet."
+
+    def _background_update(self, state):
+        try:
+            self._update(state)
+        finally:
+            with self._lock:
+                state.updating = False
+
+    def _update(self, state):
+        """Fold messages received since the last update into the summary.
+
+        Returns the updated summary ("" if nothing has been said yet), or None
+        if the update failed and the previous summary was kept.
+        """
+        with state.lock:
+            with self._lock:
+                new_messages = [entry for entry in state.messages if entry[0] > state.summarized]
+                summary = state.summary
+            if not new_messages:
+                return summary
+
+            dropped = new_messages[0][0] - state.summarized - 1
+            lines = [f"<{user}> {text}" for _, user, text in new_messages]
+            if dropped > 0:
+                lines.insert(0, f"[{dropped} earlier messages not shown]")
+
+            template = UPDATE_PROMPT if summary else INITIAL_PROMPT
+            prompt = template.format(summary=summary, messages="\n".join(lines))
+            try:
+                updated = self.complete(prompt, self.summary_tokens)
+            except Exception as e:
+                logger.error(f"Error updating channel summary: {e}")
+                updated = None
+            if not updated:
+                logger.warning(f"Channel summary update failed, keeping the previous summary "
+                               f"({len(new_messages)} messages not folded in)")
+                metrics.incr("summary_update_failures")
+                return None
+            updated = updated.strip()
+
+            metrics.incr("summary_updates")
+            metrics.incr("summary_messages", len(new_messages))
+            with self._lock:
+                state.summary = updated
+                state.summarized = new_messages[-1][0]
+            return updated
@@ -0,0 +1,366 @@
+"""
+Continuation handling shared by the platform clients
+
+Long AI responses are split into platform-sized chunks. The rest of the text is
+stored per user and channel so it can be delivered with the 'continue' command.
+With lazy generation enabled only a small token budget is generated up front,
+and further text is generated from the stored Ollama context on 'continue'.
+With a durable state store, stored responses are also saved there so
+'continue' keeps working after a restart.
+
+When a platform's reply deadline passes before generation finishes, the text
+generated so far is sent as a partial reply and a placeholder is stored
+until the rest arrives, which 'continue' then delivers.
+"""
+import logging
+import time
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+CONTINUE_COMMANDS = ['continue', 'cont', 'more']
+CONTINUATION_MSG = " (say 'continue' for more)"
+PARTIAL_MSG = " (still generating, say 'continue' for the rest)"
+STILL_WORKING_MSG = "Still working on that one. Say 'continue' in a moment for the answer."
+PENDING_MSG = "Still generating the rest. Say 'continue' again in a moment."
+
+SUMMARY_PROMPT = (
+    "Summarize the following text, keeping names, numbers, errors and other "
+    "details someone might ask about:\n\n{text}"
+)
+
+def flatten_text(text):
+    """Collapse all whitespace, including newlines, into single spaces (IRC)"""
+    clean_text = text.replace('\r\n', ' ').replace('\r', ' ').replace('\n', ' ')
+    return ' '.join(clean_text.split())
+
+def normalize_lines(text):
+    """Normalize whitespace within lines but preserve newlines (Discord/Slack markdown)"""
+    clean_text = text.replace('\r\n', '\n').replace('\r', '\n')
+    lines = clean_text.split('\n')
+    clean_lines = [' '.join(line.split()) for line in lines]
+    return '\n'.join(clean_lines)
+
+class ContinuationStore:
+    def __init__(self, ollama_client, max_length, prepare=flatten_text,
+                 token_budget=200, lazy=False, max_tokens=500, router=None, scheduler=None, long_input=None,
+                 state=None):
+        self.ollama_client = ollama_client
+        self.router = router          # Optional ModelRouter picking the model per request
+        self.scheduler = scheduler    # Optional GenerationScheduler queueing requests by model
+        self.long_input = long_input  # Optional LongInputProcessor splitting very long prompts
+        self.state = state            # Optional state store that stored responses are saved to
+        self.max_length = max_length  # Platform message limit in characters
+        self.prepare = prepare        # Cleans/formats raw AI text for the platform
+        self.token_budget = token_budget
+        self.lazy = lazy
+        self.max_tokens = max_tokens
+
+        # key: "user@channel", value: {"raw_text": str, "full_text": str, "position": int,
+        #                              "client": backend client, "model": str,
+        #                              "context": list or None, "tokens": int, "delivered_tokens": int}
+        self.responses = {}
+
+    def configure(self, ollama_client, token_budget, lazy):
+        """Switch to a new Ollama client and budget, keeping stored responses"""
+        self.ollama_client = ollama_client
+        self.token_budget = token_budget
+        self.lazy = lazy
+
+    @staticmethod
+    def is_continue(message):
+        """Check if a message is a continue command"""
+        return message.lower().strip() in CONTINUE_COMMANDS
+
+    def has_response(self, user, context):
+        """Check whether user@context has a stored response to continue"""
+        return self._entry(f"{user}@{context}") is not None
+
+    def generate(self, user, context, prompt, handle=None):
+        """Generate a response for the prompt and return its first chunk.
+
+        Returns None if the generation was cancelled through its handle.
+        """
+        result = self.generate_response(context, prompt, handle)
+        if result is None:
+            return None
+        return self.first_chunk(user, context, result["text"], result["resume_context"], result["eval_count"],
+                                result["client"], result["model"])
+
+    def generate_response(self, context, prompt, handle=None):
+        """Route and generate a response without storing it.
+
+        Returns the backend's result dict plus "client", "model" and
+        "resume_context" (the Ollama context to continue from in lazy mode), or
+        None if the generation was cancelled through its handle.
+        """
+        if handle is not None and handle.cancelled:
+            return None  # Superseded before it even started
+
+        client, model = self.ollama_client, self.ollama_client.model
+        if self.router is not None:
+            client, model, prompt = self.router.route(prompt, context)
+
+        max_tokens = self.token_budget if self.lazy else self.max_tokens
+        result = self._complete(client, model, prompt, max_tokens, handle)
+        if isinstance(result, str):
+            # Rejected before generating
+            result = {"text": result, "context": None, "done": True, "eval_count": 0,
+                      "cancelled": False, "error": True}
+        else:
+            metrics.incr("requests")
+
+        if result["cancelled"]:
+            return None
+
+        # Only keep the Ollama context when there is more text left to generate
+        result["resume_context"] = result["context"] if self.lazy and not result["done"] else None
+        result["client"], result["model"] = client, model
+        return result
+
+    def complete(self, prompt, max_tokens=300):
+        """Generate text for an internal prompt with the default model, or None on error"""
+        client, model = self.ollama_client, self.ollama_client.model
+        result = self._complete(client, model, prompt, max_tokens)
+        if isinstance(result, str) or result["error"]:
+            return None
+        return result["text"]
+
+    def summarize(self, text, max_tokens=300):
+        """Summarize a text (such as a long attached file), or None on error"""
+        return self.complete(SUMMARY_PROMPT.format(text=text), max_tokens)
+
+    def _complete(self, client, model, prompt, max_tokens, handle=None):
+        """Generate for a prompt, splitting very long ones when long input mode is on.
+
+        Returns the result dict, or the message for the user if the prompt was rejected.
+        """
+        if self.long_input is not None and self.long_input.applies(client, prompt):
+            return self.long_input.run(
+                client, model, prompt, max_tokens,
+                lambda part, tokens, part_handle: self._timed_generate(client, model, part, tokens, handle=part_handle),
+                handle=handle
+            )
+
+        prompt, rejection = client.fit_prompt(prompt, model, max_tokens)
+        if rejection is not None:
+            return rejection
+        return self._timed_generate(client, model, prompt, max_tokens, handle=handle)
+
+    def _timed_generate(self, client, model, prompt, max_tokens, context=None, handle=None):
+        """Call the backend, recording per-model latency and token counts"""
+        def call():
+            start = time.perf_counter()
+            result = client.generate_partial(
+                prompt, max_tokens=max_tokens, context=context, handle=handle, model=model
+            )
+            if not result["cancelled"]:
+                metrics.observe(f"model_latency:{model}", time.perf_counter() - start)
+            return result
+
+        result = self.scheduler.run(model, call) if self.scheduler is not None else call()
+        metrics.incr("tokens_generated", result["eval_count"])
+        metrics.incr(f"model_tokens:{model}", result["eval_count"])
+        return result
+
+    def first_chunk(self, user, context, text, resume_context=None, tokens=0, client=None, model=None,
+                    full_text=None):
+        """Store a new response and return its first chunk.
+
+        full_text is the text already prepared for the platform, if it was.
+        """
+        key = f"{user}@{context}"
+        entry = {
+            "raw_text": text,
+            "full_text": full_text if full_text is not None else self.prepare(text),
+            "position": 0,
+            "client": client or self.ollama_client,
+            "model": model,
+            "context": resume_context,
+            "tokens": tokens,
+            "delivered_tokens": 0
+        }
+        self.responses[key] = entry
+        return self._take_chunk(key, entry)
+
+    def partial_chunk(self, user, context, text, full_text=None):
+        """Return the text generated so far as a partial reply, storing a placeholder
+        until complete_partial() stores the finished response.
+
+        full_text is the text already prepared for the platform, if it was.
+        """
+        key = f"{user}@{context}"
+        full_text = full_text if full_text is not None else self.prepare(text)
+        max_content_length = self.max_length - len(PARTIAL_MSG)
+        chunk = full_text[:max_content_length]
+        if len(full_text) > max_content_length and chunk.rfind(' ') > max_content_length - 50:
+            chunk = chunk[:chunk.rfind(' ')]
+        chunk = chunk.rstrip()
+
+        # Placeholders stay in memory: a restart loses the generation they wait for
+        self._forget(key)
+        self.responses[key] = {"pending": True, "sent": chunk}
+        metrics.incr("partial_replies")
+        if not chunk:
+            return STILL_WORKING_MSG
+        return f"{chunk}...{PARTIAL_MSG}"
+
+    def complete_partial(self, user, context, placeholder, result):
+        """Store the finished response behind a partial reply.
+
+        placeholder is the entry partial_chunk() stored, so a newer response
+        for user@context isn't overwritten; result is the generate_response()
+        result, or None if the generation was cancelled. Errors aren't
+        stored, so 'continue' never returns part of an error message.
+        """
+        key = f"{user}@{context}"
+        if self.responses.get(key) is not placeholder:
+            return
+        if result is None or result["error"]:
+            self.responses.pop(key, None)
+            return
+
+        full_text = self.prepare(result["text"])
+        sent = placeholder["sent"]
+        # Continue right after the partial reply (prepared text can differ slightly at the join)
+        position = len(sent) if full_text.startswith(sent) else min(len(sent), len(full_text))
+        entry = {
+            "raw_text": result["text"],
+            "full_text": full_text,
+            "position": position,
+            "client": result["client"] or self.ollama_client,
+            "model": result["model"],
+            "context": result["resume_context"],
+            "tokens": result["eval_count"],
+            "delivered_tokens": 0
+        }
+        self._record_delivery(entry)
+        self.responses[key] = entry
+        self._save(key, entry)
+
+    def next_chunk(self, user, context):
+        """Return the next chunk of the stored response for user@context"""
+        key = f"{user}@{context}"
+
+        entry = self._entry(key)
+        if entry is None:
+            return "No previous message to continue."
+        if entry.get("pending"):
+            return PENDING_MSG
+
+        # Top up the stored text so the next chunk is a full one where possible
+        max_content_length = self.max_length - len(CONTINUATION_MSG)
+        while entry["context"] and len(entry["full_text"]) - entry["position"] <= max_content_length:
+            result = self._generate_more(entry)
+            if result["error"]:
+                # The stored response is left as it was, so the next 'continue' tries again
+                return result["text"]
+            if not result["text"]:
+                break
+
+        if entry["position"] >= len(entry["full_text"]):
+            self._forget(key)
+            return "End of message reached."
+
+        return self._take_chunk(key, entry)
+
+    def _generate_more(self, entry):
+        """Resume generation from the stored Ollama context, returning the backend's result.
+
+        The entry is only extended when the result isn't an error.
+        """
+        # Resume on the backend and model that produced the stored context
+        result = self._timed_generate(
+            entry["client"], entry["model"], "", self.token_budget, context=entry["context"]
+        )
+
+        metrics.incr("lazy_continuations")
+        if result["error"]:
+            return result
+
+        # Re-prepare the whole text so whitespace at the join is handled consistently
+        entry["raw_text"] += result["text"]
+        entry["full_text"] = self.prepare(entry["raw_text"])
+        entry["context"] = result["context"] if not result["done"] else None
+        entry["tokens"] += result["eval_count"]
+        return result
+
+    def _take_chunk(self, key, entry):
+        """Cut the next chunk from an entry, updating its position"""
+        full_text = entry["full_text"]
+        start_pos = entry["position"]
+        # Don't start a chunk with the space left over from a word-boundary break
+        while start_pos < len(full_text) and full_text[start_pos] == ' ':
+            start_pos += 1
+        remaining_text = full_text[start_pos:]
+        max_content_length = self.max_length - len(CONTINUATION_MSG)
+        more_to_generate = entry["context"] is not None
+
+        if len(remaining_text) <= max_content_length:
+            entry["position"] = len(full_text)
+            self._record_delivery(entry)
+
+            if not more_to_generate:
+                # This is the last chunk, no need to keep it
+                self._forget(key)
+                return remaining_text
+
+            # Everything generated so far fits; more is generated on 'continue'
+            self._save(key, entry)
+            return f"{remaining_text}...{CONTINUATION_MSG}"
+
+        # Find a good break point (prefer ending at word boundary)
+        chunk_end = max_content_length - 3  # Reserve space for "..."
+
+        # Try to break at a word boundary
+        space_pos = remaining_text.rfind(' ', 0, chunk_end)
+        if space_pos > chunk_end - 50:  # Only use word boundary if it's not too far back
+            chunk_end = space_pos
+
+        entry["position"] = start_pos + chunk_end
+        self._record_delivery(entry)
+
+        chunk = remaining_text[:chunk_end] + "..."
+        self._save(key, entry)
+        return f"{chunk}{CONTINUATION_MSG}"
+
+    def _entry(self, key):
+        """Return the stored response for key, loading it from the state store if needed"""
+        entry = self.responses.get(key)
+        if entry is not None or self.state is None or not self.state.durable:
+            return entry
+
+        saved = self.state.get("continuations", key)
+        if saved is None:
+            return None
+        provider = saved.pop("provider")
+        clients = self.router.clients if self.router is not None else {}
+        saved["client"] = clients.get(provider, self.ollama_client)
+        self.responses[key] = saved
+        metrics.incr("continuations_restored")
+        return saved
+
+    def _save(self, key, entry):
+        """Save a stored response to the state store (written in the background)"""
+        if self.state is None or not self.state.durable:
+            return
+        # Clients can't be saved; remember which backend to resume on instead
+        clients = self.router.clients if self.router is not None else {}
+        provider = next((name for name, client in clients.items() if client is entry["client"]), None)
+        saved = {name: value for name, value in entry.items() if name != "client"}
+        saved["provider"] = provider
+        self.state.put("continuations", key, saved)
+
+    def _forget(self, key):
+        self.responses.pop(key, None)
+        if self.state is not None and self.state.durable:
+            self.state.delete("continuations", key)
+
+    def _record_delivery(self, entry):
+        """Attribute generated tokens to the text actually sent to the user"""
+        if not entry["full_text"]:
+            return
+        delivered = entry["tokens"] * entry["position"] // len(entry["full_text"])
+        if delivered > entry["delivered_tokens"]:
+            metrics.incr("tokens_delivered", delivered - entry["delivered_tokens"])
+            entry["delivered_tokens"] = delivered
@@ -2,44 +2,141 @@
 Discord client implementation for the AI bot
 """
 import discord
+from discord import app_commands
 from discord.ext import commands
 import asyncio
 import logging
-from ollama_client import OllamaClient
+import threading
+import time
+import requests
+from continuation import normalize_lines
+from attachments import Attachment
+from pipeline import Request
+from services import Services
+from outbound import RateLimited
+from metrics import metrics
 
 logger = logging.getLogger(__name__)
 
-class DiscordBot(commands.Bot):
+# Final responses for slash commands the pipeline didn't answer, by the stage that dropped them
+DROPPED_REPLIES = {
+    "filter": "I don't answer in this channel.",
+    "generate": "That request was cancelled.",
+}
+
+def fetch_shard_count(token):
+    """Ask Discord for the recommended number of shards for the bot"""
+    response = requests.get(
+        "https://discord.com/api/v10/gateway/bot",
+        headers={"Authorization": f"Bot {token}"},
+        timeout=10
+    )
+    response.raise_for_status()
+    return response.json()["shards"]
+
+def shard_range(index, processes, shard_count):
+    """The shard IDs run by process number index out of processes"""
+    return list(range(index * shard_count // processes, (index + 1) * shard_count // processes))
+
+class InteractionStream:
+    """Shows a slash command's answer as it is generated by editing the deferred response"""
+    def __init__(self, bot, interaction, interval):
+        self.bot = bot
+        self.interaction = interaction
+        self.interval = interval  # Seconds between edits, to stay under the webhook rate limit
+        self.parts = []
+        self.last_edit = 0.0
+        self.pending = None       # Future of the edit in flight
+        self._lock = threading.Lock()
+    
+    def __call__(self, piece):
+        """Record a streamed piece, editing the response if the last edit was long enough ago"""
+        with self._lock:
+            self.parts.append(piece)
+            now = time.monotonic()
+            if now - self.last_edit < self.interval or (self.pending is not None and not self.pending.done()):
+                return
+            self.last_edit = now
+            text = self.bot.services.continuations.prepare("".join(self.parts))
+            if len(text) > 1900:
+                self.interval = float('inf')  # The preview is full; the answer replaces it when done
+            self.pending = asyncio.run_coroutine_threadsafe(
+                self.interaction.edit_original_response(content=f"{text[:1900]} …"), self.bot.loop
+            )
+    
+    def wait(self, timeout=10):
+        """Wait for the edit in flight, so it can't overwrite the final answer"""
+        with self._lock:
+            pending, self.interval = self.pending, float('inf')
+        if pending is not None:
+            try:
+                pending.result(timeout=timeout)
+            except Exception as e:
+                logger.warning(f"Error updating interaction response: {e}")
+
+class DiscordBot(commands.AutoShardedBot):
     def __init__(self, config):
         self.config = config
         discord_config = config['discord']
         
-        # Set up bot intents
+        # Set up bot intents. Without the privileged message content intent the bot
+        # still sees DMs and mentions, and slash commands work regardless.
         intents = discord.Intents.default()
-        intents.message_content = True
+        intents.message_content = discord_config.get('message_content', True)
         intents.dm_messages = True
         
+        # With no shard_count Discord's recommended number of shards is used;
+        # shard_ids is set for each process when shard_processes splits them
+        self.shard_settings = (discord_config.get('shard_count', 0), discord_config.get('shard_ids'))
         super().__init__(
             command_prefix='!',
             intents=intents,
-            help_command=None
+            help_command=None,
+            shard_count=discord_config.get('shard_count', 0) or None,
+            shard_ids=discord_config.get('shard_ids'),
+            # Longer rate-limit waits raise instead, and the send queue reschedules the message
+            max_ratelimit_timeout=30.0
         )
         
+        # Processes sharing a state store may see the same channel names in
+        # different guilds, so their contexts are qualified with the guild ID
+        self.qualify_contexts = discord_config.get('shard_ids') is not None
+        
         self.bot_name = config['bot_name']
         self.token = discord_config['token']
         self.guild_id = discord_config.get('guild_id', None)
         self.allowed_channels = discord_config.get('channels', [])
-        
-        self.ollama_client = OllamaClient(
-            base_url=config['ollama']['base_url'],
-            model=config['ollama']['model']
+        self.slash_commands = discord_config.get('slash_commands', True)
+        self.stream_interval = discord_config.get('stream_interval', 1.5)  # Seconds between streamed edits
+        
+        self.services = Services(
+            config, 'discord',
+            max_length=1800,  # Discord has 2000 char limit
+            prepare=lambda text: normalize_lines(self.format_for_discord(text)),
+            token_budget=600,
+            send_limit=2000
         )
-        
-        # Store full responses for continuation
-        self.stored_responses = {}  # key: "user@channel", value: {"full_text": str, "position": int}
+        self.generations = self.services.generations
+        self.pipeline = self.services.build_pipeline(self, dispatch=self.dispatch_blocking)
         
         logger.info("Discord Bot initialized")
     
+    def apply_config(self, config):
+        """Apply a reloaded configuration without reconnecting"""
+        discord_config = config['discord']
+        
+        if discord_config['token'] != self.token:
+            logger.warning("Changing the Discord token requires a restart; keeping the current connection")
+        if (discord_config.get('shard_count', 0), discord_config.get('shard_ids')) != self.shard_settings:
+            logger.warning("Changing Discord sharding requires a restart")
+        
+        self.services.apply(config)
+        self.bot_name = config['bot_name']
+        self.guild_id = discord_config.get('guild_id', None)
+        self.allowed_channels = discord_config.get('channels', [])
+        self.stream_interval = discord_config.get('stream_interval', 1.5)
+        self.config = config
+    
     def format_for_discord(self, text):
         """Format AI response with Discord markdown"""
         if not text:
@@ -81,9 +178,93 @@ class DiscordBot(commands.Bot):
         
         return formatted_text
     
+    async def setup_hook(self):
+        """Register the slash commands before connecting"""
+        self.loop.create_task(self.report_shards())
+        if not self.slash_commands:
+            return
+        
+        @self.tree.command(name="ask", description="Ask the AI a question")
+        @app_commands.describe(prompt="Your question")
+        async def ask(interaction: discord.Interaction, prompt: str):
+            await self.submit_interaction(interaction, prompt)
+        
+        @self.tree.command(name="continue", description="Get the next part of the last answer")
+        async def continue_(interaction: discord.Interaction):
+            await self.submit_interaction(interaction, "continue")
+        
+        @self.tree.command(name="models", description="List available AI models")
+        async def models(interaction: discord.Interaction):
+            await interaction.response.defer()
+            # The catalog may have to ask the backend, so keep that off the event loop
+            models = await asyncio.get_running_loop().run_in_executor(None, self.services.ollama_client.catalog.models)
+            if models:
+                model_list = "\n".join(models)
+                await interaction.followup.send(f"Available models:\n```\n{model_list}\n```")
+            else:
+                await interaction.followup.send("No models available or AI service is down.")
+        
+        # Guild commands show up immediately; global ones can take up to an hour
+        if self.guild_id:
+            guild = discord.Object(id=self.guild_id)
+            self.tree.copy_global_to(guild=guild)
+            synced = await self.tree.sync(guild=guild)
+        else:
+            synced = await self.tree.sync()
+        logger.info(f"Registered {len(synced)} slash commands")
+    
+    async def submit_interaction(self, interaction, text):
+        """Acknowledge a slash command within Discord's 3 second limit, then run it through the pipeline"""
+        await interaction.response.defer(thinking=True)
+        
+        self.record_event(interaction.guild)
+        user = interaction.user.name
+        direct = isinstance(interaction.channel, discord.DMChannel)
+        context = user if direct else self.qualify(interaction.channel)
+        logger.info(f"Slash command from {user} in {context}: {text}")
+        
+        request = Request(
+            'discord', user, context, text, direct=direct, addressed=True,
+            message_id=interaction.id, raw=interaction
+        )
+        request.stream = InteractionStream(self, interaction, self.stream_interval)
+        self.pipeline.submit(request)
+    
+    def qualify(self, channel):
+        """The pipeline context for a guild channel"""
+        return f"{channel.guild.id}/{channel.name}" if self.qualify_contexts else channel.name
+    
+    def record_event(self, guild):
+        """Count an event handled by the guild's shard (DMs arrive on shard 0)"""
+        metrics.incr(f"discord_events:{guild.shard_id if guild is not None else 0}")
+    
+    async def report_shards(self, interval=30):
+        """Publish each shard's heartbeat latency and event rate as gauges"""
+        last_counts = {}
+        while not self.is_closed():
+            await asyncio.sleep(interval)
+            for shard_id, latency in self.latencies:
+                if latency == latency and latency != float('inf'):  # NaN or inf until the first heartbeat
+                    metrics.set_gauge(f"discord_shard_latency:{shard_id}", latency)
+                count = metrics.get(f"discord_events:{shard_id}")
+                metrics.set_gauge(f"discord_event_rate:{shard_id}", (count - last_counts.get(shard_id, 0)) / interval)
+                last_counts[shard_id] = count
+    
+    async def on_shard_ready(self, shard_id):
+        logger.info(f"Discord shard {shard_id} ready")
+        metrics.set_gauge(f"discord_shard_connected:{shard_id}", 1)
+    
+    async def on_shard_resumed(self, shard_id):
+        metrics.set_gauge(f"discord_shard_connected:{shard_id}", 1)
+    
+    async def on_shard_disconnect(self, shard_id):
+        logger.warning(f"Discord shard {shard_id} disconnected")
+        metrics.set_gauge(f"discord_shard_connected:{shard_id}", 0)
+        metrics.incr(f"discord_shard_disconnects:{shard_id}")
+    
     async def on_ready(self):
         """Called when bot is ready"""
-        logger.info(f'{self.user} has connected to Discord!')
+        logger.info(f'{self.user} has connected to Discord with {len(self.shards)} shards!')
         
         if self.guild_id:
             guild = discord.utils.get(self.guilds, id=self.guild_id)
@@ -99,200 +280,104 @@ class DiscordBot(commands.Bot):
         )
     
     async def on_message(self, message):
-        """Handle incoming messages"""
+        """Turn incoming messages into pipeline requests"""
         # Ignore messages from the bot itself
         if message.author == self.user:
             return
         
+        self.record_event(message.guild)
+        user = message.author.name
+        attachments = [
+            Attachment(attachment.id, attachment.filename, attachment.url, attachment.size, attachment.content_type)
+            for attachment in message.attachments
+        ]
+        
         # Handle DMs
         if isinstance(message.channel, discord.DMChannel):
-            await self.handle_dm(message)
+            logger.info(f"DM from {user}: {message.content}")
+            self.pipeline.submit(Request(
+                'discord', user, user, message.content, direct=True,
+                message_id=message.id, attachments=attachments, raw=message
+            ))
             return
         
-        # Handle mentions in guild channels
-        if self.user.mentioned_in(message) or self.is_mentioned(message.content):
-            # Check if channel is allowed (if restriction is set)
-            if self.allowed_channels and message.channel.name not in self.allowed_channels:
-                return
-            
-            await self.handle_mention(message)
-        
-        # Process commands
-        await self.process_commands(message)
+        # Remove Discord mentions of the bot
+        content = message.content.replace(f'<@{self.user.id}>', '').replace(f'<@!{self.user.id}>', '')
+        self.pipeline.submit(Request(
+            'discord', user, self.qualify(message.channel), content,
+            addressed=True if self.user.mentioned_in(message) else None,
+            message_id=message.id, attachments=attachments, raw=message
+        ))
+        
+        # Run registered commands (!ping, !models); !stats, !summarize and other
+        # pipeline commands aren't registered and would log CommandNotFound
+        ctx = await self.get_context(message)
+        if ctx.valid:
+            await self.invoke(ctx)
     
-    def is_mentioned(self, content):
-        """Check if bot is mentioned in message content"""
-        content_lower = content.lower()
-        bot_name_lower = self.bot_name.lower()
-        
-        mentions = [
-            f"{bot_name_lower}:",
-            f"{bot_name_lower},",
-            f"{bot_name_lower} ",
-            f"@{bot_name_lower}",
-            bot_name_lower
-        ]
-        
-        return any(mention in content_lower for mention in mentions)
+    def channel_allowed(self, context):
+        """Check if channel is allowed (if restriction is set)"""
+        return not self.allowed_channels or context.rsplit('/', 1)[-1] in self.allowed_channels
     
-    def clean_message(self, content):
-        """Remove bot mentions and clean up the message"""
-        # Remove Discord mentions
-        clean_content = content
-        # Check if user ID is in the content (mentions)
-        if f'<@{self.user.id}>' in content or f'<@!{self.user.id}>' in content:
-            clean_content = clean_content.replace(f'<@{self.user.id}>', '')
-            clean_content = clean_content.replace(f'<@!{self.user.id}>', '')
-        
-        # Remove text mentions
-        content_lower = content.lower()
-        bot_name_lower = self.bot_name.lower()
-        
-        patterns_to_remove = [
-            f"{bot_name_lower}:",
-            f"{bot_name_lower},",
-            f"@{bot_name_lower}",
-            bot_name_lower
-        ]
-        
-        for pattern in patterns_to_remove:
-            clean_content = clean_content.replace(pattern, "", 1)
-            clean_content = clean_content.replace(pattern.title(), "", 1)
-            clean_content = clean_content.replace(pattern.upper(), "", 1)
-        
-        return clean_content.strip()
-    
-    async def handle_dm(self, message):
-        """Handle direct messages"""
-        user = message.author
-        content = message.content.strip()
-        
-        logger.info(f"DM from {user}: {content}")
-        
-        # Check for continue command
-        if content.lower() in ['continue', 'cont', 'more']:
-            await self.handle_continue(message, user.name, user.name)  # DM context
+    def send(self, request, text):
+        """Queue a reply for the channel the message came from, or as a slash command's response"""
+        if isinstance(request.raw, discord.Interaction):
+            interaction, stream = request.raw, request.stream
+            self.services.outbound.put(f"interaction:{interaction.id}",
+                                       lambda text: self.deliver_interaction(interaction, stream, text), text,
+                                       mergeable=False)
             return
         
-        # Generate AI response
+        message = request.raw
+        if not request.direct:
+            text = f"{message.author.mention}: {text}"
+        self.services.outbound.put(message.channel.id, lambda text: self.deliver(message.channel, text), text)
+    
+    def dropped(self, request, stage):
+        """Settle a slash command's deferred response when the pipeline drops its request"""
+        if isinstance(request.raw, discord.Interaction):
+            self.send(request, DROPPED_REPLIES.get(stage, "There's nothing for me to answer there."))
+    
+    def deliver(self, channel, text):
+        """Send a message on the event loop, waiting for it from a send queue thread"""
         try:
-            full_response = self.ollama_client.generate_full_response(content)
-            formatted_response = self.format_for_discord(full_response)
-            chunked_response = self.get_first_chunk(formatted_response, user.name, user.name)
-            await message.channel.send(chunked_response)
-            logger.info(f"Sent DM response to {user}")
-        except Exception as e:
-            logger.error(f"Error handling DM: {e}")
-            await message.channel.send("Sorry, I encountered an error processing your message.")
+            asyncio.run_coroutine_threadsafe(channel.send(text), self.loop).result(timeout=60)
+        except discord.RateLimited as e:
+            raise RateLimited(e.retry_after)
     
-    async def handle_mention(self, message):
-        """Handle mentions in channels"""
-        user = message.author
-        content = self.clean_message(message.content)
-        channel = message.channel
-        
-        # Check if the cleaned message is a continue command
-        if content.lower().strip() in ['continue', 'cont', 'more']:
-            logger.info(f"Continue command from {user} in {channel}")
-            await self.handle_continue(message, user.name, channel.name)
-            return
-        
-        logger.info(f"Mentioned in {channel} by {user}: {content}")
-        
-        # Generate AI response
+    def deliver_interaction(self, interaction, stream, text):
+        """Replace a deferred (or streamed) slash command response with the answer"""
+        stream.wait()
         try:
-            full_response = self.ollama_client.generate_full_response(content)
-            formatted_response = self.format_for_discord(full_response)
-            chunked_response = self.get_first_chunk(formatted_response, user.name, channel.name)
-            await message.channel.send(f"{user.mention}: {chunked_response}")
-            logger.info(f"Sent mention response in {channel}")
-        except Exception as e:
-            logger.error(f"Error handling mention: {e}")
-            await message.channel.send(f"{user.mention}: Sorry, I encountered an error processing your message.")
+            asyncio.run_coroutine_threadsafe(
+                interaction.edit_original_response(content=text), self.loop
+            ).result(timeout=60)
+        except discord.RateLimited as e:
+            raise RateLimited(e.retry_after)
     
-    def get_first_chunk(self, full_text, user, context):
-        """Get the first chunk of text and store the rest for continuation"""
-        key = f"{user}@{context}"
-        
-        # Preserve markdown formatting - don't collapse newlines
-        clean_text = full_text.replace('\r\n', '\n').replace('\r', '\n')
-        # Only normalize excessive whitespace within lines
-        lines = clean_text.split('\n')
-        clean_lines = [' '.join(line.split()) for line in lines]
-        clean_text = '\n'.join(clean_lines)
-        
-        # Reserve space for the continuation message
-        continuation_msg = " (say 'continue' for more)"
-        max_content_length = 1800 - len(continuation_msg)  # Discord has 2000 char limit
-        
-        if len(clean_text) <= max_content_length:
-            # Text fits in one message, no need to store
-            if key in self.stored_responses:
-                del self.stored_responses[key]
-            return clean_text
-        
-        # Find a good break point (prefer ending at word boundary)
-        chunk_end = max_content_length - 3  # Reserve space for "..."
-        
-        # Try to break at a word boundary
-        space_pos = clean_text.rfind(' ', 0, chunk_end)
-        if space_pos > chunk_end - 50:  # Only use word boundary if it's not too far back
-            chunk_end = space_pos
-        
-        # Store full text for continuation
-        self.stored_responses[key] = {
-            "full_text": clean_text,
-            "position": chunk_end
-        }
-        
-        # Return first chunk with continuation indicator
-        first_chunk = clean_text[:chunk_end] + "..."
-        return f"{first_chunk}{continuation_msg}"
+    def dispatch_blocking(self, fn):
+        """Run generation off the event loop"""
+        asyncio.get_running_loop().run_in_executor(None, fn)
     
-    async def handle_continue(self, message, user, context):
-        """Handle continue requests"""
-        key = f"{user}@{context}"
-        
-        if key not in self.stored_responses:
-            response = "No previous message to continue."
-        else:
-            stored = self.stored_responses[key]
-            full_text = stored["full_text"]
-            start_pos = stored["position"]
-            
-            if start_pos >= len(full_text):
-                response = "End of message reached."
-                del self.stored_responses[key]
-            else:
-                # Get next chunk
-                remaining_text = full_text[start_pos:]
-                continuation_msg = " (say 'continue' for more)"
-                max_content_length = 1800 - len(continuation_msg)
-                
-                if len(remaining_text) <= max_content_length:
-                    # This is the last chunk
-                    response = remaining_text
-                    del self.stored_responses[key]
-                else:
-                    # More chunks remain - find good break point
-                    chunk_end = max_content_length - 3  # Reserve space for "..."
-                    
-                    # Try to break at word boundary
-                    space_pos = remaining_text.rfind(' ', 0, chunk_end)
-                    if space_pos > chunk_end - 50:  # Only use word boundary if it's not too far back
-                        chunk_end = space_pos
-                    
-                    chunk = remaining_text[:chunk_end] + "..."
-                    self.stored_responses[key]["position"] = start_pos + chunk_end
-                    response = f"{chunk}{continuation_msg}"
-        
-        # Send continuation response
-        if context == user:  # DM
-            await message.channel.send(response)
-        else:  # Channel
-            await message.channel.send(f"{message.author.mention}: {response}")
-        
-        logger.info(f"Sent continuation to {user} in {context}")
+    async def on_raw_message_delete(self, payload):
+        """Cancel the generation for a deleted message"""
+        self.generations.cancel_message(payload.message_id)
+    
+    async def on_member_remove(self, member):
+        """Cancel generations for members leaving the server"""
+        self.generations.cancel_where("left", user=member.name)
+    
+    def shutdown(self, grace):
+        """Drain in-flight requests for up to grace seconds, then close (any thread but the event loop's)"""
+        self.services.drain(grace)
+        # close() flushes the send queue and closes the state store
+        asyncio.run_coroutine_threadsafe(self.close(), self.loop).result(timeout=60)
+    
+    async def close(self):
+        """Cancel in-flight generations before closing the connection"""
+        # Queued replies are delivered through this loop, so wait for them off it
+        await asyncio.get_running_loop().run_in_executor(None, self.services.close)
+        await super().close()
     
     @commands.command(name='ping')
     async def ping(self, ctx):
@@ -302,7 +387,7 @@ class DiscordBot(commands.Bot):
     @commands.command(name='models')
     async def list_models(self, ctx):
         """List available AI models"""
-        models = self.ollama_client.list_models()
+        models = self.services.ollama_client.catalog.models()
         if models:
             model_list = "\\n".join(models)
             await ctx.send(f"Available models:\\n```\\n{model_list}\\n```")
@@ -0,0 +1,86 @@
+"""
+Tracking of in-flight generations so they can be cancelled
+
+Each user has at most one generation per channel/DM. A new question from the
+same user supersedes the previous one, and the platform clients cancel
+generations when the triggering message is deleted, the user leaves, or the
+bot disconnects or shuts down. Background generations (cache warming) only
+start while nothing else runs and are cancelled as soon as a user's
+generation starts.
+"""
+import threading
+import time
+from llm_client import GenerationHandle
+
+class ActiveGenerations:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._handles = {}  # key: "user@channel", value: GenerationHandle
+        self._background = set()
+        self.last_started = 0.0  # monotonic time a user's generation last started
+
+    def __len__(self):
+        with self._lock:
+            return len(self._handles)
+
+    def start(self, user, context, message_id=None):
+        """Register a new generation, cancelling any it supersedes"""
+        handle = GenerationHandle(user, context, message_id)
+        key = f"{user}@{context}"
+
+        with self._lock:
+            previous = self._handles.get(key)
+            self._handles[key] = handle
+            self.last_started = time.monotonic()
+            background, self._background = self._background, set()
+
+        if previous is not None:
+            previous.cancel("superseded")
+        for other in background:
+            other.cancel("preempted")
+        return handle
+
+    def start_background(self, context):
+        """Register a low-priority generation, or return None if users' generations are running"""
+        handle = GenerationHandle(None, context)
+        with self._lock:
+            if self._handles:
+                return None
+            self._background.add(handle)
+        return handle
+
+    def finish(self, handle):
+        """Forget a generation once it has completed or been cancelled"""
+        key = f"{handle.user}@{handle.context}"
+        with self._lock:
+            self._background.discard(handle)
+            if self._handles.get(key) is handle:
+                del self._handles[key]
+
+    def cancel_message(self, message_id, reason="deleted"):
+        """Cancel the generation triggered by a specific message"""
+        return self._cancel(lambda handle: handle.message_id == message_id, reason)
+
+    def cancel_where(self, reason, user=None, context=None, context_prefix=None):
+        """Cancel generations for a user and/or channel (None matches any)"""
+        return self._cancel(
+            lambda handle: (user is None or handle.user == user)
+            and (context is None or handle.context == context)
+            and (context_prefix is None or str(handle.context).startswith(context_prefix)),
+            reason
+        )
+
+    def cancel_all(self, reason="shutdown"):
+        """Cancel every in-flight generation, including background ones"""
+        with self._lock:
+            background, self._background = self._background, set()
+        for handle in background:
+            handle.cancel(reason)
+        return self._cancel(lambda handle: True, reason)
+
+    def _cancel(self, predicate, reason):
+        with self._lock:
+            matching = [key for key, handle in self._handles.items() if predicate(handle)]
+            handles = [self._handles.pop(key) for key in matching]
+
+        return sum(1 for handle in handles if handle.cancel(reason))
@@ -0,0 +1,150 @@
+"""
+Backend health monitoring and circuit breaking
+
+Each backend client has a CircuitBreaker fed by its requests and by the
+background HealthMonitor's probes. After failure_threshold consecutive
+failures the breaker opens and requests fail fast instead of waiting on a
+backend that is down or hanging. Once reset_timeout has passed it goes
+half-open: probes (and one trial request at a time) get through, and after
+success_threshold consecutive successes it closes again.
+"""
+import logging
+import threading
+import time
+import weakref
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=3, reset_timeout=30, success_threshold=2):
+        self.name = name
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._successes = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self.configure(failure_threshold, reset_timeout, success_threshold)
+
+    def configure(self, failure_threshold=3, reset_timeout=30, success_threshold=2):
+        """Apply [health] breaker settings"""
+        with self._lock:
+            self.failure_threshold = max(1, failure_threshold)
+            self.reset_timeout = reset_timeout
+            self.success_threshold = max(1, success_threshold)
+
+    @property
+    def state(self):
+        with self._lock:
+            self._check_reset()
+            return self._state
+
+    def allow_request(self):
+        """Check whether a request may be sent to the backend"""
+        with self._lock:
+            self._check_reset()
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+
+        metrics.incr(f"circuit_rejected:{self.name}")
+        return False
+
+    def record_success(self):
+        """Record a successful request or probe"""
+        with self._lock:
+            self._check_reset()
+            self._trial_in_flight = False
+            self._failures = 0
+            if self._state == HALF_OPEN:
+                self._successes += 1
+                if self._successes >= self.success_threshold:
+                    self._set_state(CLOSED)
+
+    def record_failure(self):
+        """Record a failed request or probe"""
+        with self._lock:
+            self._check_reset()
+            self._trial_in_flight = False
+            self._failures += 1
+            if self._state == HALF_OPEN or (self._state == CLOSED and self._failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                self._set_state(OPEN)
+                metrics.incr(f"circuit_opened:{self.name}")
+
+    def _check_reset(self):
+        # Caller holds the lock
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._set_state(HALF_OPEN)
+
+    def _set_state(self, state):
+        # Caller holds the lock
+        logger.warning(f"Circuit breaker for {self.name} {self._state} -> {state}")
+        self._state = state
+        self._successes = 0
+        self._trial_in_flight = False
+        metrics.set_gauge(f"circuit_open:{self.name}", int(state != CLOSED))
+
+class HealthMonitor:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients = weakref.WeakSet()  # Clients replaced on reload drop out on their own
+        self._wake = threading.Event()
+        self._thread = None
+        self.configure({})
+
+    def configure(self, config):
+        """Apply [health] settings to the monitor and every watched client's breaker"""
+        with self._lock:
+            self.enabled = config.get('enabled', True)
+            self.interval = config.get('interval', 10)
+            self.probe_timeout = config.get('probe_timeout', 2)
+            self.breaker_settings = {
+                'failure_threshold': config.get('failure_threshold', 3),
+                'reset_timeout': config.get('reset_timeout', 30),
+                'success_threshold': config.get('success_threshold', 2),
+            }
+            clients = list(self._clients)
+
+        for client in clients:
+            client.breaker.configure(**self.breaker_settings)
+        # Wake the monitor so a new interval applies right away
+        self._wake.set()
+
+    def watch(self, client):
+        """Start tracking a backend client's health"""
+        client.breaker.configure(**self.breaker_settings)
+        with self._lock:
+            self._clients.add(client)
+
+    def start(self):
+        """Start probing watched clients in the background"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="health-monitor", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if not self.enabled:
+                continue
+
+            with self._lock:
+                clients = list(self._clients)
+            for client in clients:
+                # A probe that fails records the failure, which is what opens the breaker
+                # when the backend is down even if no requests are coming in
+                client.probe(timeout=self.probe_timeout)
+
+# Shared monitor for all backend clients
+health_monitor = HealthMonitor()
@@ -1,228 +1,280 @@
 """
 IRC client implementation for the AI bot
 """
-import irc.bot
-import irc.strings
-import threading
+import irc.client
+import socket
+import ssl
 import logging
 import time
 import random
-from ollama_client import OllamaClient
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from continuation import flatten_text
+from pipeline import Request
+from services import Services
+from metrics import metrics
 
 logger = logging.getLogger(__name__)
 
-class IRCBot(irc.bot.SingleServerIRCBot):
+def network_settings(irc_config):
+    """Settings for each network, keyed by name.
+
+    A plain [irc] section is a single network named after its server. With
+    [irc.networks.<name>] sections, each network's settings fall back to the
+    ones in [irc].
+    """
+    networks = irc_config.get('networks')
+    if not networks:
+        return {irc_config['server']: irc_config}
+    
+    defaults = {key: value for key, value in irc_config.items() if key != 'networks'}
+    return {name: {**defaults, **settings} for name, settings in networks.items()}
+
+class IRCNetwork:
+    """One IRC server connection with its own channels, nick and flood settings"""
+    def __init__(self, name, settings, connection, prefix=""):
+        self.name = name
+        self.connection = connection
+        self.prefix = prefix  # Qualifies channel names when several networks are configured
+        self.is_connected = False
+        self.reconnect_attempts = 0
+        self.reconnect_scheduled = False
+        self.connecting = None  # Token of the connect attempt in progress
+        self.rejoins_scheduled = set()  # Channels waiting to be rejoined after a kick
+        self.awaiting_pong = False
+        
+        # Outgoing messages are paced so the server doesn't kick the bot for flooding
+        self.outbox = deque()
+        self.send_tokens = 0.0
+        self.send_refilled = time.monotonic()
+        self.pump_scheduled = False
+        
+        self.configure(settings)
+    
+    def configure(self, settings):
+        """Apply the network's settings (server changes take effect on the next connect)"""
+        self.server = settings['server']
+        self.port = settings['port']
+        self.nickname = settings['nickname']
+        self.realname = settings.get('realname', self.nickname)
+        self.password = settings.get('password')
+        self.ssl = settings.get('ssl', False)
+        self.channels = settings['channels']
+        self.flood_rate = settings.get('flood_rate', 2.0)    # Sustained messages per second
+        self.flood_burst = settings.get('flood_burst', 4)    # Messages sent back to back
+        self.rejoin_delay = settings.get('rejoin_delay', 30)  # Seconds to wait before rejoining after a kick
+        self.connect_timeout = settings.get('connect_timeout', 10)  # Seconds to wait for a connection
+        self.send_tokens = min(self.send_tokens, self.flood_burst)
+    
+    def connect(self, sock):
+        """Connect (or reconnect) to the network's server over an already open socket (reactor thread)"""
+        self.connection.connect(
+            self.server, self.port, self.nickname, self.password,
+            ircname=self.realname, connect_factory=lambda address: sock
+        )
+    
+    def open_socket(self):
+        """Resolve the server and open its socket, giving up after connect_timeout.
+        
+        This blocks, so it runs on a connect thread rather than the shared
+        reactor thread.
+        """
+        sock = socket.create_connection((self.server, self.port), timeout=self.connect_timeout)
+        try:
+            if self.ssl:
+                sock = ssl.create_default_context().wrap_socket(sock, server_hostname=self.server)
+        except OSError:
+            sock.close()
+            raise
+        # The reactor only reads once select() says there is data
+        sock.settimeout(None)
+        return sock
+    
+    def qualify(self, name):
+        """The pipeline context for a channel or nick on this network"""
+        return f"{self.prefix}{name}"
+    
+    def report(self):
+        """Publish the network's connection state as gauges"""
+        metrics.set_gauge(f"irc_connected:{self.name}", int(self.is_connected))
+        metrics.set_gauge(f"irc_reconnect_attempt:{self.name}", self.reconnect_attempts)
+        metrics.set_gauge(f"irc_outbox:{self.name}", len(self.outbox))
+
+class IRCBot(irc.client.SimpleIRCClient):
     def __init__(self, config):
         self.config = config
         irc_config = config['irc']
         
-        # Initialize IRC connection
-        self.server = irc_config['server']
-        self.port = irc_config['port']
-        self.nickname = irc_config['nickname']
+        super().__init__()
         
-        super().__init__([(self.server, self.port)], self.nickname, self.nickname)
+        # All networks share this reactor (and its one thread), the backend
+        # clients and the generation workers
+        settings = network_settings(irc_config)
+        prefixed = 'networks' in irc_config
+        self.networks = {}
+        self._by_connection = {}  # key: ServerConnection, value: IRCNetwork
+        for index, (name, network_config) in enumerate(settings.items()):
+            connection = self.connection if index == 0 else self.reactor.server()
+            network = IRCNetwork(name, network_config, connection, f"{name}/" if prefixed else "")
+            self.networks[name] = network
+            self._by_connection[connection] = network
         
-        self.channel_list = irc_config['channels']
         self.bot_name = config['bot_name']
-        self.ollama_client = OllamaClient(
-            base_url=config['ollama']['base_url'],
-            model=config['ollama']['model']
+        
+        # Generation runs on worker threads so the reactor keeps processing
+        # events (and can cancel superseded generations) while Ollama decodes
+        self.services = Services(config, 'irc', max_length=400, prepare=flatten_text, token_budget=200,
+                                 file_input=False)
+        self.generations = self.services.generations
+        self.executor = ThreadPoolExecutor(
+            max_workers=irc_config.get('max_workers', 4),
+            thread_name_prefix='irc-generate'
         )
         
-        # Store full responses for continuation
-        self.stored_responses = {}  # key: "user@channel", value: {"full_text": str, "position": int}
+        # Parsing and commands run on the reactor thread; generation runs on the executor
+        # (which waits on the worker processes when [workers] is enabled)
+        self.pipeline = self.services.build_pipeline(self, dispatch=self.executor.submit)
         
         # Reconnection settings
         self.reconnect_enabled = True
-        self.reconnect_attempts = 0
         self.max_reconnect_attempts = 10
         self.base_reconnect_delay = 5  # Base delay in seconds
         self.max_reconnect_delay = 300  # Max delay in seconds (5 minutes)
-        self.is_connected = False
         self.should_stop = False
         
-        logger.info(f"IRC Bot initialized for {self.server}:{self.port} as {self.nickname}")
+        # Reconnects, rejoins and keepalives are timers on the reactor's
+        # scheduler, so they never block event processing or start threads
+        self.keepalive_interval = irc_config.get('keepalive', 60)
+        self.reactor.scheduler.execute_every(self.keepalive_interval, self._keepalive)
+        
+        for network in self.networks.values():
+            logger.info(f"IRC network {network.name}: {network.server}:{network.port} as {network.nickname}")
+    
+    def apply_config(self, config):
+        """Apply a reloaded configuration without reconnecting"""
+        irc_config = config['irc']
+        settings = network_settings(irc_config)
+        
+        if set(settings) != set(self.networks):
+            logger.warning("Adding or removing IRC networks requires a restart; keeping the current ones")
+        
+        self.services.apply(config)
+        self.bot_name = config['bot_name']
+        self.config = config
+        
+        for name, network_config in settings.items():
+            network = self.networks.get(name)
+            if network is None:
+                continue
+            if (network_config['server'], network_config['port']) != (network.server, network.port):
+                logger.warning(f"Changing the server of {name} takes effect when it reconnects")
+            
+            old_channels = set(network.channels)
+            with self.reactor.mutex:
+                network.configure(network_config)
+            new_channels = set(network.channels)
+            
+            if not network.is_connected:
+                continue  # on_welcome joins the new channel list
+            
+            def update_channels(network=network, joined=new_channels - old_channels, left=old_channels - new_channels):
+                for channel in joined:
+                    network.connection.join(channel)
+                    logger.info(f"Joined channel: {channel} on {network.name}")
+                for channel in left:
+                    network.connection.part(channel)
+                    self.generations.cancel_where("left", context=network.qualify(channel))
+                    logger.info(f"Left channel: {channel} on {network.name}")
+            
+            with self.reactor.mutex:
+                self.reactor.scheduler.execute_after(0, update_channels)
     
     def on_welcome(self, connection, event):
         """Called when bot successfully connects to IRC server"""
-        logger.info("Connected to IRC server")
-        self.is_connected = True
-        self.reconnect_attempts = 0  # Reset reconnect attempts on successful connection
-        
-        for channel in self.channel_list:
+        network = self._by_connection[connection]
+        logger.info(f"Connected to IRC network {network.name}")
+        network.is_connected = True
+        network.reconnect_attempts = 0  # Reset reconnect attempts on successful connection
+        network.awaiting_pong = False
+        network.report()
+        
+        for channel in network.channels:
             connection.join(channel)
-            logger.info(f"Joined channel: {channel}")
+            logger.info(f"Joined channel: {channel} on {network.name}")
     
     def on_privmsg(self, connection, event):
         """Handle private messages"""
+        network = self._by_connection[connection]
         sender = event.source.nick
         message = event.arguments[0].strip() if event.arguments else ""
         
-        logger.info(f"Private message from {sender}: {message}")
-        
-        # Check for continue command
-        if message.lower() in ['continue', 'cont', 'more']:
-            self.handle_continue(connection, sender, sender)  # DM context
-            return
-        
-        # Generate AI response
-        full_response = self.ollama_client.generate_full_response(message)
-        chunked_response = self.get_first_chunk(full_response, sender, sender)
-        
-        # Send response back as private message
-        connection.privmsg(sender, chunked_response)
-        logger.info(f"Sent private response to {sender}")
+        logger.info(f"Private message from {sender} on {network.name}: {message}")
+        self.pipeline.submit(Request(
+            'irc', sender, network.qualify(sender), message, direct=True, raw=(network, sender, sender),
+            scope=network.prefix
+        ))
     
     def on_pubmsg(self, connection, event):
         """Handle public channel messages"""
+        network = self._by_connection[connection]
         sender = event.source.nick
         channel = event.target
         message = event.arguments[0].strip() if event.arguments else ""
         
-        # Check for simple continue command (no mention)
-        if message.lower() in ['continue', 'cont', 'more']:
-            self.handle_continue(connection, sender, channel)
-            return
+        self.pipeline.submit(Request(
+            'irc', sender, network.qualify(channel), message, raw=(network, channel, sender), scope=network.prefix
+        ))
+    
+    def on_ctcp(self, connection, event):
+        """Reply to CTCP VERSION and PING requests"""
+        nick = event.source.nick
+        if event.arguments[0] == "VERSION":
+            connection.ctcp_reply(nick, f"VERSION {self.bot_name}")
+        elif event.arguments[0] == "PING" and len(event.arguments) > 1:
+            connection.ctcp_reply(nick, f"PING {event.arguments[1]}")
+    
+    def channel_allowed(self, context):
+        """The bot only hears the channels it joined"""
+        return True
+    
+    def send(self, request, text):
+        """Send a pipeline reply to the user, or to the channel addressed to them"""
+        network, target, nick = request.raw
+        if request.direct:
+            self.send_message(network, nick, text)
+        else:
+            self.send_message(network, target, f"{nick}: {text}")
+        logger.info(f"Sent response to {request.user} in {request.context}")
+    
+    def send_message(self, network, target, text):
+        """Queue a message from any thread; the reactor sends it at the network's flood rate"""
+        with self.reactor.mutex:
+            network.outbox.append((target, text))
+            if not network.pump_scheduled:
+                network.pump_scheduled = True
+                self.reactor.scheduler.execute_after(0, lambda: self._pump(network))
+    
+    def _pump(self, network):
+        """Send queued messages within the flood limit, rescheduling for the rest (reactor thread)"""
+        now = time.monotonic()
+        network.send_tokens = min(network.flood_burst,
+                                  network.send_tokens + (now - network.send_refilled) * network.flood_rate)
+        network.send_refilled = now
+        
+        while network.outbox and network.send_tokens >= 1:
+            target, text = network.outbox.popleft()
+            network.send_tokens -= 1
+            try:
+                network.connection.privmsg(target, text)
+            except irc.client.ServerNotConnectedError:
+                logger.warning(f"Not connected to {network.name}, dropped message to {target}")
         
-        # Check if bot is mentioned
-        if self.is_mentioned(message):
-            # Remove bot name from message
-            clean_message = self.clean_message(message)
-            
-            # Check if the cleaned message is a continue command
-            if clean_message.lower().strip() in ['continue', 'cont', 'more']:
-                logger.info(f"Continue command from {sender} in {channel}")
-                self.handle_continue(connection, sender, channel)
-                return
-            
-            logger.info(f"Mentioned in {channel} by {sender}: {clean_message}")
-            
-            # Generate AI response
-            full_response = self.ollama_client.generate_full_response(clean_message)
-            chunked_response = self.get_first_chunk(full_response, sender, channel)
-            
-            # Send response to channel
-            connection.privmsg(channel, f"{sender}: {chunked_response}")
-            logger.info(f"Sent public response in {channel}")
-    
-    def is_mentioned(self, message):
-        """Check if the bot is mentioned in the message"""
-        message_lower = message.lower()
-        bot_name_lower = self.bot_name.lower()
-        
-        # Check for various mention patterns
-        mentions = [
-            f"{bot_name_lower}:",
-            f"{bot_name_lower},",
-            f"{bot_name_lower} ",
-            f"@{bot_name_lower}",
-            bot_name_lower
-        ]
-        
-        return any(mention in message_lower for mention in mentions)
-    
-    def clean_message(self, message):
-        """Remove bot name and clean up the message"""
-        message_lower = message.lower()
-        bot_name_lower = self.bot_name.lower()
-        
-        # Remove common mention patterns
-        patterns_to_remove = [
-            f"{bot_name_lower}:",
-            f"{bot_name_lower},",
-            f"@{bot_name_lower}",
-            bot_name_lower
-        ]
-        
-        clean_msg = message
-        for pattern in patterns_to_remove:
-            clean_msg = clean_msg.replace(pattern, "", 1)
-            clean_msg = clean_msg.replace(pattern.title(), "", 1)
-            clean_msg = clean_msg.replace(pattern.upper(), "", 1)
-        
-        return clean_msg.strip()
-    
-    def get_first_chunk(self, full_text, user, context):
-        """Get the first chunk of text and store the rest for continuation"""
-        key = f"{user}@{context}"
-        
-        # Clean the text for IRC
-        clean_text = full_text.replace('\r\n', ' ').replace('\r', ' ').replace('\n', ' ')
-        clean_text = ' '.join(clean_text.split())
-        
-        # Reserve space for the continuation message
-        continuation_msg = " (say 'continue' for more)"
-        max_content_length = 400 - len(continuation_msg)
-        
-        if len(clean_text) <= max_content_length:
-            # Text fits in one message, no need to store
-            if key in self.stored_responses:
-                del self.stored_responses[key]
-            return clean_text
-        
-        # Find a good break point (prefer ending at word boundary)
-        chunk_end = max_content_length - 3  # Reserve space for "..."
-        
-        # Try to break at a word boundary
-        space_pos = clean_text.rfind(' ', 0, chunk_end)
-        if space_pos > chunk_end - 50:  # Only use word boundary if it's not too far back
-            chunk_end = space_pos
-        
-        # Store full text for continuation
-        self.stored_responses[key] = {
-            "full_text": clean_text,
-            "position": chunk_end
-        }
-        
-        # Return first chunk with continuation indicator
-        first_chunk = clean_text[:chunk_end] + "..."
-        return f"{first_chunk}{continuation_msg}"
-    
-    def handle_continue(self, connection, user, context):
-        """Handle continue requests"""
-        key = f"{user}@{context}"
-        
-        if key not in self.stored_responses:
-            response = "No previous message to continue."
+        if network.outbox:
+            self.reactor.scheduler.execute_after((1 - network.send_tokens) / network.flood_rate,
+                                                 lambda: self._pump(network))
         else:
-            stored = self.stored_responses[key]
-            full_text = stored["full_text"]
-            start_pos = stored["position"]
-            
-            if start_pos >= len(full_text):
-                response = "End of message reached."
-                del self.stored_responses[key]
-            else:
-                # Get next chunk
-                remaining_text = full_text[start_pos:]
-                continuation_msg = " (say 'continue' for more)"
-                max_content_length = 400 - len(continuation_msg)
-                
-                if len(remaining_text) <= max_content_length:
-                    # This is the last chunk
-                    response = remaining_text
-                    del self.stored_responses[key]
-                else:
-                    # More chunks remain - find good break point
-                    chunk_end = max_content_length - 3  # Reserve space for "..."
-                    
-                    # Try to break at word boundary
-                    space_pos = remaining_text.rfind(' ', 0, chunk_end)
-                    if space_pos > chunk_end - 50:  # Only use word boundary if it's not too far back
-                        chunk_end = space_pos
-                    
-                    chunk = remaining_text[:chunk_end] + "..."
-                    self.stored_responses[key]["position"] = start_pos + chunk_end
-                    response = f"{chunk}{continuation_msg}"
-        
-        # Send continuation response
-        if context == user:  # DM
-            connection.privmsg(user, response)
-        else:  # Channel
-            connection.privmsg(context, f"{user}: {response}")
-        
-        logger.info(f"Sent continuation to {user} in {context}")
+            network.pump_scheduled = False
     
     def on_error(self, connection, event):
         """Handle IRC errors"""
@@ -230,93 +282,220 @@ class IRCBot(irc.bot.SingleServerIRCBot):
     
     def on_disconnect(self, connection, event):
         """Handle disconnection and attempt reconnection"""
-        self.is_connected = False
-        logger.warning("Disconnected from IRC server")
+        network = self._by_connection[connection]
+        network.is_connected = False
+        network.rejoins_scheduled.clear()
+        network.report()
+        logger.warning(f"Disconnected from IRC network {network.name}")
+        
+        # Replies can't be delivered any more, so stop decoding them
+        self.generations.cancel_where("disconnect", context_prefix=network.prefix)
         
         if self.should_stop:
             logger.info("Bot is shutting down, not attempting reconnection")
             return
-            
-        if self.reconnect_enabled and self.reconnect_attempts < self.max_reconnect_attempts:
-            self.attempt_reconnect()
-        else:
-            logger.error(f"Max reconnection attempts ({self.max_reconnect_attempts}) reached. Giving up.")
+        
+        self.attempt_reconnect(network)
     
-    def attempt_reconnect(self):
-        """Attempt to reconnect with exponential backoff"""
-        self.reconnect_attempts += 1
+    def attempt_reconnect(self, network):
+        """Schedule a reconnection with exponential backoff"""
+        if network.reconnect_scheduled:
+            return
+        if not self.reconnect_enabled or network.reconnect_attempts >= self.max_reconnect_attempts:
+            logger.error(f"Max reconnection attempts ({self.max_reconnect_attempts}) reached for {network.name}. "
+                         "Giving up.")
+            return
+        
+        network.reconnect_attempts += 1
+        network.reconnect_scheduled = True
+        network.report()
         
         # Calculate delay with exponential backoff and jitter
         delay = min(
-            self.base_reconnect_delay * (2 ** (self.reconnect_attempts - 1)),
+            self.base_reconnect_delay * (2 ** (network.reconnect_attempts - 1)),
             self.max_reconnect_delay
         )
         # Add jitter to avoid thundering herd
         delay += random.uniform(0, min(delay * 0.1, 10))
         
-        logger.info(f"Attempting reconnection #{self.reconnect_attempts} in {delay:.1f} seconds...")
-        time.sleep(delay)
+        logger.info(f"Attempting reconnection #{network.reconnect_attempts} to {network.name} in {delay:.1f} seconds...")
+        self.reactor.scheduler.execute_after(delay, lambda: self._reconnect(network))
+    
+    def _reconnect(self, network):
+        """Reconnect a network (reactor thread)"""
+        network.reconnect_scheduled = False
+        if self.should_stop or network.is_connected or network.connecting:
+            return
         
+        metrics.incr(f"irc_reconnects:{network.name}")
+        self.connect_network(network)
+        logger.info("Reconnection attempt initiated")
+    
+    def connect_network(self, network):
+        """Start connecting a network without blocking the reactor (reactor thread).
+        
+        Name lookup and the TCP/TLS handshake run on a connect thread, which
+        hands the open socket back to the reactor. Name lookup has no timeout
+        of its own, so the reactor gives up on the attempt after
+        connect_timeout.
+        """
+        attempt = object()
+        network.connecting = attempt
+        threading.Thread(
+            target=self._open_socket, args=(network, attempt),
+            name=f"irc-connect-{network.name}", daemon=True
+        ).start()
+        self.reactor.scheduler.execute_after(network.connect_timeout,
+                                             lambda: self._connect_timed_out(network, attempt))
+    
+    def _open_socket(self, network, attempt):
+        """Open the network's socket and pass it to the reactor (connect thread)"""
         try:
-            # Recreate the connection
-            self.connection.reconnect()
-            logger.info("Reconnection attempt initiated")
-        except Exception as e:
-            logger.error(f"Reconnection attempt #{self.reconnect_attempts} failed: {e}")
-            if self.reconnect_attempts < self.max_reconnect_attempts:
-                # Schedule another attempt
-                threading.Timer(1.0, self.attempt_reconnect).start()
-            else:
-                logger.error("All reconnection attempts exhausted")
+            sock, error = network.open_socket(), None
+        except OSError as e:
+            sock, error = None, e
+        with self.reactor.mutex:
+            self.reactor.scheduler.execute_after(0, lambda: self._socket_opened(network, attempt, sock, error))
+    
+    def _socket_opened(self, network, attempt, sock, error):
+        """Register a freshly opened socket with the reactor, or retry after an error (reactor thread)"""
+        if network.connecting is not attempt or self.should_stop:
+            # The attempt timed out or the bot is stopping
+            if sock is not None:
+                sock.close()
+            return
+        network.connecting = None
+        
+        if error is None:
+            try:
+                network.connect(sock)
+                return
+            except irc.client.ServerConnectionError as e:
+                error = e
+        self._connect_failed(network, error)
+    
+    def _connect_timed_out(self, network, attempt):
+        """Give up on a connect attempt that is still resolving or connecting (reactor thread)"""
+        if network.connecting is not attempt:
+            return
+        network.connecting = None
+        self._connect_failed(network, f"no connection after {network.connect_timeout}s")
+    
+    def _connect_failed(self, network, error):
+        """Log a failed connect attempt and schedule the next one (reactor thread)"""
+        if network.reconnect_attempts:
+            logger.error(f"Reconnection attempt #{network.reconnect_attempts} to {network.name} failed: {error}")
+        else:
+            logger.error(f"Error connecting to {network.name}: {error}")
+        self.attempt_reconnect(network)
+    
+    def _keepalive(self):
+        """Ping each connected network, dropping connections that stopped answering (reactor thread)"""
+        for network in self.networks.values():
+            network.report()
+            if not network.is_connected:
+                continue
+            if network.awaiting_pong:
+                # No reply to the last ping: the connection is dead even if the socket isn't closed
+                logger.warning(f"No reply from {network.name} in {self.keepalive_interval}s, reconnecting")
+                metrics.incr(f"irc_ping_timeouts:{network.name}")
+                network.connection.disconnect("Ping timeout")
+                continue
+            network.awaiting_pong = True
+            network.connection.ping("keep-alive")
+    
+    def on_pong(self, connection, event):
+        """The server answered our keepalive"""
+        self._by_connection[connection].awaiting_pong = False
     
     def on_nicknameinuse(self, connection, event):
         """Handle nickname already in use"""
-        alternative_nick = f"{self.nickname}_{random.randint(100, 999)}"
-        logger.warning(f"Nickname {self.nickname} in use, trying {alternative_nick}")
+        network = self._by_connection[connection]
+        alternative_nick = f"{network.nickname}_{random.randint(100, 999)}"
+        logger.warning(f"Nickname {network.nickname} in use on {network.name}, trying {alternative_nick}")
         connection.nick(alternative_nick)
     
+    def on_part(self, connection, event):
+        """Cancel generations for users leaving a channel"""
+        network = self._by_connection[connection]
+        self.generations.cancel_where("left", user=event.source.nick, context=network.qualify(event.target))
+    
+    def on_quit(self, connection, event):
+        """Cancel generations for users quitting IRC"""
+        network = self._by_connection[connection]
+        self.generations.cancel_where("left", user=event.source.nick, context_prefix=network.prefix)
+    
     def on_kick(self, connection, event):
         """Handle being kicked from a channel"""
+        network = self._by_connection[connection]
         channel = event.target
         kicker = event.source.nick
-        reason = event.arguments[0] if event.arguments else "No reason given"
+        reason = event.arguments[1] if len(event.arguments) > 1 else "No reason given"
+        
+        # The first argument is the kicked nick: cancel that user's generations,
+        # or all of the channel's if it was us, since we can't reply until we rejoin
+        kicked = event.arguments[0] if event.arguments else None
+        if kicked != connection.get_nickname():
+            self.generations.cancel_where("left", user=kicked, context=network.qualify(channel))
+            return
         
-        logger.warning(f"Kicked from {channel} by {kicker}: {reason}")
+        logger.warning(f"Kicked from {channel} on {network.name} by {kicker}: {reason}")
+        self.generations.cancel_where("left", context=network.qualify(channel))
         
         # Wait a bit then try to rejoin
-        def rejoin_after_kick():
-            time.sleep(30)  # Wait 30 seconds before attempting to rejoin
-            if self.is_connected:
-                try:
-                    connection.join(channel)
-                    logger.info(f"Attempted to rejoin {channel} after being kicked")
-                except Exception as e:
-                    logger.error(f"Failed to rejoin {channel}: {e}")
-        
-        threading.Thread(target=rejoin_after_kick, daemon=True).start()
+        if channel not in network.rejoins_scheduled:
+            network.rejoins_scheduled.add(channel)
+            self.reactor.scheduler.execute_after(network.rejoin_delay, lambda: self._rejoin(network, channel))
+    
+    def _rejoin(self, network, channel):
+        """Rejoin a channel we were kicked from (reactor thread)"""
+        if channel not in network.rejoins_scheduled:
+            return  # Disconnected in the meantime; on_welcome joins the channels again
+        network.rejoins_scheduled.discard(channel)
+        if network.is_connected and channel in network.channels:
+            network.connection.join(channel)
+            metrics.incr(f"irc_rejoins:{network.name}")
+            logger.info(f"Attempted to rejoin {channel} on {network.name} after being kicked")
     
     def stop_bot(self):
         """Gracefully stop the bot"""
         self.should_stop = True
         self.reconnect_enabled = False
-        if hasattr(self, 'connection') and self.connection.is_connected():
-            self.connection.quit("Bot shutting down")
+        self.services.close()
+        for network in self.networks.values():
+            if network.connection.is_connected():
+                network.connection.quit("Bot shutting down")
         logger.info("Bot stop requested")
     
+    def shutdown(self, grace):
+        """Drain in-flight requests for up to grace seconds, deliver their replies, then stop (any thread)"""
+        self.services.drain(grace)
+        
+        # The reactor sends the queued replies at each network's flood rate
+        deadline = time.monotonic() + 10
+        while any(network.outbox and network.is_connected for network in self.networks.values()) \
+                and time.monotonic() < deadline:
+            time.sleep(0.1)
+        with self.reactor.mutex:
+            self.reactor.scheduler.execute_after(0, self.stop_bot)
+    
     def start_bot(self):
-        """Start the IRC bot with reconnection handling"""
+        """Connect to every network and run the shared reactor"""
+        logger.info("Starting IRC bot...")
+        for network in self.networks.values():
+            self.connect_network(network)
+        
         while not self.should_stop:
             try:
-                logger.info("Starting IRC bot...")
-                self.start()
+                self.reactor.process_once(timeout=0.2)
             except KeyboardInterrupt:
                 logger.info("Bot interrupted by user")
                 self.stop_bot()
                 break
             except Exception as e:
-                logger.error(f"Error starting IRC bot: {e}")
+                logger.error(f"Error in IRC event loop: {e}")
                 if not self.should_stop and self.reconnect_enabled:
-                    logger.info("Attempting to restart bot after error...")
+                    logger.info("Restarting IRC event loop after error...")
                     time.sleep(self.base_reconnect_delay)
                     continue
                 else:
@@ -0,0 +1,308 @@
+"""
+Shared HTTP plumbing for AI model backends
+
+BaseClient implements the request flow every provider uses: pooled HTTP
+connections, streaming with cancellation, timeouts, circuit breaking,
+user-facing error messages, prompt budgeting against the model's context
+window and per-provider metrics. Providers (OllamaClient, OpenAICompatibleClient)
+only describe how to build requests and parse responses.
+"""
+import json
+import logging
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+import requests
+from requests.adapters import HTTPAdapter
+from health import CLOSED, CircuitBreaker, health_monitor
+from metrics import metrics
+from model_catalog import ModelCatalog
+
+logger = logging.getLogger(__name__)
+
+# Tokens reserved for the chat template wrapped around the prompt
+PROMPT_OVERHEAD_TOKENS = 32
+
+DEFAULT_OPTIONS = {"temperature": 0.7}
+
+def estimate_tokens(text, chars_per_token=4):
+    """Rough token count for a text, without running the model's tokenizer"""
+    return math.ceil(len(text) / chars_per_token)
+
+class GenerationHandle:
+    """Handle for an in-flight streamed generation that can be cancelled from another thread"""
+    def __init__(self, user=None, context=None, message_id=None):
+        self.user = user
+        self.context = context
+        self.message_id = message_id
+        self.cancelled = False
+        self.cancel_reason = None
+        self.on_text = None  # Called with each streamed piece of text, e.g. to show progress
+        self._response = None
+        self._lock = threading.Lock()
+
+    def attach(self, response):
+        """Attach the streaming HTTP response so cancel() can abort it"""
+        with self._lock:
+            self._response = response
+            cancelled = self.cancelled
+        if cancelled:
+            response.close()
+
+    def cancel(self, reason="cancelled"):
+        """Cancel the generation, returning False if it was already cancelled"""
+        with self._lock:
+            if self.cancelled:
+                return False
+            self.cancelled = True
+            self.cancel_reason = reason
+            response = self._response
+
+        # Closing the stream drops the connection, which makes the backend stop decoding
+        if response is not None:
+            response.close()
+
+        metrics.incr("generations_cancelled")
+        metrics.incr(f"generations_cancelled_{reason}")
+        logger.info(f"Generation for {self.user}@{self.context} cancelled ({reason})")
+        return True
+
+class BaseClient(ABC):
+    provider = "base"           # Short name used in metrics
+    provider_name = "AI"        # Name used in log messages
+    health_path = "/"           # GET endpoint that answers 200 when the service is up
+
+    def __init__(self, base_url, model, timeout=30, pool_size=10, options=None, model_options=None,
+                 catalog_ttl=60, prompt_overflow="truncate", chars_per_token=4):
+        self.base_url = base_url.rstrip('/')
+        self.model = model
+        self.timeout = timeout
+        self.options = {**DEFAULT_OPTIONS, **(options or {})}
+        self.model_options = model_options or {}
+        self.prompt_overflow = prompt_overflow  # "truncate" or "reject"
+        self.chars_per_token = chars_per_token
+
+        # Reuse connections across requests instead of opening one per call
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.breaker = CircuitBreaker(f"{self.provider}@{self.base_url}")
+        health_monitor.watch(self)
+        self.catalog = ModelCatalog(self, ttl=catalog_ttl)
+
+    def options_for(self, model):
+        """Generation options for a model: the section's options plus its model_options overrides.
+
+        keep_alive is returned with the options but sent as a top-level field.
+        """
+        return {**self.options, **self.model_options.get(model, {})}
+
+    def token_limit(self, options, max_tokens):
+        """Tokens to request: max_tokens, capped by a configured num_predict or max_tokens"""
+        limit = options.get("max_tokens", options.get("num_predict"))
+        if limit is not None and limit > 0:
+            return min(max_tokens, limit)
+        return max_tokens
+
+    def _headers(self):
+        """Extra HTTP headers for every request"""
+        return {}
+
+    @abstractmethod
+    def _build_request(self, prompt, max_tokens, context, model, stream):
+        """Return (path, payload) for a generation request"""
+
+    @abstractmethod
+    def _parse_response(self, data):
+        """Parse a non-streamed response into text, context, done and eval_count"""
+
+    @abstractmethod
+    def _parse_stream_line(self, line):
+        """Parse one streamed line, returning (text piece, final fields or None, finished)"""
+
+    def probe(self, timeout=5):
+        """Check the AI service's health endpoint, recording the result in the circuit breaker"""
+        try:
+            response = self.session.get(f"{self.base_url}{self.health_path}", headers=self._headers(), timeout=timeout)
+            healthy = response.status_code == 200
+        except requests.RequestException as e:
+            logger.error(f"{self.provider_name} service not available: {e}")
+            healthy = False
+
+        if healthy:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+        return healthy
+
+    def is_available(self):
+        """Check the cached health state, without a network round trip"""
+        return self.breaker.state == CLOSED
+
+    def generate_partial(self, prompt, max_tokens=500, context=None, handle=None, model=None):
+        """Generate up to max_tokens, returning the text plus the context for resuming.
+
+        Returns a dict with "text", "context", "done" (False when generation stopped
+        at the token limit), "eval_count", "cancelled" and "error" (True when "text"
+        is an error message for the user). "context" is only set by
+        backends that can resume a generation. Passing a GenerationHandle streams
+        the response so it can be cancelled. The model defaults to the client's.
+        """
+        result = {"text": "", "context": None, "done": True, "eval_count": 0, "cancelled": False, "error": False}
+
+        if handle is not None and handle.cancelled:
+            result["cancelled"] = True
+            return result
+
+        if not self.breaker.allow_request():
+            result["text"] = "Sorry, the AI service is currently unavailable. Please try again in a minute."
+            result["error"] = True
+            return result
+
+        stream = handle is not None
+        path, payload = self._build_request(prompt, max_tokens, context, model or self.model, stream)
+
+        metrics.incr(f"provider_requests:{self.provider}")
+        start = time.perf_counter()
+
+        try:
+            response = self.session.post(
+                f"{self.base_url}{path}",
+                json=payload,
+                headers=self._headers(),
+                timeout=self.timeout,
+                stream=stream
+            )
+
+            # Server errors count against the backend's health; client errors
+            # (such as an unknown model) mean it answered fine
+            if response.status_code >= 500:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+
+            if response.status_code == 200:
+                if stream:
+                    result.update(self._read_stream(response, handle, start))
+                    result["cancelled"] = handle.cancelled
+                else:
+                    result.update(self._parse_response(response.json()))
+            else:
+                logger.error(f"{self.provider_name} API error: {response.status_code}")
+                metrics.incr(f"provider_errors:{self.provider}")
+                result["text"] = "Sorry, there was an error processing your request."
+                result["error"] = True
+
+        except requests.RequestException as e:
+            logger.error(f"Error calling {self.provider_name} API: {e}")
+            metrics.incr(f"provider_errors:{self.provider}")
+            self.breaker.record_failure()
+            result["text"] = "Sorry, I couldn't connect to the AI service."
+            result["error"] = True
+        except json.JSONDecodeError as e:
+            logger.error(f"Error parsing {self.provider_name} response: {e}")
+            metrics.incr(f"provider_errors:{self.provider}")
+            result["text"] = "Sorry, there was an error processing the AI response."
+            result["error"] = True
+
+        if not result["cancelled"]:
+            metrics.observe(f"provider_latency:{self.provider}", time.perf_counter() - start)
+        return result
+
+    def _read_stream(self, response, handle, start):
+        """Read a streamed response, stopping early if the handle is cancelled"""
+        handle.attach(response)
+        parts = []
+        fields = {}
+        try:
+            for line in response.iter_lines():
+                if handle.cancelled:
+                    break
+                if not line:
+                    continue
+                piece, final_fields, finished = self._parse_stream_line(line)
+                if piece:
+                    if not parts:
+                        metrics.observe(f"time_to_first_token:{self.provider}", time.perf_counter() - start)
+                    parts.append(piece)
+                    if handle.on_text is not None:
+                        handle.on_text(piece)
+                if final_fields:
+                    fields.update(final_fields)
+                if finished:
+                    break
+        except Exception:
+            # Reading from a stream closed by cancel() fails in various ways
+            if not handle.cancelled:
+                raise
+        finally:
+            response.close()
+
+        fields["text"] = "".join(parts)
+        # Fall back to counting streamed pieces if the backend didn't report usage
+        fields.setdefault("eval_count", len(parts))
+        return fields
+
+    def fit_prompt(self, prompt, model, max_tokens):
+        """Trim or reject a prompt that won't fit the model's context window.
+
+        Returns (prompt, None) when the prompt can be sent, possibly trimmed, or
+        (None, message for the user) when it is rejected.
+        """
+        window = self.context_window(model)
+        if not window:
+            return prompt, None
+
+        budget = window - max_tokens - PROMPT_OVERHEAD_TOKENS
+        estimated = estimate_tokens(prompt, self.chars_per_token)
+        if estimated <= budget:
+            return prompt, None
+
+        if self.prompt_overflow == "reject" or budget <= 0:
+            metrics.incr("prompts_rejected")
+            return None, (f"Sorry, that message is too long for {model} "
+                          f"(about {estimated} tokens, the limit is {max(budget, 0)}).")
+
+        # The backend would drop the excess anyway, after spending time on it
+        logger.info(f"Trimming prompt for {model} from about {estimated} to {budget} tokens")
+        metrics.incr("prompts_truncated")
+        return prompt[:budget * self.chars_per_token].rstrip(), None
+
+    def context_window(self, model):
+        """Tokens of context the backend will use for a model, or None if unknown"""
+        return self.catalog.context_length(model)
+
+    def show_model(self, model):
+        """Metadata for a model, such as "context_length" in tokens"""
+        return {}
+
+    def generate_full_response(self, prompt, max_tokens=500):
+        """Generate full response from the model without truncation"""
+        return self.generate_partial(prompt, max_tokens=max_tokens)["text"]
+
+    def generate_response(self, prompt, max_tokens=500):
+        """Generate response from the model"""
+        raw_response = self.generate_full_response(prompt, max_tokens=max_tokens)
+        # Clean up the response for IRC compatibility
+        clean_response = raw_response.replace('\r\n', ' ').replace('\r', ' ').replace('\n', ' ')
+        # Remove extra spaces
+        clean_response = ' '.join(clean_response.split())
+        # Truncate if too long for IRC (max ~400 chars to be safe)
+        if len(clean_response) > 400:
+            clean_response = clean_response[:397] + "..."
+        return clean_response
+
+    def list_models(self):
+        """List available models"""
+        return []
+
+    def running_models(self):
+        """List models currently loaded in memory, or None if unknown"""
+        return None
+
+    def get_available_models(self):
+        """Alias for list_models() - returns list of available models"""
+        return self.list_models()
@@ -0,0 +1,187 @@
+"""
+Map-reduce handling of very long user inputs
+
+A long paste (a log, a document) sent as one prompt makes the backend spend a
+long time on prompt evaluation while other users wait, and may not fit the
+model's context window at all. With [long_input] enabled, such inputs are
+split into context-sized pieces that are condensed in parallel (map), and the
+condensed notes are answered in one final request (reduce).
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from llm_client import PROMPT_OVERHEAD_TOKENS, estimate_tokens
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REQUEST = "Summarize this text and point out anything important."
+
+MAP_PROMPT = (
+    "The user sent a long text with this request: {request}\n\n"
+    "Here is part {index} of {count} of the text:\n\n{chunk}\n\n"
+    "Write brief notes on everything in this part that is relevant to the request."
+)
+
+REDUCE_PROMPT = (
+    "The user sent a long text with this request: {request}\n\n"
+    "It was read in {count} parts. Notes on each part:\n\n{notes}\n\n"
+    "Using these notes, respond to the user's request."
+)
+
+# First words that mark a line as an instruction rather than part of the pasted text
+REQUEST_WORDS = {
+    "analyze", "analyse", "can", "check", "compare", "could", "describe", "explain", "extract", "find",
+    "fix", "give", "how", "is", "list", "please", "review", "rewrite", "summarize", "summarise", "tell",
+    "translate", "what", "what's", "when", "where", "which", "who", "why", "would",
+}
+
+def looks_like_request(line):
+    """Whether a line reads like a question or instruction to the bot"""
+    if not line or len(line) > 300:
+        return False
+    words = line.lower().split()
+    return line.endswith('?') or words[0].strip(',:') in REQUEST_WORDS
+
+def split_request(prompt):
+    """Separate the user's request from the pasted text.
+
+    A question or instruction on the last line, or failing that the first,
+    is taken as the request; otherwise the whole input is text to summarize.
+    """
+    lines = prompt.strip().split('\n')
+    if len(lines) > 1:
+        first, last = lines[0].strip(), lines[-1].strip()
+        if looks_like_request(last):
+            return last, '\n'.join(lines[:-1])
+        if looks_like_request(first):
+            return first, '\n'.join(lines[1:])
+    return DEFAULT_REQUEST, prompt
+
+def split_text(text, max_chars):
+    """Split text into chunks of at most max_chars, breaking between lines where possible"""
+    chunks = []
+    current = ""
+    for line in text.split('\n'):
+        while len(line) > max_chars:
+            # A single line longer than a chunk has to be cut
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(line[:max_chars])
+            line = line[max_chars:]
+        if current and len(current) + 1 + len(line) > max_chars:
+            chunks.append(current)
+            current = line
+        else:
+            current = f"{current}\n{line}" if current else line
+    if current.strip():
+        chunks.append(current)
+    return [chunk for chunk in chunks if chunk.strip()]
+
+class LongInputProcessor:
+    def __init__(self, config=None):
+        self._executor = None
+        self.parallel = 0
+        self.configure(config)
+
+    def configure(self, config=None):
+        """Apply [long_input] settings"""
+        config = config or {}
+        self.enabled = config.get('enabled', False)
+        self.min_tokens = config.get('min_tokens', 2000)      # Inputs above this are split
+        self.chunk_tokens = config.get('chunk_tokens', 1500)  # Upper bound on each piece
+        self.max_chunks = config.get('max_chunks', 8)         # Fan-out limit per input
+        self.map_tokens = config.get('map_tokens', 200)       # Note length per piece
+
+        parallel = max(1, config.get('parallel', 2))          # Pieces processed at once
+        if parallel != self.parallel:
+            previous = self._executor
+            self._executor = ThreadPoolExecutor(max_workers=parallel, thread_name_prefix="long-input")
+            self.parallel = parallel
+            if previous is not None:
+                previous.shutdown(wait=False)
+
+    def applies(self, client, prompt):
+        """Check whether a prompt should be split"""
+        return self.enabled and estimate_tokens(prompt, client.chars_per_token) > self.min_tokens
+
+    def run(self, client, model, prompt, max_tokens, generate, handle=None):
+        """Answer a long prompt with a parallel map step and a final reduce step.
+
+        generate(prompt, max_tokens, handle) performs one backend request and
+        returns its result dict; the reduce step's result is returned. If a
+        piece fails or is cancelled, that piece's result is returned instead
+        and nothing is reduced.
+        """
+        start = time.perf_counter()
+        request, text = split_request(prompt)
+        window = client.context_window(model)
+
+        # Each piece has to fit the context window next to the instructions and its notes
+        chunk_tokens = self.chunk_tokens
+        if window:
+            overhead = estimate_tokens(MAP_PROMPT + request, client.chars_per_token) + PROMPT_OVERHEAD_TOKENS
+            chunk_tokens = max(1, min(chunk_tokens, window - self.map_tokens - overhead))
+        chunks = split_text(text, chunk_tokens * client.chars_per_token)
+
+        if len(chunks) > self.max_chunks:
+            logger.warning(f"Long input has {len(chunks)} pieces, only reading the first {self.max_chunks}")
+            metrics.incr("long_input_truncated")
+            chunks = chunks[:self.max_chunks]
+
+        # Keep the combined notes small enough for the reduce prompt
+        map_tokens = self.map_tokens
+        if window:
+            share = (window - max_tokens - PROMPT_OVERHEAD_TOKENS) // (len(chunks) + 1)
+            map_tokens = min(map_tokens, max(32, share))
+
+        metrics.incr("long_input_requests")
+        metrics.incr("long_input_chunks", len(chunks))
+        logger.info(f"Splitting long input into {len(chunks)} pieces for {model}")
+
+        futures = [
+            self._executor.submit(self._map, generate, request, index, len(chunks), chunk, map_tokens, handle)
+            for index, chunk in enumerate(chunks, start=1)
+        ]
+        notes = []
+        for future in futures:
+            result = future.result()
+            if result["error"] or result["cancelled"]:
+                # An error message or a cancelled piece must not become notes for the reduce step
+                for pending in futures:
+                    pending.cancel()
+                if result["error"]:
+                    metrics.incr("long_input_failed")
+                return result
+            notes.append(result["text"].strip())
+        metrics.observe("long_input_map_stage", time.perf_counter() - start)
+
+        if handle is not None and handle.cancelled:
+            return {"text": "", "context": None, "done": True, "eval_count": 0, "cancelled": True, "error": False}
+
+        reduce_prompt = REDUCE_PROMPT.format(
+            request=request,
+            count=len(chunks),
+            notes="\n\n".join(f"Part {index}: {note}" for index, note in enumerate(notes, start=1))
+        )
+        reduce_prompt, rejection = client.fit_prompt(reduce_prompt, model, max_tokens)
+        if rejection is not None:
+            return {"text": rejection, "context": None, "done": True, "eval_count": 0, "cancelled": False, "error": True}
+
+        reduce_start = time.perf_counter()
+        result = generate(reduce_prompt, max_tokens, handle)
+        metrics.observe("long_input_reduce", time.perf_counter() - reduce_start)
+        metrics.observe("long_input_total", time.perf_counter() - start)
+        return result
+
+    def _map(self, generate, request, index, count, chunk, map_tokens, handle):
+        """Condense one piece of the input into notes, returning the generate() result"""
+        if handle is not None and handle.cancelled:
+            return {"text": "", "context": None, "done": True, "eval_count": 0, "cancelled": True, "error": False}
+
+        start = time.perf_counter()
+        # Pieces aren't streamed, so a cancel takes effect between pieces
+        result = generate(MAP_PROMPT.format(request=request, index=index, count=count, chunk=chunk), map_tokens, None)
+        metrics.observe("long_input_map", time.perf_counter() - start)
+        return result
@@ -3,19 +3,38 @@
 Multi-platform AI bot that can connect to IRC, Discord, and Slack
 and interact with local Ollama AI models.
 """
+import time
+
+_IMPORT_START = time.perf_counter()
+
+import argparse
+import importlib
 import json
 import toml
 import logging
+import multiprocessing
+import os
+import signal
 import sys
 import asyncio
 import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
 from pathlib import Path
 
-# Import platform-specific clients
-from irc_client import run_irc_bot
-from discord_client import run_discord_bot
-from slack_client import run_slack_bot
-from ollama_client import OllamaClient
+from providers import PROVIDERS, create_client
+from health import health_monitor
+from metrics import metrics
+
+_IMPORT_TIME = time.perf_counter() - _IMPORT_START
+
+# Platform client modules are only imported when selected, since each one
+# pulls in its (heavy) chat library
+PLATFORM_MODULES = {
+    'irc': ('irc_client', 'IRCBot'),
+    'discord': ('discord_client', 'DiscordBot'),
+    'slack': ('slack_client', 'SlackBot'),
+}
 
 # Configure logging
 logging.basicConfig(
@@ -30,10 +49,22 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 class AIBot:
-    def __init__(self, config_file='config.toml'):
+    def __init__(self, config_file='config.toml', startup_profile=False, shard_process=None):
         self.config_file = config_file
-        self.config = self.load_config()
-        self.validate_config()
+        self.startup_profile = startup_profile
+        self.shard_process = shard_process  # (index, total shards) in a Discord shard process
+        self.startup_timings = {"main imports": _IMPORT_TIME}  # key: step, value: seconds
+        
+        with self.timed("load config"):
+            self.config = self.with_shards(self.load_config())
+            self.validate_config()
+        health_monitor.configure(self.config.get('health', {}))
+        
+        # Running platform bot, used to apply reloaded configuration
+        self.bot = None
+        self._reload_lock = threading.Lock()
+        self._stop_watching = threading.Event()
+        self._shutting_down = threading.Event()
         
         logger.info(f"AI Bot initialized for platform: {self.config['platform']}")
     
@@ -63,33 +94,155 @@ class AIBot:
             logger.error(f"Error loading configuration: {e}")
             raise
     
-    def validate_config(self):
+    def validate_config(self, config=None):
         """Validate configuration settings"""
+        config = config if config is not None else self.config
         required_keys = ['platform', 'bot_name', 'ollama']
         
         for key in required_keys:
-            if key not in self.config:
+            if key not in config:
                 raise ValueError(f"Missing required configuration key: {key}")
         
-        platform = self.config['platform']
-        if platform not in ['irc', 'discord', 'slack']:
+        platform = config['platform']
+        if platform not in PLATFORM_MODULES:
             raise ValueError(f"Unsupported platform: {platform}")
         
         # Validate platform-specific config
-        if platform not in self.config:
+        if platform not in config:
             raise ValueError(f"Missing configuration for platform: {platform}")
         
+        backends = {'ollama': config['ollama']}
+        backends.update({f"providers.{name}": settings for name, settings in config.get('providers', {}).items()})
+        for section, settings in backends.items():
+            for key in ['base_url', 'model']:
+                if key not in settings:
+                    raise ValueError(f"Missing required configuration key: {section}.{key}")
+            if settings.get('provider', 'ollama') not in PROVIDERS:
+                raise ValueError(f"Unsupported provider in [{section}]: {settings['provider']}")
+        
+        for rule in config.get('router', {}).get('rules', []):
+            if rule.get('provider') and rule['provider'] not in config.get('providers', {}):
+                raise ValueError(f"Router rule uses undefined provider: {rule['provider']}")
+        
         logger.info("Configuration validation passed")
     
+    def reload_config(self):
+        """Reload the configuration file and apply it to the running bot"""
+        with self._reload_lock:
+            try:
+                config = self.with_shards(self.load_config())
+                self.validate_config(config)
+                if config['platform'] != self.config['platform']:
+                    raise ValueError("Changing platform requires a restart")
+            except Exception as e:
+                logger.error(f"Configuration reload failed, keeping current settings: {e}")
+                metrics.incr("config_reload_failures")
+                return False
+            
+            health_monitor.configure(config.get('health', {}))
+            if self.bot is not None:
+                self.bot.apply_config(config)
+            self.config = config
+        
+        metrics.incr("config_reloads")
+        logger.info(f"Configuration reloaded (model: {config['ollama']['model']})")
+        return True
+    
+    def with_shards(self, config):
+        """Restrict a Discord shard process's configuration to its range of shards"""
+        if self.shard_process is None:
+            return config
+        from discord_client import shard_range
+        
+        index, shard_count = self.shard_process
+        processes = min(config['discord'].get('shard_processes', 1), shard_count)
+        discord_config = dict(config['discord'], shard_count=shard_count,
+                              shard_ids=shard_range(index, processes, shard_count))
+        return dict(config, discord=discord_config)
+    
+    def install_reload_handlers(self):
+        """Reload configuration on SIGHUP and, if enabled, when the file changes"""
+        if hasattr(signal, 'SIGHUP'):
+            # Reload off the signal handler so it never blocks the interrupted code
+            signal.signal(
+                signal.SIGHUP,
+                lambda signum, frame: threading.Thread(target=self.reload_config, daemon=True).start()
+            )
+        
+        reload_config = self.config.get('reload', {})
+        if reload_config.get('watch', False):
+            interval = reload_config.get('interval', 5)
+            threading.Thread(target=self.watch_config, args=(interval,), daemon=True).start()
+    
+    def install_shutdown_handler(self):
+        """Drain and stop the bot on SIGTERM, so restarts don't lose requests"""
+        # Drain off the signal handler, since it waits for in-flight generations
+        signal.signal(
+            signal.SIGTERM,
+            lambda signum, frame: threading.Thread(target=self.shutdown, daemon=True).start()
+        )
+    
+    def shutdown(self):
+        """Turn away new questions, let in-flight ones finish within the grace period, then stop"""
+        if self._shutting_down.is_set():
+            return
+        self._shutting_down.set()
+        grace = self.config.get('shutdown', {}).get('grace', 20)
+        logger.info("Shutdown requested")
+        try:
+            self.bot.shutdown(grace)
+        except Exception as e:
+            logger.error(f"Error draining before shutdown, stopping now: {e}")
+            signal.raise_signal(signal.SIGINT)
+    
+    def watch_config(self, interval):
+        """Poll the configuration file and reload it when it changes"""
+        config_path = Path(self.config_file)
+        last_mtime = config_path.stat().st_mtime
+        
+        while not self._stop_watching.wait(interval):
+            try:
+                mtime = config_path.stat().st_mtime
+            except OSError as e:
+                logger.warning(f"Cannot check configuration file: {e}")
+                continue
+            
+            if mtime != last_mtime:
+                last_mtime = mtime
+                logger.info(f"Configuration file {self.config_file} changed, reloading")
+                self.reload_config()
+    
+    @contextmanager
+    def timed(self, step):
+        """Record how long a startup step takes"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.startup_timings[step] = time.perf_counter() - start
+    
+    def report_startup_profile(self):
+        """Log the recorded startup timings"""
+        logger.info("Startup profile:")
+        for step, seconds in self.startup_timings.items():
+            logger.info(f"  {step:<28} {seconds * 1000:8.1f} ms")
+        logger.info(f"  {'total':<28} {(time.perf_counter() - _IMPORT_START) * 1000:8.1f} ms")
+    
+    def create_bot(self):
+        """Import the configured platform's client module and create its bot"""
+        module_name, class_name = PLATFORM_MODULES[self.config['platform']]
+        
+        with self.timed(f"import {module_name}"):
+            module = importlib.import_module(module_name)
+        with self.timed(f"init {class_name}"):
+            return getattr(module, class_name)(self.config)
+    
     def test_ollama_connection(self):
         """Test connection to Ollama service"""
-        ollama_client = OllamaClient(
-            base_url=self.config['ollama']['base_url'],
-            model=self.config['ollama']['model']
-        )
+        ollama_client = create_client(self.config['ollama'])
         
-        if ollama_client.is_available():
-            models = ollama_client.list_models()
+        if ollama_client.probe():
+            models = ollama_client.catalog.models()
             logger.info(f"Ollama service is available. Models: {models}")
             
             # Test if configured model is available
@@ -97,6 +250,9 @@ class AIBot:
             if configured_model not in models:
                 logger.warning(f"Configured model '{configured_model}' not found in available models")
                 logger.info("Available models: " + ", ".join(models))
+            else:
+                logger.info(f"Context window for {configured_model}: "
+                            f"{ollama_client.context_window(configured_model)} tokens")
             
             return True
         else:
@@ -106,28 +262,134 @@ class AIBot:
     def run_irc(self):
         """Run IRC bot"""
         logger.info("Starting IRC bot...")
-        run_irc_bot(self.config)
+        self.bot.start_bot()
     
     def run_discord(self):
         """Run Discord bot"""
         logger.info("Starting Discord bot...")
-        asyncio.run(run_discord_bot(self.config))
+        asyncio.run(self.bot.start_bot())
+    
+    def run_shard_processes(self):
+        """Split the Discord shards between processes on this host, restarting any that exit"""
+        from discord_client import fetch_shard_count
+        
+        discord_config = self.config['discord']
+        shard_count = discord_config.get('shard_count', 0) or fetch_shard_count(discord_config['token'])
+        count = min(discord_config['shard_processes'], shard_count)
+        logger.info(f"Running {shard_count} Discord shards in {count} processes")
+        
+        context = multiprocessing.get_context('spawn')
+        processes = [None] * count
+        
+        def spawn(index):
+            processes[index] = context.Process(
+                target=run_shard_process,
+                args=(self.config_file, index, shard_count, self.startup_profile),
+                name=f"discord-shards-{index}"
+            )
+            processes[index].start()
+        
+        for index in range(count):
+            spawn(index)
+        
+        # Stop the shard processes with this one; each drains on the SIGTERM it gets
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        # Each process reloads its own configuration
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, lambda signum, frame: [
+                os.kill(process.pid, signal.SIGHUP) for process in processes if process.is_alive()
+            ])
+        
+        try:
+            while True:
+                time.sleep(1)
+                for index, process in enumerate(processes):
+                    if not process.is_alive():
+                        logger.error(f"Discord shard process {index} exited with code {process.exitcode}, restarting")
+                        metrics.incr("shard_process_restarts")
+                        spawn(index)
+        finally:
+            for process in processes:
+                process.terminate()
+            deadline = time.monotonic() + self.config.get('shutdown', {}).get('grace', 20) + 30
+            for process in processes:
+                process.join(max(0, deadline - time.monotonic()))
     
     def run_slack(self):
         """Run Slack bot"""
         logger.info("Starting Slack bot...")
-        run_slack_bot(self.config)
+        self.bot.start_bot()
+    
+    def start_bot_setup(self):
+        """Create the bot in a background thread, returning a Future for it.
+
+        The thread is a daemon so a failed startup can exit without waiting
+        for the platform client to finish initializing.
+        """
+        bot_setup = Future()
+        
+        def setup():
+            bot_setup.set_running_or_notify_cancel()
+            try:
+                bot_setup.set_result(self.create_bot())
+            except Exception as e:
+                bot_setup.set_exception(e)
+        
+        threading.Thread(target=setup, name="bot-setup", daemon=True).start()
+        return bot_setup
+    
+    def discard_bot(self, bot_setup):
+        """Close a bot that was created after startup had already failed"""
+        if bot_setup.exception() is not None:
+            return
+        try:
+            bot_setup.result().services.close()
+        except Exception as e:
+            logger.error(f"Error closing unused bot: {e}")
+    
+    def check_ollama(self):
+        """Test the Ollama connection, recording how long it takes"""
+        with self.timed("ollama check"):
+            return self.test_ollama_connection()
     
     def start(self):
         """Start the bot based on configured platform"""
-        # Test Ollama connection
-        if not self.test_ollama_connection():
+        platform = self.config['platform']
+        
+        if platform == 'discord' and self.shard_process is None \
+                and self.config['discord'].get('shard_processes', 1) > 1:
+            try:
+                self.run_shard_processes()
+            except KeyboardInterrupt:
+                logger.info("Bot stopped by user")
+            except Exception as e:
+                logger.error(f"Error running Discord shard processes: {e}")
+                return False
+            return True
+        
+        # Test the Ollama connection while the platform client is imported and
+        # initialized (which includes Slack's auth check), since both wait on the network
+        bot_setup = self.start_bot_setup()
+        if not self.check_ollama():
+            # Don't wait for the platform client; release it if it still gets built
+            bot_setup.add_done_callback(self.discard_bot)
             logger.error("Cannot start bot: Ollama service is not available")
             logger.info("Please ensure Ollama is running and accessible at: " + 
                        self.config['ollama']['base_url'])
             return False
         
-        platform = self.config['platform']
+        try:
+            self.bot = bot_setup.result()
+        except Exception as e:
+            logger.error(f"Error initializing {platform} bot: {e}")
+            return False
+        
+        if self.startup_profile:
+            self.report_startup_profile()
+        
+        self.install_reload_handlers()
+        self.install_shutdown_handler()
+        health_monitor.start()
         
         try:
             if platform == 'irc':
@@ -145,21 +407,30 @@ class AIBot:
         except Exception as e:
             logger.error(f"Error running {platform} bot: {e}")
             return False
+        finally:
+            self._stop_watching.set()
         
         return True
 
+def run_shard_process(config_file, index, shard_count, startup_profile=False):
+    """Entry point of a process running one range of Discord shards"""
+    bot = AIBot(config_file, startup_profile=startup_profile, shard_process=(index, shard_count))
+    sys.exit(0 if bot.start() else 1)
+
 def main():
     """Main entry point"""
     print("🤖 AI Multi-Platform Bot")
     print("=" * 50)
     
-    # Check for custom config file argument
-    config_file = 'config.toml'
-    if len(sys.argv) > 1:
-        config_file = sys.argv[1]
+    parser = argparse.ArgumentParser(description="Multi-platform AI bot powered by Ollama")
+    parser.add_argument('config_file', nargs='?', default='config.toml',
+                        help="Configuration file (default: config.toml)")
+    parser.add_argument('--startup-profile', action='store_true',
+                        help="Report import and initialization timings at startup")
+    args = parser.parse_args()
     
     try:
-        bot = AIBot(config_file)
+        bot = AIBot(args.config_file, startup_profile=args.startup_profile)
         
         print(f"Platform: {bot.config['platform']}")
         print(f"Bot Name: {bot.config['bot_name']}")
@@ -0,0 +1,156 @@
+"""
+Lightweight in-process metrics for monitoring the bot
+"""
+import threading
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}  # key: name, value: int
+        self.gauges = {}    # key: name, value: number
+        self.timings = {}   # key: name, value: {"count": int, "total": float, "max": float}
+
+    def incr(self, name, value=1):
+        """Increment a counter"""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        """Set a gauge to its current value"""
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, name, seconds):
+        """Record a duration observation"""
+        with self._lock:
+            timing = self.timings.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0})
+            timing["count"] += 1
+            timing["total"] += seconds
+            timing["max"] = max(timing["max"], seconds)
+
+    def get(self, name, default=0):
+        """Get the current value of a counter or gauge"""
+        with self._lock:
+            if name in self.counters:
+                return self.counters[name]
+            return self.gauges.get(name, default)
+
+    def snapshot(self):
+        """Return a copy of all metrics"""
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "timings": {name: dict(value) for name, value in self.timings.items()}
+            }
+
+    def drain(self):
+        """Return a copy of all metrics and clear them, for shipping to another process"""
+        with self._lock:
+            snapshot = {
+                "counters": self.counters,
+                "gauges": self.gauges,
+                "timings": self.timings
+            }
+            self.counters, self.gauges, self.timings = {}, {}, {}
+            return snapshot
+
+    def merge(self, snapshot):
+        """Add metrics drained in another process"""
+        with self._lock:
+            for name, value in snapshot["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            self.gauges.update(snapshot["gauges"])
+            for name, value in snapshot["timings"].items():
+                timing = self.timings.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0})
+                timing["count"] += value["count"]
+                timing["total"] += value["total"]
+                timing["max"] = max(timing["max"], value["max"])
+
+    def reset(self):
+        """Clear all metrics"""
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.timings.clear()
+
+    def format_summary(self):
+        """Format the most useful metrics as a single line for chat"""
+        snapshot = self.snapshot()
+        counters = snapshot["counters"]
+
+        generated = counters.get("tokens_generated", 0)
+        delivered = counters.get("tokens_delivered", 0)
+        ratio = f" ({delivered * 100 // generated}%)" if generated else ""
+
+        parts = [
+            f"requests: {counters.get('requests', 0)}",
+            f"tokens generated: {generated}",
+            f"tokens delivered: {delivered}{ratio}",
+        ]
+
+        limited = sum(value for name, value in counters.items() if name.startswith("rate_limited_"))
+        if limited:
+            parts.append(f"rate limited: {limited}")
+
+        cancelled = counters.get("generations_cancelled", 0)
+        if cancelled:
+            parts.append(f"cancelled: {cancelled}")
+
+        hits, misses = counters.get("cache_hits", 0), counters.get("cache_misses", 0)
+        if hits:
+            parts.append(f"cache hits: {hits * 100 // (hits + misses)}%")
+
+        warmed = counters.get("cache_warmed", 0)
+        if warmed:
+            parts.append(f"warmed: {warmed} ({counters.get('cache_warm_hits', 0)} hits)")
+
+        unhealthy = [name.split(":", 1)[1] for name, value in snapshot["gauges"].items()
+                     if name.startswith("circuit_open:") and value]
+        if unhealthy:
+            parts.append(f"unavailable: {', '.join(sorted(unhealthy))}")
+
+        shard_latencies = [value for name, value in snapshot["gauges"].items()
+                           if name.startswith("discord_shard_latency:")]
+        if len(shard_latencies) > 1:
+            parts.append(f"shards: {len(shard_latencies)} (max latency {max(shard_latencies) * 1000:.0f}ms)")
+
+        disconnected = [name.split(":", 1)[1] for name, value in snapshot["gauges"].items()
+                        if name.startswith("irc_connected:") and not value]
+        if disconnected:
+            parts.append(f"disconnected: {', '.join(sorted(disconnected))}")
+
+        wait = snapshot["timings"].get("scheduler_wait")
+        if wait and wait["count"]:
+            parts.append(f"avg queue wait: {wait['total'] / wait['count']:.1f}s")
+            parts.append(f"model swaps: {counters.get('model_swaps', 0)}")
+
+        map_stage = snapshot["timings"].get("long_input_map_stage")
+        reduce_stage = snapshot["timings"].get("long_input_reduce")
+        if map_stage and map_stage["count"]:
+            reduce_average = reduce_stage["total"] / reduce_stage["count"] if reduce_stage else 0.0
+            parts.append(f"long inputs: {map_stage['count']} (map avg {map_stage['total'] / map_stage['count']:.1f}s, "
+                         f"reduce avg {reduce_average:.1f}s)")
+
+        for name, timing in sorted(snapshot["timings"].items()):
+            if name.startswith("send_queue_latency:") and timing["count"]:
+                platform = name.split(":", 1)[1]
+                parts.append(f"{platform} send wait: avg {timing['total'] / timing['count']:.1f}s")
+
+        for name, timing in sorted(snapshot["timings"].items()):
+            if name.startswith("provider_latency:") and timing["count"]:
+                provider = name.split(":", 1)[1]
+                average = timing["total"] / timing["count"]
+                ttft = snapshot["timings"].get(f"time_to_first_token:{provider}")
+                first_token = f", first token {ttft['total'] / ttft['count']:.1f}s" if ttft else ""
+                parts.append(f"{provider}: avg {average:.1f}s{first_token}")
+
+        for name, timing in sorted(snapshot["timings"].items()):
+            if name.startswith("model_latency:") and timing["count"]:
+                model = name.split(":", 1)[1]
+                average = timing["total"] / timing["count"]
+                parts.append(f"{model}: {timing['count']} req, avg {average:.1f}s, max {timing['max']:.1f}s")
+        return ", ".join(parts)
+
+# Shared metrics registry used by all platform clients
+metrics = Metrics()
@@ -0,0 +1,78 @@
+"""
+Cached model catalog for a backend
+
+Keeps the list of installed models and per-model metadata (such as the
+context length reported by Ollama's /api/show) so commands, routing and
+prompt budgeting don't query the backend on every request. Once loaded, the
+catalog is refreshed in the background when it is older than its TTL, and
+callers get the cached copy in the meantime. Failed or empty metadata
+lookups are remembered for negative_ttl seconds, so a backend that can't
+describe a model isn't asked again on every request.
+"""
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class ModelCatalog:
+    def __init__(self, client, ttl=300, negative_ttl=60):
+        self.client = client
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        self._models = None          # Installed model names, None until first fetched
+        self._fetched_at = 0.0       # monotonic time of the last successful fetch
+        self._refreshing = False
+        self._details = {}           # key: model, value: metadata dict from show_model()
+        self._missing = {}           # key: model, value: monotonic time its metadata lookup came back empty
+
+    def models(self):
+        """Installed models, fetched on first use and refreshed in the background when stale"""
+        with self._lock:
+            models = self._models
+            stale = time.monotonic() - self._fetched_at > self.ttl
+            refresh_in_background = models is not None and stale and not self._refreshing
+            if refresh_in_background:
+                self._refreshing = True
+
+        if models is None:
+            return self.refresh()
+        if refresh_in_background:
+            threading.Thread(target=self.refresh, name="catalog-refresh", daemon=True).start()
+        return models
+
+    def refresh(self):
+        """Fetch the model list now, keeping the old one if the backend can't be reached"""
+        models = self.client.list_models()
+        with self._lock:
+            self._refreshing = False
+            if models:
+                if models != self._models:
+                    # Models may have been re-pulled with different metadata
+                    self._details = {}
+                    self._missing = {}
+                self._models = models
+                self._fetched_at = time.monotonic()
+            return self._models or []
+
+    def details(self, model):
+        """Metadata for a model (see show_model()), cached until the model list changes"""
+        with self._lock:
+            if model in self._details:
+                return self._details[model]
+            if time.monotonic() - self._missing.get(model, float('-inf')) < self.negative_ttl:
+                return {}
+
+        details = self.client.show_model(model)
+        with self._lock:
+            if details:
+                self._details[model] = details
+                self._missing.pop(model, None)
+            else:
+                self._missing[model] = time.monotonic()
+        return details
+
+    def context_length(self, model):
+        """The model's trained context length in tokens, or None if unknown"""
+        return self.details(model).get("context_length")
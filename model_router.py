@@ -0,0 +1,101 @@
+"""
+Per-request model routing
+
+Picks the backend and model for each request from [router] rules (prompt
+length, platform, channel, keywords) or an explicit "!model <name>" prefix, and
+falls back when the chosen model isn't installed. Rules are checked in order and
+the first match wins; requests matching no rule use [ollama].model. A rule may
+send traffic to a named [providers.<name>] backend instead of [ollama].
+Rule channels match the bare channel name or the qualified one
+("<network>/#channel" on IRC, "<guild id>/<channel>" on Discord).
+"""
+import logging
+from metrics import metrics
+from providers import create_client
+
+logger = logging.getLogger(__name__)
+
+MODEL_PREFIX = "!model "
+
+def unqualified(channel):
+    """The channel name without the IRC network or Discord guild that qualifies it ("libera/#help" -> "#help")"""
+    return str(channel).rsplit('/', 1)[-1]
+
+class ModelRouter:
+    def __init__(self, ollama_client, config, platform):
+        self.platform = platform
+        self.configure(ollama_client, config)
+
+    def configure(self, ollama_client, config):
+        """Apply [ollama] and [router] settings"""
+        router_config = config.get('router', {})
+
+        self.ollama_client = ollama_client
+        self.clients = {name: create_client(settings) for name, settings in config.get('providers', {}).items()}
+        self.default_model = config['ollama']['model']
+        self.enabled = router_config.get('enabled', False)
+        self.allow_override = router_config.get('allow_override', True)
+        self.fallback_model = router_config.get('fallback_model', self.default_model)
+        self.rules = router_config.get('rules', [])
+
+    def route(self, prompt, channel=None):
+        """Pick the backend for a prompt.
+
+        Returns (client, model, prompt without any !model prefix).
+        """
+        if not self.enabled:
+            return self.ollama_client, self.default_model, prompt
+
+        provider, model, rule_name = None, None, "default"
+
+        if self.allow_override and prompt.lower().startswith(MODEL_PREFIX):
+            parts = prompt[len(MODEL_PREFIX):].strip().split(None, 1)
+            if parts:
+                rule_name = "override"
+                # "!model <provider>" picks a backend, anything else a model on [ollama]
+                if parts[0] in self.clients:
+                    provider = parts[0]
+                else:
+                    model = parts[0]
+                prompt = parts[1] if len(parts) > 1 else ""
+
+        if rule_name == "default":
+            for index, rule in enumerate(self.rules):
+                if self._matches(rule, prompt, channel):
+                    provider, model = rule.get('provider'), rule.get('model')
+                    rule_name = rule.get('name', f"rule{index}")
+                    break
+
+        client = self.clients.get(provider, self.ollama_client)
+        model = model or client.model
+
+        if not self.is_installed(client, model):
+            logger.warning(f"Model '{model}' ({rule_name}) is not installed, using '{self.fallback_model}'")
+            metrics.incr("model_fallbacks")
+            client, model = self.ollama_client, self.fallback_model
+
+        metrics.incr(f"model_routed:{model}:{rule_name}")
+        return client, model, prompt
+
+    def _matches(self, rule, prompt, channel):
+        """Check whether a rule applies to this request"""
+        if 'platforms' in rule and self.platform not in rule['platforms']:
+            return False
+        if 'channels' in rule and channel not in rule['channels'] \
+                and unqualified(channel) not in rule['channels']:
+            return False
+        if len(prompt) > rule.get('max_prompt_chars', len(prompt)):
+            return False
+        if len(prompt) < rule.get('min_prompt_chars', 0):
+            return False
+        if 'keywords' in rule:
+            prompt_lower = prompt.lower()
+            if not any(keyword.lower() in prompt_lower for keyword in rule['keywords']):
+                return False
+        return True
+
+    def is_installed(self, client, model):
+        """Check a model against the backend's cached model catalog"""
+        available = client.catalog.models()
+        # If the catalog couldn't be fetched, don't second-guess the rules
+        return not available or model in available
@@ -4,117 +4,129 @@ Ollama client module for AI model communication
 import requests
 import json
 import logging
+from llm_client import BaseClient
 
 logger = logging.getLogger(__name__)
 
-class OllamaClient:
-    def __init__(self, base_url="http://localhost:11434", model="llama2"):
-        self.base_url = base_url.rstrip('/')
-        self.model = model
-        
-    def is_available(self):
-        """Check if Ollama service is available"""
-        try:
-            response = requests.get(f"{self.base_url}/api/tags", timeout=5)
-            return response.status_code == 200
-        except requests.RequestException as e:
-            logger.error(f"Ollama service not available: {e}")
-            return False
-    
-    def generate_full_response(self, prompt, max_tokens=500):
-        """Generate full response from Ollama model without truncation"""
-        if not self.is_available():
-            return "Sorry, the AI service is currently unavailable."
-        
-        try:
-            payload = {
-                "model": self.model,
-                "prompt": prompt,
-                "stream": False,
-                "options": {
-                    "num_predict": max_tokens,
-                    "temperature": 0.7
-                }
-            }
-            
-            response = requests.post(
-                f"{self.base_url}/api/generate",
-                json=payload,
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                return result.get("response", "Sorry, I couldn't generate a response.")
-            else:
-                logger.error(f"Ollama API error: {response.status_code}")
-                return "Sorry, there was an error processing your request."
-                
-        except requests.RequestException as e:
-            logger.error(f"Error calling Ollama API: {e}")
-            return "Sorry, I couldn't connect to the AI service."
-        except json.JSONDecodeError as e:
-            logger.error(f"Error parsing Ollama response: {e}")
-            return "Sorry, there was an error processing the AI response."
-    
-    def generate_response(self, prompt, max_tokens=500):
-        """Generate response from Ollama model"""
-        if not self.is_available():
-            return "Sorry, the AI service is currently unavailable."
-        
-        try:
-            payload = {
-                "model": self.model,
-                "prompt": prompt,
-                "stream": False,
-                "options": {
-                    "num_predict": max_tokens,
-                    "temperature": 0.7
-                }
-            }
-            
-            response = requests.post(
-                f"{self.base_url}/api/generate",
-                json=payload,
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                raw_response = result.get("response", "Sorry, I couldn't generate a response.")
-                # Clean up the response for IRC compatibility
-                clean_response = raw_response.replace('\r\n', ' ').replace('\r', ' ').replace('\n', ' ')
-                # Remove extra spaces
-                clean_response = ' '.join(clean_response.split())
-                # Truncate if too long for IRC (max ~400 chars to be safe)
-                if len(clean_response) > 400:
-                    clean_response = clean_response[:397] + "..."
-                return clean_response
-            else:
-                logger.error(f"Ollama API error: {response.status_code}")
-                return "Sorry, there was an error processing your request."
-                
-        except requests.RequestException as e:
-            logger.error(f"Error calling Ollama API: {e}")
-            return "Sorry, I couldn't connect to the AI service."
-        except json.JSONDecodeError as e:
-            logger.error(f"Error parsing Ollama response: {e}")
-            return "Sorry, there was an error processing the AI response."
-    
+# Context window Ollama uses when neither the request nor the Modelfile sets num_ctx
+DEFAULT_NUM_CTX = 2048
+
+class OllamaClient(BaseClient):
+    provider = "ollama"
+    provider_name = "Ollama"
+    health_path = "/api/tags"
+
+    def __init__(self, base_url="http://localhost:11434", model="llama2", timeout=30, pool_size=10, **kwargs):
+        super().__init__(base_url, model, timeout=timeout, pool_size=pool_size, **kwargs)
+
+    def _build_request(self, prompt, max_tokens, context, model, stream):
+        """Build an /api/generate request"""
+        options = self.options_for(model)
+        keep_alive = options.pop("keep_alive", None)
+        num_predict = self.token_limit(options, max_tokens)
+        options.pop("max_tokens", None)
+        payload = {
+            "model": model,
+            "prompt": prompt,
+            "stream": stream,
+            "options": {**options, "num_predict": num_predict}
+        }
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
+        if context:
+            # Resume decoding right after the stored context. Ollama ignores an
+            # empty prompt, so a single space is sent untemplated in raw mode.
+            payload["context"] = context
+            payload["raw"] = True
+            payload["prompt"] = prompt or " "
+        return "/api/generate", payload
+
+    def _parse_response(self, data):
+        """Parse an /api/generate response"""
+        return {
+            "text": data.get("response", "Sorry, I couldn't generate a response."),
+            "context": data.get("context"),
+            "done": data.get("done_reason") != "length",
+            "eval_count": data.get("eval_count", 0)
+        }
+
+    def _parse_stream_line(self, line):
+        """Parse one NDJSON line of a streamed /api/generate response"""
+        data = json.loads(line)
+        piece = data.get("response", "")
+        if not data.get("done"):
+            return piece, None, False
+
+        final_fields = self._parse_response(data)
+        del final_fields["text"]
+        return piece, final_fields, True
+
     def list_models(self):
         """List available models"""
         if not self.is_available():
             return []
-        
         try:
-            response = requests.get(f"{self.base_url}/api/tags", timeout=10)
+            response = self.session.get(f"{self.base_url}/api/tags", timeout=10)
             if response.status_code == 200:
                 data = response.json()
                 return [model['name'] for model in data.get('models', [])]
             return []
         except requests.RequestException:
             return []
-    
-    def get_available_models(self):
-        """Alias for list_models() - returns list of available models"""
-        return self.list_models()
\ No newline at end of file
+
+    def show_model(self, model):
+        """Context length and Modelfile num_ctx for a model (/api/show)"""
+        if not self.is_available():
+            return {}
+        try:
+            response = self.session.post(f"{self.base_url}/api/show", json={"model": model}, timeout=10)
+            if response.status_code != 200:
+                return {}
+            data = response.json()
+        except (requests.RequestException, ValueError) as e:
+            logger.warning(f"Could not fetch details for {model}: {e}")
+            return {}
+
+        # model_info keys are prefixed with the architecture, e.g. "llama.context_length"
+        context_length = next(
+            (value for key, value in data.get("model_info", {}).items() if key.endswith(".context_length")),
+            None
+        )
+        num_ctx = None
+        for line in data.get("parameters", "").splitlines():
+            parts = line.split()
+            if len(parts) == 2 and parts[0] == "num_ctx":
+                num_ctx = int(parts[1])
+        return {"context_length": context_length, "num_ctx": num_ctx}
+
+    def context_window(self, model):
+        """The num_ctx Ollama will run the model with, capped at its trained context length"""
+        details = self.catalog.details(model)
+        num_ctx = self.options_for(model).get("num_ctx") or details.get("num_ctx") or DEFAULT_NUM_CTX
+        trained = details.get("context_length")
+        return min(num_ctx, trained) if trained else num_ctx
+
+    def running_models(self):
+        """List models currently loaded in memory (/api/ps), or None if unknown"""
+        if not self.is_available():
+            return None
+        try:
+            response = self.session.get(f"{self.base_url}/api/ps", timeout=5)
+            if response.status_code == 200:
+                data = response.json()
+                return [model['name'] for model in data.get('models', [])]
+        except (requests.RequestException, ValueError) as e:
+            logger.warning(f"Could not fetch running models: {e}")
+        return None
+
+    def model_memory(self, model):
+        """Return (total bytes, VRAM bytes) for a loaded model from /api/ps, or None"""
+        try:
+            response = self.session.get(f"{self.base_url}/api/ps", timeout=5)
+            if response.status_code == 200:
+                for entry in response.json().get('models', []):
+                    if entry.get('name') == model:
+                        return entry.get('size', 0), entry.get('size_vram', 0)
+        except (requests.RequestException, ValueError) as e:
+            logger.warning(f"Could not fetch model memory: {e}")
+        return None
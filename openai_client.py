@@ -0,0 +1,121 @@
+"""
+Client for OpenAI-compatible inference servers (llama.cpp server, vLLM, ...)
+"""
+import json
+import logging
+import requests
+from llm_client import BaseClient
+
+logger = logging.getLogger(__name__)
+
+# Generation options that have an equivalent in the chat completions API, by
+# their Ollama name (num_predict and max_tokens cap the reply length instead)
+CHAT_OPTIONS = {
+    "temperature": "temperature",
+    "top_p": "top_p",
+    "seed": "seed",
+    "stop": "stop",
+}
+
+class OpenAICompatibleClient(BaseClient):
+    provider = "openai"
+    provider_name = "OpenAI-compatible"
+    health_path = "/v1/models"
+
+    def __init__(self, base_url="http://localhost:8080", model="default", timeout=30, pool_size=10,
+                 api_key=None, **kwargs):
+        super().__init__(base_url, model, timeout=timeout, pool_size=pool_size, **kwargs)
+        self.api_key = api_key
+
+    def _headers(self):
+        """Send the API key if one is configured"""
+        if self.api_key:
+            return {"Authorization": f"Bearer {self.api_key}"}
+        return {}
+
+    def _build_request(self, prompt, max_tokens, context, model, stream):
+        """Build a /v1/chat/completions request.
+
+        These servers have no equivalent of Ollama's context, so generations
+        can't be resumed and context is ignored. Options are taken from the
+        same options/model_options settings as Ollama's; those without a
+        chat completions equivalent (num_ctx, num_thread, ...) are skipped.
+        """
+        options = self.options_for(model)
+        payload = {
+            "model": model,
+            "messages": [{"role": "user", "content": prompt}],
+            "max_tokens": self.token_limit(options, max_tokens),
+            "stream": stream
+        }
+        for name, value in options.items():
+            if name in CHAT_OPTIONS:
+                payload[CHAT_OPTIONS[name]] = value
+        if stream:
+            payload["stream_options"] = {"include_usage": True}
+        return "/v1/chat/completions", payload
+
+    def _parse_response(self, data):
+        """Parse a chat completion response"""
+        choices = data.get("choices") or [{}]
+        message = choices[0].get("message", {})
+        return {
+            "text": message.get("content") or "Sorry, I couldn't generate a response.",
+            "context": None,
+            "done": choices[0].get("finish_reason") != "length",
+            "eval_count": data.get("usage", {}).get("completion_tokens", 0)
+        }
+
+    def _parse_stream_line(self, line):
+        """Parse one server-sent event line of a streamed chat completion"""
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        if not line.startswith("data:"):
+            return "", None, False
+
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            return "", None, True
+
+        chunk = json.loads(data)
+        final_fields = {}
+        if chunk.get("usage"):
+            final_fields["eval_count"] = chunk["usage"].get("completion_tokens", 0)
+
+        piece = ""
+        for choice in chunk.get("choices") or []:
+            piece += (choice.get("delta") or {}).get("content") or ""
+            if choice.get("finish_reason"):
+                final_fields["done"] = choice["finish_reason"] != "length"
+        return piece, final_fields or None, False
+
+    def list_models(self):
+        """List available models"""
+        if not self.is_available():
+            return []
+        try:
+            response = self.session.get(f"{self.base_url}/v1/models", headers=self._headers(), timeout=10)
+            if response.status_code == 200:
+                data = response.json()
+                return [model['id'] for model in data.get('data', [])]
+            return []
+        except (requests.RequestException, ValueError):
+            return []
+
+    def show_model(self, model):
+        """Context length for a model, as reported in /v1/models by vLLM or llama.cpp server"""
+        if not self.is_available():
+            return {}
+        try:
+            response = self.session.get(f"{self.base_url}/v1/models", headers=self._headers(), timeout=10)
+            if response.status_code != 200:
+                return {}
+            entries = response.json().get('data', [])
+        except (requests.RequestException, ValueError):
+            return {}
+
+        for entry in entries:
+            if entry.get('id') == model:
+                context_length = entry.get('max_model_len') or (entry.get('meta') or {}).get('n_ctx_train')
+                return {"context_length": context_length}
+        return {}
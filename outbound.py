@@ -0,0 +1,163 @@
+"""
+Rate-limit-aware outbound message queue for Discord and Slack
+
+Replies are queued per destination (a channel, DM or slash-command response)
+and delivered by a fixed number of sender threads instead of each handler
+calling the platform directly. Each destination gets at most one message per
+channel_interval seconds, and replies that queue up for the same destination
+meanwhile are merged into one message when they fit. When the platform
+reports a rate limit, the destination (or, for global limits, the whole
+queue) waits for the retry-after period instead of blocking a handler in the
+SDK's own retry loop. Queue latency and depth are recorded per platform.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+class RateLimited(Exception):
+    """Raised by a deliver function when the platform rejected a send for rate limiting"""
+    def __init__(self, retry_after, is_global=False):
+        super().__init__(f"rate limited for {retry_after:.1f}s")
+        self.retry_after = retry_after
+        self.is_global = is_global
+
+class SendQueue:
+    def __init__(self, platform, max_length, config=None):
+        self.platform = platform
+        self.max_length = max_length  # Platform message size limit, for merging
+        self._condition = threading.Condition()
+        self._queues = OrderedDict()  # key: destination, value: deque of [deliver, text, enqueue time, mergeable, attempts]
+        self._ready_at = {}           # key: destination, value: monotonic time it may be sent to again
+        self._busy = set()            # Destinations with a send in flight, so their messages stay in order
+        self._global_ready_at = 0.0
+        self._queued = 0
+        self._threads = []
+        self._stopping = False
+        self.configure(config)
+
+    def configure(self, config=None):
+        """Apply [outbound] settings"""
+        config = config or {}
+        with self._condition:
+            self.channel_interval = config.get('channel_interval', 1.0)  # Seconds between messages to one destination
+            self.merge = config.get('merge', True)                       # Combine queued replies to one destination
+            self.max_attempts = config.get('max_attempts', 5)            # Sends tried before a message is dropped
+            self.thread_count = config.get('threads', 2)
+            self._condition.notify_all()
+
+    def start(self):
+        """Start the sender threads"""
+        for index in range(self.thread_count):
+            thread = threading.Thread(target=self._run, name=f"{self.platform}-send-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def put(self, destination, deliver, text, mergeable=True):
+        """Queue text for destination; deliver(text) sends it from a sender thread"""
+        with self._condition:
+            self._queues.setdefault(destination, deque()).append([deliver, text, time.monotonic(), mergeable, 0])
+            self._queued += 1
+            metrics.set_gauge(f"send_queue_depth:{self.platform}", self._queued)
+            self._condition.notify()
+
+    def _next(self):
+        """Take the oldest ready destination's messages, merged if allowed (caller holds the lock).
+
+        Returns (destination, deliver, text, entries) or the number of seconds until one is ready.
+        """
+        now = time.monotonic()
+        if now < self._global_ready_at:
+            return self._global_ready_at - now
+
+        wait = None
+        for destination, entries in self._queues.items():
+            if destination in self._busy:
+                continue
+            ready_at = self._ready_at.get(destination, 0.0)
+            if ready_at > now:
+                wait = min(wait, ready_at - now) if wait is not None else ready_at - now
+                continue
+
+            taken = [entries.popleft()]
+            text = taken[0][1]
+            while self.merge and taken[0][3] and entries and entries[0][3] \
+                    and len(text) + 1 + len(entries[0][1]) <= self.max_length:
+                text += "\n" + entries[0][1]
+                taken.append(entries.popleft())
+            if not entries:
+                del self._queues[destination]
+            self._busy.add(destination)
+            self._queued -= len(taken)
+            if len(taken) > 1:
+                metrics.incr(f"send_merged:{self.platform}", len(taken) - 1)
+            return destination, taken[0][0], text, taken
+        return wait
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if self._stopping and not self._queues:
+                        return
+                    item = self._next()
+                    if isinstance(item, tuple):
+                        break
+                    self._condition.wait(item)
+            destination, deliver, text, taken = item
+
+            retry_after = None
+            try:
+                deliver(text)
+                now = time.monotonic()
+                for entry in taken:
+                    metrics.observe(f"send_queue_latency:{self.platform}", now - entry[2])
+            except RateLimited as e:
+                logger.warning(f"{self.platform} send to {destination} {e}")
+                metrics.incr(f"send_rate_limited:{self.platform}")
+                retry_after = e.retry_after
+                if e.is_global:
+                    with self._condition:
+                        self._global_ready_at = max(self._global_ready_at, time.monotonic() + e.retry_after)
+                self._requeue(destination, taken)
+            except Exception as e:
+                logger.error(f"Error sending {self.platform} message to {destination}: {e}")
+                metrics.incr(f"send_failures:{self.platform}", len(taken))
+
+            with self._condition:
+                self._busy.discard(destination)
+                self._ready_at[destination] = time.monotonic() + max(self.channel_interval, retry_after or 0)
+                # Forget pacing state for quiet destinations so it doesn't grow without bound
+                if len(self._ready_at) > 1000:
+                    now = time.monotonic()
+                    self._ready_at = {key: at for key, at in self._ready_at.items() if at > now}
+                metrics.set_gauge(f"send_queue_depth:{self.platform}", self._queued)
+                self._condition.notify_all()
+
+    def _requeue(self, destination, taken):
+        """Put rate-limited messages back at the front of their destination's queue"""
+        retry = [entry for entry in taken if entry[4] + 1 < self.max_attempts]
+        if len(retry) < len(taken):
+            logger.error(f"Dropped {len(taken) - len(retry)} {self.platform} messages to {destination} "
+                         f"after {self.max_attempts} rate-limited attempts")
+            metrics.incr(f"send_failures:{self.platform}", len(taken) - len(retry))
+        with self._condition:
+            entries = self._queues.setdefault(destination, deque())
+            for entry in reversed(retry):
+                entry[4] += 1
+                entries.appendleft(entry)
+            self._queued += len(retry)
+
+    def flush(self, timeout=10):
+        """Stop the sender threads once the queued messages are sent, waiting up to timeout seconds"""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.monotonic()))
+        if self._queued:
+            logger.warning(f"{self._queued} {self.platform} messages were not sent before shutdown")
@@ -0,0 +1,504 @@
+"""
+Platform-agnostic message pipeline
+
+Platform clients are thin adapters: they turn each platform event into a
+Request and hand it to a Pipeline, which runs it through stages:
+
+    filter -> parse -> drain -> rate-limit -> cache -> generate -> format -> chunk -> send
+
+A stage returns False to drop the request. Once a stage sets request.reply
+(a command result, a rate-limit message, an error) the remaining processing
+stages are skipped and only the output stages run. Stages marked blocking
+(generation) are handed to the adapter's dispatch function, so the fast
+stages run on the platform's event thread and only generation moves to a
+worker.
+
+Adapters with a reply deadline get whatever has been generated when it
+passes, sent as a partial reply, while generation finishes in the background
+and the rest becomes available through 'continue'.
+
+On shutdown the pipeline drains: new questions get a "restarting" reply while
+requests already in flight finish within a grace period. Generations still
+running after it are cancelled; their users get a reply saying so, and what
+was generated behind a partial reply is kept for 'continue'.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from metrics import metrics
+from response_cache import normalize_prompt
+
+logger = logging.getLogger(__name__)
+
+ERROR_REPLY = "Sorry, I encountered an error processing your message."
+RESTARTING_REPLY = "I'm restarting right now. Please ask again in a minute."
+INTERRUPTED_REPLY = "Sorry, I had to restart before I could finish that answer. Please ask again in a minute."
+INTERRUPTED_NOTE = "\n\n(This answer was cut short by a restart.)"
+
+class Request:
+    """One incoming message on its way through the pipeline"""
+    __slots__ = (
+        'platform', 'user', 'context', 'text', 'direct', 'addressed', 'message_id', 'attachments', 'raw',
+        'command', 'prompt', 'cache_key', 'response', 'resume_context', 'tokens', 'client', 'model',
+        'formatted', 'reply', 'stream', 'partial', 'scope', 'received_at',
+    )
+
+    def __init__(self, platform, user, context, text, direct=False, addressed=None,
+                 message_id=None, attachments=None, raw=None, scope=""):
+        self.platform = platform
+        self.user = user
+        self.context = context          # Channel, or the user for direct messages
+        self.text = text
+        self.direct = direct
+        self.addressed = addressed      # True/False if the platform knows, None to look for the bot's name
+        self.message_id = message_id
+        self.attachments = attachments or ()
+        self.raw = raw                  # Platform objects the adapter needs to reply
+        self.command = None             # "ask", "continue", "summarize" or "stats"
+        self.prompt = None
+        self.cache_key = None
+        self.response = None            # Raw generated text
+        self.resume_context = None
+        self.tokens = 0
+        self.client = None
+        self.model = None
+        self.formatted = None           # Response prepared for the platform
+        self.reply = None               # Text to send
+        self.stream = None              # Called with each generated piece of text, for progress updates
+        self.partial = None             # Future of the finished result when the deadline passed first
+        self.scope = scope              # Prefix making user names unique, e.g. the IRC network
+        self.received_at = time.perf_counter()
+
+def mention_patterns(bot_name):
+    """Ways users address the bot by name"""
+    name = bot_name.lower()
+    return [f"{name}:", f"{name},", f"@{name}", name]
+
+def is_mentioned(text, bot_name):
+    """Check if the bot is mentioned by name in the text"""
+    text_lower = text.lower()
+    return any(pattern in text_lower for pattern in mention_patterns(bot_name))
+
+def clean_message(text, bot_name):
+    """Remove the bot's name from the text"""
+    clean_text = text
+    for pattern in mention_patterns(bot_name):
+        clean_text = clean_text.replace(pattern, "", 1)
+        clean_text = clean_text.replace(pattern.title(), "", 1)
+        clean_text = clean_text.replace(pattern.upper(), "", 1)
+    return clean_text.strip()
+
+class Stage:
+    name = "stage"
+    output = False    # Output stages still run once a reply is set
+    blocking = False  # Blocking stages run through the adapter's dispatch function
+
+    def __call__(self, request):
+        return True
+
+    def close(self):
+        """Release the stage's resources once no more requests will come"""
+
+class FilterStage(Stage):
+    """Drop messages the bot should ignore entirely"""
+    name = "filter"
+
+    def __init__(self, adapter):
+        self.adapter = adapter
+
+    def __call__(self, request):
+        if not request.text and not request.attachments:
+            return False
+        return request.direct or self.adapter.channel_allowed(request.context)
+
+class ParseStage(Stage):
+    """Work out what the message asks for, recording channel chatter for summaries"""
+    name = "parse"
+
+    def __init__(self, adapter, continuations, summaries=None):
+        self.adapter = adapter
+        self.continuations = continuations
+        self.summaries = summaries
+
+    def __call__(self, request):
+        text = request.text.strip()
+        command = text.lower()
+
+        if command == '!stats':
+            request.reply = metrics.format_summary()
+            return True
+        if command == '!summarize' and not request.direct and self.summaries is not None:
+            request.command = "summarize"
+            return True
+        # A bare 'continue' works without addressing the bot if there is something to continue.
+        # Otherwise it is ordinary chatter (IRC used to answer every bare 'continue' in a
+        # channel); addressed and direct ones still get "No previous message to continue."
+        if self.continuations.is_continue(text) and (
+                request.direct or self.continuations.has_response(request.user, request.context)):
+            request.command = "continue"
+            return True
+
+        if not request.direct and self.summaries is not None:
+            self.summaries.record(request.context, request.user, text)
+
+        if request.direct:
+            prompt = text
+        elif request.addressed or (request.addressed is None and is_mentioned(text, self.adapter.bot_name)):
+            prompt = clean_message(text, self.adapter.bot_name)
+        else:
+            return False
+
+        if self.continuations.is_continue(prompt):
+            request.command = "continue"
+        elif self.summaries is not None and not request.direct and self.summaries.is_summarize(prompt):
+            request.command = "summarize"
+        else:
+            request.command = "ask"
+            request.prompt = prompt
+        logger.info(f"{request.command} from {request.user} in {request.context}: {prompt}")
+        return True
+
+class DrainStage(Stage):
+    """Reply that the bot is restarting instead of starting new generations while it drains"""
+    name = "drain"
+
+    def __init__(self, settings):
+        self.settings = settings
+
+    def __call__(self, request):
+        if request.command in ("ask", "summarize") and getattr(self.settings, 'draining', False):
+            request.reply = RESTARTING_REPLY
+            metrics.incr(f"drain_rejected:{request.platform}")
+        return True
+
+class RateLimitStage(Stage):
+    """Reply with a polite message instead of generating when a user is over their limit"""
+    name = "rate-limit"
+
+    def __init__(self, rate_limiter):
+        self.rate_limiter = rate_limiter
+
+    def __call__(self, request):
+        if request.command in ("ask", "summarize"):
+            retry_after = self.rate_limiter.check(
+                request.user, None if request.direct else request.context, scope=request.scope
+            )
+            if retry_after:
+                request.reply = self.rate_limiter.limit_message(retry_after)
+        return True
+
+class CacheStage(Stage):
+    """Answer repeated questions from the response cache"""
+    name = "cache"
+
+    def __init__(self, cache, continuations):
+        self.cache = cache
+        self.continuations = continuations
+
+    def __call__(self, request):
+        if request.command != "ask" or request.attachments or not self.cache.enabled:
+            return True
+
+        router = self.continuations.router
+        # Routing rules can depend on the channel, so answers are only shared across channels without them
+        scope = request.context if router is not None and router.enabled else ""
+        request.cache_key = "|".join([
+            request.platform, scope, self.continuations.ollama_client.model, normalize_prompt(request.prompt)
+        ])
+        self.cache.record(request.cache_key, request.prompt, request.context)
+        request.response = self.cache.get(request.cache_key)
+        return True
+
+class GenerateStage(Stage):
+    """Generate the response text (or the next chunk for continue)"""
+    name = "generate"
+    blocking = True
+
+    def __init__(self, continuations, generations, summaries=None, attachments=None, cache=None, generator=None,
+                 settings=None, background_threads=8):
+        self.continuations = continuations
+        self.generator = generator or continuations  # Anything with generate_response(), e.g. a WorkerPool
+        self.generations = generations
+        self.summaries = summaries
+        self.attachments = attachments
+        self.cache = cache
+        self.settings = settings
+        # Generations that outlive their deadline finish here (threads are only started when needed)
+        self._background = ThreadPoolExecutor(max_workers=background_threads, thread_name_prefix='generate-background')
+
+    def __call__(self, request):
+        if request.command == "continue":
+            request.reply = self.continuations.next_chunk(request.user, request.context)
+            return True
+        if request.command == "summarize":
+            request.response = self.summaries.summarize(request.context)
+            return True
+        if request.response is not None:
+            return True  # Answered from the cache
+
+        prompt = request.prompt
+        if request.attachments and self.attachments is not None:
+            prompt = self.attachments.add_to_prompt(prompt, request.attachments)
+
+        handle = self.generations.start(request.user, request.context, request.message_id)
+        handle.on_text = request.stream
+        deadline = getattr(self.settings, 'deadline', 0)
+        if deadline:
+            return self._generate_with_deadline(request, prompt, handle, deadline)
+        try:
+            result = self.generator.generate_response(request.context, prompt, handle)
+        finally:
+            self.generations.finish(handle)
+        return self._use_result(request, result, handle)
+
+    def _generate_with_deadline(self, request, prompt, handle, deadline):
+        """Generate in the background, settling for the text so far if the deadline passes"""
+        pieces = []
+        stream = request.stream
+
+        def on_text(piece):
+            pieces.append(piece)
+            if stream is not None:
+                stream(piece)
+        handle.on_text = on_text
+
+        def generate():
+            result = self.generator.generate_response(request.context, prompt, handle)
+            if result is None and handle.cancel_reason == "shutdown" and pieces:
+                # Keep what the user was promised through 'continue' (saved with the continuation state)
+                result = {"text": "".join(pieces) + INTERRUPTED_NOTE, "done": False, "error": False,
+                          "resume_context": None, "eval_count": 0, "client": None, "model": None}
+            return result
+
+        future = self._background.submit(generate)
+        remaining = deadline - (time.perf_counter() - request.received_at)
+        try:
+            result = future.result(timeout=max(0, remaining))
+        except FutureTimeout:
+            metrics.incr(f"deadline_missed:{request.platform}")
+            logger.info(f"Deadline passed for {request.user} in {request.context}, sending a partial reply")
+            request.response = "".join(pieces)
+            request.partial = future
+            future.add_done_callback(lambda future: self._finish_background(request, handle, future))
+            return True
+        except Exception:
+            self.generations.finish(handle)
+            raise
+        self.generations.finish(handle)
+        return self._use_result(request, result, handle)
+
+    def _finish_background(self, request, handle, future):
+        """Clean up after a generation that finished after its partial reply"""
+        self.generations.finish(handle)
+        if future.exception() is not None:
+            logger.error(f"Background generation for {request.user} in {request.context} failed: "
+                         f"{future.exception()}")
+            return
+        result = future.result()
+        if result is not None and request.cache_key and self.cache is not None \
+                and result["done"] and not result["error"]:
+            self.cache.put(request.cache_key, result["text"])
+
+    def _use_result(self, request, result, handle):
+        if result is None:
+            if handle.cancel_reason == "shutdown":
+                request.reply = INTERRUPTED_REPLY
+                return True
+            return False  # Cancelled, nothing to send
+
+        request.response = result["text"]
+        request.resume_context = result["resume_context"]
+        request.tokens = result["eval_count"]
+        request.client = result["client"]
+        request.model = result["model"]
+
+        if request.cache_key and self.cache is not None and result["done"] and not result["error"]:
+            self.cache.put(request.cache_key, request.response)
+        return True
+
+    def close(self):
+        """Wait for background generations (and the partial replies waiting on them) to finish"""
+        self._background.shutdown(wait=True)
+
+class FormatStage(Stage):
+    """Prepare generated text for the platform"""
+    name = "format"
+    output = True
+
+    def __init__(self, continuations):
+        self.continuations = continuations
+
+    def __call__(self, request):
+        if request.reply is None and request.response is not None:
+            request.formatted = self.continuations.prepare(request.response)
+        return True
+
+class ChunkStage(Stage):
+    """Cut the first message-sized chunk, storing the rest for continue"""
+    name = "chunk"
+    output = True
+
+    def __init__(self, continuations):
+        self.continuations = continuations
+
+    def __call__(self, request):
+        if request.reply is None and request.partial is not None:
+            request.reply = self.continuations.partial_chunk(
+                request.user, request.context, request.response, full_text=request.formatted
+            )
+            placeholder = self.continuations.responses.get(f"{request.user}@{request.context}")
+            request.partial.add_done_callback(lambda future: self.continuations.complete_partial(
+                request.user, request.context, placeholder,
+                future.result() if future.exception() is None else None
+            ))
+        elif request.reply is None and request.response is not None:
+            request.reply = self.continuations.first_chunk(
+                request.user, request.context, request.response, request.resume_context, request.tokens,
+                request.client, request.model, full_text=request.formatted
+            )
+        return True
+
+class SendStage(Stage):
+    """Deliver the reply through the platform adapter"""
+    name = "send"
+    output = True
+
+    def __init__(self, adapter):
+        self.adapter = adapter
+
+    def __call__(self, request):
+        if request.reply is None:
+            return False
+        self.adapter.send(request, request.reply)
+        metrics.observe(f"pipeline_latency:{request.platform}", time.perf_counter() - request.received_at)
+        return True
+
+class Pipeline:
+    def __init__(self, stages, dispatch=None, timed=False, on_drop=None):
+        self.stages = stages
+        self.dispatch = dispatch or (lambda fn: fn())  # Runs blocking stages, e.g. on a worker pool
+        self.timed = timed                             # Record per-stage timings
+        self.on_drop = on_drop                         # Called with (request, stage name) when a stage drops one
+        self._idle = threading.Condition()
+        self._in_flight = 0                            # Submitted requests that haven't finished
+
+    def submit(self, request):
+        """Run a request through the pipeline, dispatching blocking stages"""
+        with self._idle:
+            self._in_flight += 1
+        try:
+            dispatched = self._run(request, 0, on_worker=False)
+        except Exception:
+            self._done()
+            raise
+        if not dispatched:
+            self._done()
+
+    def _run_dispatched(self, request, index):
+        try:
+            self._run(request, index, on_worker=True)
+        finally:
+            self._done()
+
+    def _done(self):
+        with self._idle:
+            self._in_flight -= 1
+            if not self._in_flight:
+                self._idle.notify_all()
+
+    def wait_idle(self, timeout):
+        """Wait up to timeout seconds for submitted requests to finish; returns False on timeout"""
+        with self._idle:
+            return self._idle.wait_for(lambda: not self._in_flight, timeout)
+
+    def drain(self, generations, grace):
+        """Let in-flight requests and generations finish for up to grace seconds, then cancel the rest.
+
+        Stop new work first (the draining setting). Returns the number of
+        generations that had to be cancelled.
+        """
+        deadline = time.monotonic() + grace
+        self.wait_idle(grace)
+        # Generations behind partial replies carry on after their request has finished
+        while len(generations) and time.monotonic() < deadline:
+            time.sleep(0.1)
+
+        cancelled = generations.cancel_all("shutdown")
+        if cancelled:
+            logger.warning(f"Cancelled {cancelled} generations still running after {grace}s")
+            metrics.incr("shutdown_cancelled", cancelled)
+        # Cancelled requests still send their replies
+        if not self.wait_idle(10):
+            logger.warning(f"{self._in_flight} requests were still in the pipeline at shutdown")
+        for stage in self.stages:
+            stage.close()
+        return cancelled
+
+    def run(self, request):
+        """Run a request through every stage on the calling thread and return it"""
+        self._run(request, 0, on_worker=True)
+        return request
+
+    def _run(self, request, start, on_worker):
+        """Run stages from start; returns True if the rest was handed to the dispatch function"""
+        for index in range(start, len(self.stages)):
+            stage = self.stages[index]
+            if request.reply is not None and not stage.output:
+                continue
+            if stage.blocking and not on_worker:
+                self.dispatch(lambda: self._run_dispatched(request, index))
+                return True
+
+            stage_start = time.perf_counter()
+            try:
+                keep_going = stage(request)
+            except Exception as e:
+                logger.error(f"Error in {stage.name} stage for {request.user} in {request.context}: {e}")
+                request.reply = ERROR_REPLY
+                keep_going = True
+            if self.timed:
+                metrics.observe(f"pipeline_stage:{stage.name}", time.perf_counter() - stage_start)
+            if not keep_going:
+                self._dropped(request, stage)
+                return False
+        return False
+
+    def _dropped(self, request, stage):
+        if self.on_drop is None:
+            return
+        try:
+            self.on_drop(request, stage.name)
+        except Exception as e:
+            logger.error(f"Error handling dropped request for {request.user} in {request.context}: {e}")
+
+def build_pipeline(adapter, continuations, rate_limiter, generations, summaries=None, attachments=None,
+                   cache=None, dispatch=None, generator=None, settings=None, background_threads=8):
+    """Assemble the standard stages for a platform adapter.
+
+    The adapter provides bot_name, channel_allowed(context) and send(request, text),
+    and optionally dropped(request, stage name), called when a request ends without
+    a reply (e.g. to settle a platform's pending response).
+    settings (the adapter if not given, e.g. a Services) optionally provides
+    deadline (seconds before a partial reply is sent, 0 for none) and draining
+    (True while shutting down, to turn away new questions). background_threads
+    bounds the generations running against a deadline at once.
+    """
+    settings = settings or adapter
+    stages = [
+        FilterStage(adapter),
+        ParseStage(adapter, continuations, summaries),
+        DrainStage(settings),
+        RateLimitStage(rate_limiter),
+    ]
+    if cache is not None:
+        stages.append(CacheStage(cache, continuations))
+    stages += [
+        GenerateStage(continuations, generations, summaries, attachments, cache, generator, settings,
+                      background_threads),
+        FormatStage(continuations),
+        ChunkStage(continuations),
+        SendStage(adapter),
+    ]
+    return Pipeline(stages, dispatch, on_drop=getattr(adapter, 'dropped', None))
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Message pipeline throughput benchmark
+
+Pushes a synthetic mix of chat traffic (channel chatter, mentions, repeated
+questions, DMs, continues and commands) through the shared message pipeline
+with a stub backend that answers after a fixed delay, then reports requests
+per second, end-to-end latency and the time spent in each stage. No chat
+platform or AI service is needed.
+
+Usage:
+    python pipeline_benchmark.py --messages 2000 --rate 500 --workers 8 --delay 0.05
+"""
+import argparse
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from ollama_client import OllamaClient
+from continuation import ContinuationStore, flatten_text
+from generations import ActiveGenerations
+from rate_limiter import RateLimiter
+from response_cache import ResponseCache
+from channel_summary import ChannelSummaries
+from pipeline import Request, build_pipeline
+from metrics import metrics
+
+QUESTIONS = [
+    "what is a hash table?",
+    "how do I reverse a list in python?",
+    "explain TCP vs UDP",
+    "what's the difference between a process and a thread?",
+    "recommend a good book on databases",
+]
+
+CHATTER = [
+    "morning all",
+    "anyone seen the build failures?",
+    "lunch?",
+    "the deploy finished",
+    "I'll look into it after standup",
+]
+
+class StubClient(OllamaClient):
+    """Backend that returns canned text after a fixed delay"""
+    provider = "stub"
+    provider_name = "Stub"
+
+    def __init__(self, delay, words=120):
+        super().__init__("http://stub.invalid", "stub-model")
+        self.delay = delay
+        self.text = " ".join(["lorem ipsum dolor sit amet"] * (words // 5))
+
+    def generate_partial(self, prompt, max_tokens=500, context=None, handle=None, model=None):
+        time.sleep(self.delay)
+        return {"text": self.text, "context": None, "done": True, "eval_count": max_tokens,
+                "cancelled": False, "error": False}
+
+    def context_window(self, model):
+        return None
+
+class StubAdapter:
+    """Platform adapter that counts replies instead of sending them"""
+    bot_name = "aibot"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.done = threading.Event()
+        self.expected = None
+
+    def channel_allowed(self, context):
+        return True
+
+    def send(self, request, text):
+        with self._lock:
+            self.sent += 1
+            if self.expected is not None and self.sent >= self.expected:
+                self.done.set()
+
+def synthetic_messages(count, users, channels, seed):
+    """Build a mixed stream of requests, returning (requests, expected replies)"""
+    rng = random.Random(seed)
+    requests, expected = [], 0
+    for _ in range(count):
+        user = f"user{rng.randrange(users)}"
+        channel = f"#chan{rng.randrange(channels)}"
+        roll = rng.random()
+        if roll < 0.5:
+            requests.append(Request('bench', user, channel, rng.choice(CHATTER)))
+            continue
+        if roll < 0.8:
+            text = f"aibot: {rng.choice(QUESTIONS)}"
+            requests.append(Request('bench', user, channel, text))
+        elif roll < 0.9:
+            requests.append(Request('bench', user, user, rng.choice(QUESTIONS), direct=True))
+        elif roll < 0.97:
+            requests.append(Request('bench', user, user, "continue", direct=True))
+        else:
+            requests.append(Request('bench', user, channel, "!stats"))
+        expected += 1
+    return requests, expected
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure message pipeline throughput with a stub backend")
+    parser.add_argument('--messages', type=int, default=2000, help="Messages to send (default: 2000)")
+    parser.add_argument('--users', type=int, default=50, help="Distinct users (default: 50)")
+    parser.add_argument('--channels', type=int, default=5, help="Distinct channels (default: 5)")
+    parser.add_argument('--workers', type=int, default=8, help="Generation worker threads (default: 8)")
+    parser.add_argument('--delay', type=float, default=0.05, help="Stub backend latency in seconds (default: 0.05)")
+    parser.add_argument('--rate', type=float, default=500, help="Messages per second, 0 for all at once (default: 500)")
+    parser.add_argument('--no-cache', action='store_true', help="Disable the response cache")
+    parser.add_argument('--seed', type=int, default=1, help="Random seed for the message mix (default: 1)")
+    args = parser.parse_args()
+
+    client = StubClient(args.delay)
+    continuations = ContinuationStore(client, max_length=400, prepare=flatten_text, token_budget=200)
+    adapter = StubAdapter()
+    executor = ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix='bench-generate')
+    pipeline = build_pipeline(
+        adapter, continuations, RateLimiter(), ActiveGenerations(),
+        summaries=ChannelSummaries({'update_every': 0}, complete=continuations.complete),
+        cache=ResponseCache({'enabled': not args.no_cache}),
+        dispatch=executor.submit
+    )
+    pipeline.timed = True
+
+    requests, expected = synthetic_messages(args.messages, args.users, args.channels, args.seed)
+    adapter.expected = expected
+    metrics.reset()
+
+    print(f"Sending {len(requests)} messages ({expected} needing a reply) with {args.workers} workers, "
+          f"backend delay {args.delay * 1000:.0f}ms")
+    start = time.perf_counter()
+    for index, request in enumerate(requests):
+        if args.rate:
+            pause = start + index / args.rate - time.perf_counter()
+            if pause > 0:
+                time.sleep(pause)
+        request.received_at = time.perf_counter()
+        pipeline.submit(request)
+    # Superseded generations don't reply, so don't wait forever for every expected reply
+    adapter.done.wait(timeout=max(10.0, expected * args.delay))
+    executor.shutdown(wait=True)
+    elapsed = time.perf_counter() - start
+
+    snapshot = metrics.snapshot()
+    print("=" * 50)
+    print(f"Replies: {adapter.sent} in {elapsed:.2f}s")
+    print(f"Throughput: {len(requests) / elapsed:.0f} messages/s, {adapter.sent / elapsed:.0f} replies/s")
+
+    latency = snapshot["timings"].get("pipeline_latency:bench")
+    if latency and latency["count"]:
+        print(f"End-to-end latency: avg {latency['total'] / latency['count'] * 1000:.1f}ms, "
+              f"max {latency['max'] * 1000:.1f}ms")
+
+    hits = snapshot["counters"].get("cache_hits", 0)
+    misses = snapshot["counters"].get("cache_misses", 0)
+    if hits + misses:
+        print(f"Cache hit rate: {hits * 100 / (hits + misses):.0f}% ({hits}/{hits + misses})")
+
+    print("=" * 50)
+    print(f"{'stage':<12} {'calls':>7} {'avg ms':>9} {'max ms':>9}")
+    for stage in pipeline.stages:
+        timing = snapshot["timings"].get(f"pipeline_stage:{stage.name}")
+        if timing and timing["count"]:
+            print(f"{stage.name:<12} {timing['count']:>7} {timing['total'] / timing['count'] * 1000:>9.3f} "
+                  f"{timing['max'] * 1000:>9.3f}")
+
+if __name__ == "__main__":
+    main()
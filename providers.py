@@ -0,0 +1,35 @@
+"""
+Factory for AI backend clients
+
+[ollama] configures the default backend; named [providers.<name>] sections
+configure extra backends that router rules can send traffic to.
+"""
+from ollama_client import OllamaClient
+from openai_client import OpenAICompatibleClient
+
+PROVIDERS = {
+    'ollama': OllamaClient,
+    'openai': OpenAICompatibleClient,
+}
+
+def create_client(settings):
+    """Create a client from an [ollama] or [providers.<name>] section"""
+    provider = settings.get('provider', 'ollama')
+    if provider not in PROVIDERS:
+        raise ValueError(f"Unsupported provider: {provider}")
+
+    kwargs = {
+        'base_url': settings['base_url'],
+        'model': settings['model'],
+        'timeout': settings.get('timeout', 30),
+        'pool_size': settings.get('pool_size', 10),
+        'catalog_ttl': settings.get('catalog_ttl', 60),
+        'prompt_overflow': settings.get('prompt_overflow', 'truncate'),
+        'chars_per_token': settings.get('chars_per_token', 4),
+        'options': settings.get('options'),
+        'model_options': settings.get('model_options'),
+    }
+    if provider == 'openai':
+        kwargs['api_key'] = settings.get('api_key')
+
+    return PROVIDERS[provider](**kwargs)
@@ -0,0 +1,103 @@
+"""
+Token-bucket rate limiting shared by the platform clients
+
+Buckets are kept per user, per channel and globally. Per-key state is a small
+[tokens, last_update] pair in an LRU-ordered dict capped at max_tracked entries,
+so memory stays bounded no matter how many distinct users talk to the bot.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+from metrics import metrics
+
+class RateLimiter:
+    def __init__(self, config=None):
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()  # key: "scope:name", value: [tokens, last_update]
+        self.configure(config)
+
+    def configure(self, config=None):
+        """Apply [rate_limit] settings, keeping existing bucket state"""
+        config = config or {}
+
+        # scope: (tokens per second, burst size)
+        limits = {
+            'user': (config.get('user_per_minute', 6) / 60.0, config.get('user_burst', 3)),
+            'channel': (config.get('channel_per_minute', 20) / 60.0, config.get('channel_burst', 5)),
+            'global': (config.get('global_per_minute', 60) / 60.0, config.get('global_burst', 10)),
+        }
+
+        with self._lock:
+            self.enabled = config.get('enabled', False)
+            self.exempt_users = set(config.get('exempt_users', []))
+            self.max_tracked = config.get('max_tracked', 10000)
+            self.message = config.get(
+                'message', "You're sending requests a little fast. Please try again in {seconds}s."
+            )
+            self.limits = limits
+
+    def check(self, user, channel=None, scope=""):
+        """Consume one request for user/channel.
+
+        scope qualifies the user name where the same name can be different
+        people, such as "libera/" for a nick on one of several IRC networks.
+        Exempt users match with or without it.
+
+        Returns 0 if the request is allowed, otherwise the number of seconds
+        until it would be.
+        """
+        if not self.enabled:
+            return 0
+
+        if user in self.exempt_users or f"{scope}{user}" in self.exempt_users:
+            metrics.incr("rate_limit_exempt")
+            return 0
+
+        keys = [('user', f"user:{scope}{user}"), ('global', "global:")]
+        if channel and channel != f"{scope}{user}" and channel != user:
+            keys.insert(1, ('channel', f"channel:{channel}"))
+
+        now = time.monotonic()
+        with self._lock:
+            # Only consume tokens once every scope has room, so a request
+            # rejected at one level doesn't drain the others
+            buckets = []
+            for scope, key in keys:
+                bucket = self._refill(scope, key, now)
+                if bucket[0] < 1:
+                    rate = self.limits[scope][0]
+                    metrics.incr(f"rate_limited_{scope}")
+                    return (1 - bucket[0]) / rate if rate > 0 else float('inf')
+                buckets.append(bucket)
+
+            for bucket in buckets:
+                bucket[0] -= 1
+
+            metrics.set_gauge("rate_limit_tracked_keys", len(self._buckets))
+
+        metrics.incr("rate_limit_allowed")
+        return 0
+
+    def limit_message(self, retry_after):
+        """Format the polite reply for a rate-limited request"""
+        seconds = max(1, math.ceil(retry_after)) if retry_after != float('inf') else 60
+        return self.message.format(seconds=seconds)
+
+    def _refill(self, scope, key, now):
+        """Return the bucket for key, topped up for the time since its last use"""
+        rate, burst = self.limits[scope]
+
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = [float(burst), now]
+            self._buckets[key] = bucket
+            # Evict the least recently used keys; they simply start full next time
+            while len(self._buckets) > self.max_tracked:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(float(burst), bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+
+        return bucket
@@ -0,0 +1,116 @@
+"""
+Cache of complete answers to repeated prompts
+
+Identical questions (after normalizing case and whitespace) asked within ttl
+seconds are answered from the cache instead of the backend. Entries are kept
+in an LRU-ordered dict capped at max_entries. Only complete, successful
+answers are cached. With a durable state store, answers are also saved there
+and survive restarts.
+
+The cache also keeps a bounded history of which cacheable prompts are asked
+and how often, which the cache warmer uses to regenerate popular answers
+while the bot is idle.
+"""
+import threading
+import time
+from collections import OrderedDict
+from metrics import metrics
+
+def normalize_prompt(prompt):
+    """Normalize a prompt for cache lookups"""
+    return ' '.join(prompt.lower().split())
+
+class ResponseCache:
+    def __init__(self, config=None, state=None):
+        self.state = state  # Optional state store used as a second, durable tier
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key: cache key, value: (text, monotonic expiry time, warmed)
+        self._history = OrderedDict()  # key: cache key, value: [prompt, context, times asked, last asked]
+        self.configure(config)
+
+    def configure(self, config=None):
+        """Apply [cache] settings, keeping cached answers"""
+        config = config or {}
+        with self._lock:
+            self.enabled = config.get('enabled', False)
+            self.ttl = config.get('ttl', 3600)
+            self.max_entries = config.get('max_entries', 1000)
+            self.history_size = config.get('history_size', 1000)  # Prompts remembered for warming
+            self._trim()
+
+    def get(self, key):
+        """Return the cached answer for key, or None"""
+        if not self.enabled:
+            return None
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= now:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        if entry is None and self.state is not None and self.state.durable:
+            text = self.state.get("cache", key)
+            if text is not None:
+                # The store keeps its own expiry, so the restored entry gets a fresh ttl
+                with self._lock:
+                    entry = self._entries[key] = (text, now + self.ttl, False)
+                    self._trim()
+
+        metrics.incr("cache_hits" if entry is not None else "cache_misses")
+        if entry is not None and entry[2]:
+            metrics.incr("cache_warm_hits")  # A generation saved by warming
+        return entry[0] if entry is not None else None
+
+    def put(self, key, text, warmed=False):
+        """Cache an answer (warmed=True for answers generated ahead of time)"""
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self._entries[key] = (text, time.monotonic() + self.ttl, warmed)
+            self._entries.move_to_end(key)
+            self._trim()
+            metrics.set_gauge("cache_entries", len(self._entries))
+        if self.state is not None and self.state.durable:
+            self.state.put("cache", key, text, ttl=self.ttl)
+
+    def record(self, key, prompt, context):
+        """Note that a cacheable prompt was asked"""
+        if not self.enabled:
+            return
+
+        with self._lock:
+            entry = self._history.get(key)
+            if entry is None:
+                entry = self._history[key] = [prompt, context, 0, 0.0]
+            entry[2] += 1
+            entry[3] = time.monotonic()
+            self._history.move_to_end(key)
+            while len(self._history) > self.history_size:
+                self._history.popitem(last=False)
+
+    def warm_candidates(self, min_asks, horizon, max_age, limit=10):
+        """Prompts asked at least min_asks times, most recently within max_age seconds,
+        whose answers are missing or expire within horizon seconds.
+
+        Returns (key, prompt, context) tuples, most asked first.
+        """
+        now = time.monotonic()
+        with self._lock:
+            candidates = [
+                (asks, last_asked, key, prompt, context)
+                for key, (prompt, context, asks, last_asked) in self._history.items()
+                if asks >= min_asks and now - last_asked < max_age
+                and (key not in self._entries or self._entries[key][1] - now < horizon)
+            ]
+        candidates.sort(reverse=True)
+        return [(key, prompt, context) for _, _, key, prompt, context in candidates[:limit]]
+
+    def _trim(self):
+        # Caller holds the lock
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
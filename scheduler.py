@@ -0,0 +1,149 @@
+"""
+Model-affinity scheduling of generation requests
+
+Generations are queued and run on a fixed number of slots (matching how many
+requests Ollama processes in parallel). When picking the next job, requests
+for models that are already loaded in Ollama (from /api/ps) or currently
+running are preferred over ones that would force a model swap, with the model
+that ran most recently preferred over other loaded models. A job that has
+waited longer than the fairness window is always taken next, so no model's
+requests starve.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+class _Job:
+    __slots__ = ('model', 'fn', 'future', 'enqueued_at')
+
+    def __init__(self, model, fn):
+        self.model = model
+        self.fn = fn
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+class GenerationScheduler:
+    def __init__(self, ollama_client, config=None):
+        self._cond = threading.Condition()
+        self._queue = []              # Jobs in arrival order
+        self._running = {}            # key: model, value: jobs in progress
+        self._resident = set()        # Models loaded in Ollama
+        self._resident_at = 0.0       # monotonic time of the last /api/ps refresh
+        self._last_model = None       # Model of the most recently dispatched job
+        self._worker_count = 0
+        self.configure(ollama_client, config)
+
+    def configure(self, ollama_client, config=None):
+        """Apply [scheduler] settings, starting workers if more slots are needed"""
+        config = config or {}
+
+        with self._cond:
+            self.ollama_client = ollama_client
+            self.enabled = config.get('enabled', False)
+            self.slots = max(1, config.get('slots', 2))
+            self.fairness_window = config.get('fairness_window', 10)
+            self.resident_ttl = config.get('resident_ttl', 5)
+            self._resident_at = 0.0
+
+            if self.enabled:
+                while self._worker_count < self.slots:
+                    self._worker_count += 1
+                    threading.Thread(
+                        target=self._worker, name=f"scheduler-{self._worker_count}", daemon=True
+                    ).start()
+            # Surplus workers exit on their own once they see the lower slot count
+            self._cond.notify_all()
+
+    def run(self, model, fn):
+        """Run fn (a generation for model) on a scheduler slot and return its result"""
+        if not self.enabled:
+            return fn()
+
+        job = _Job(model, fn)
+        with self._cond:
+            self._queue.append(job)
+            metrics.set_gauge("scheduler_queue_depth", len(self._queue))
+            self._cond.notify()
+        return job.future.result()
+
+    def queue_depth(self):
+        """Number of jobs waiting for a slot"""
+        with self._cond:
+            return len(self._queue)
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._queue and self._worker_count <= self.slots:
+                    self._cond.wait()
+                if self._worker_count > self.slots:
+                    self._worker_count -= 1
+                    return
+
+            # Ask Ollama what is loaded (outside the lock) before choosing
+            self._refresh_resident()
+
+            with self._cond:
+                if not self._queue:
+                    continue  # Another worker took it
+                job = self._pick()
+                self._queue.remove(job)
+                metrics.set_gauge("scheduler_queue_depth", len(self._queue))
+
+                if job.model not in self._loaded_models():
+                    metrics.incr("model_swaps")
+                    logger.info(f"Scheduling {job.model}, which is not loaded yet")
+                self._last_model = job.model
+                self._running[job.model] = self._running.get(job.model, 0) + 1
+
+            metrics.observe("scheduler_wait", time.monotonic() - job.enqueued_at)
+
+            try:
+                job.future.set_result(job.fn())
+            except Exception as e:
+                job.future.set_exception(e)
+            finally:
+                with self._cond:
+                    self._running[job.model] -= 1
+
+    def _pick(self):
+        """Choose the next job; called with the lock held and a non-empty queue"""
+        oldest = self._queue[0]
+        if time.monotonic() - oldest.enqueued_at >= self.fairness_window:
+            if len(self._queue) > 1:
+                metrics.incr("scheduler_fairness_picks")
+            return oldest
+
+        # Prefer the models in use right now, then anything else Ollama has loaded
+        active = {model for model, count in self._running.items() if count}
+        active.add(self._last_model)
+        for preferred in (active, self._loaded_models()):
+            for job in self._queue:
+                if job.model in preferred:
+                    if job is not oldest:
+                        metrics.incr("scheduler_affinity_picks")
+                    return job
+        return oldest
+
+    def _loaded_models(self):
+        """Models believed to be loaded; called with the lock held"""
+        loaded = {model for model, count in self._running.items() if count}
+        loaded.add(self._last_model)
+        return loaded | self._resident
+
+    def _refresh_resident(self):
+        """Refresh the loaded model list from /api/ps when it is stale"""
+        with self._cond:
+            if time.monotonic() - self._resident_at < self.resident_ttl:
+                return
+            self._resident_at = time.monotonic()
+            ollama_client = self.ollama_client
+
+        resident = ollama_client.running_models()
+        if resident is not None:
+            with self._cond:
+                self._resident = set(resident)
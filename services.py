@@ -0,0 +1,146 @@
+"""
+Generation services shared by the platform clients
+
+Everything between a platform's connection and the backend is the same for
+IRC, Discord and Slack: the backend client and model router, the generation
+scheduler, state store, continuation store, summaries, rate limiter,
+response cache and warmer, worker pool, the outbound send queue and the
+message pipeline. A platform client creates one Services for its platform
+and only handles the platform's I/O itself; reloads, draining and shutdown
+go through the Services as well.
+"""
+import logging
+from providers import create_client
+from model_router import ModelRouter
+from scheduler import GenerationScheduler
+from generations import ActiveGenerations
+from continuation import ContinuationStore
+from long_input import LongInputProcessor
+from attachments import AttachmentStore
+from channel_summary import ChannelSummaries
+from response_cache import ResponseCache
+from cache_warmer import CacheWarmer
+from state_store import create_state_store
+from pipeline import build_pipeline
+from workers import create_worker_pool
+from outbound import SendQueue
+from rate_limiter import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+class Services:
+    def __init__(self, config, platform, max_length, prepare, token_budget, send_limit=None, file_input=True):
+        """Create the services for a platform.
+
+        max_length and prepare are passed to the continuation store, and
+        token_budget is the default for [<platform>] token_budget. send_limit
+        is the platform's message size for the outbound send queue (None for
+        platforms that pace their own sends), and file_input enables long
+        input handling and attachments.
+        """
+        self.platform = platform
+        self.default_token_budget = token_budget
+        platform_config = config[platform]
+
+        self.ollama_client = create_client(config['ollama'])
+        self.router = ModelRouter(self.ollama_client, config, platform)
+        self.scheduler = GenerationScheduler(self.ollama_client, config.get('scheduler'))
+        self.long_input = LongInputProcessor(config.get('long_input')) if file_input else None
+        self.state = create_state_store(config.get('state'))
+
+        # Store full responses for continuation
+        self.continuations = ContinuationStore(
+            self.ollama_client,
+            max_length=max_length,
+            prepare=prepare,
+            token_budget=platform_config.get('token_budget', token_budget),
+            lazy=config['ollama'].get('lazy_generation', False),
+            router=self.router,
+            scheduler=self.scheduler,
+            long_input=self.long_input,
+            state=self.state
+        )
+
+        self.attachments = AttachmentStore(
+            config.get('attachments'), summarize=self.continuations.summarize
+        ) if file_input else None
+        self.summaries = ChannelSummaries(config.get('summaries'), complete=self.continuations.complete)
+
+        self.rate_limiter = RateLimiter(config.get('rate_limit'))
+        self.deadline = platform_config.get('deadline', 0)  # Seconds before a partial reply is sent, 0 for none
+        # Generations with a deadline run on their own threads; by default a few per backend slot
+        self.background_threads = platform_config.get('background_threads', 0) \
+            or 4 * max(1, config.get('scheduler', {}).get('slots', 2))
+        self.draining = False  # Set on shutdown; new questions get a "restarting" reply
+        self.generations = ActiveGenerations()
+        self.cache = ResponseCache(config.get('cache'), state=self.state)
+        self.workers = create_worker_pool(config, platform, self.continuations)
+
+        # Replies are paced per channel and merged by the send queue
+        self.outbound = None
+        if send_limit is not None:
+            self.outbound = SendQueue(platform, send_limit, config.get('outbound'))
+            self.outbound.start()
+
+        # Regenerates popular cached answers while nobody is waiting on the backend
+        self.warmer = CacheWarmer(self.cache, self.workers or self.continuations, self.generations,
+                                  self.scheduler, config.get('cache'), workers=self.workers)
+        self.warmer.start()
+
+        self.pipeline = None
+        self.config = config
+
+    def build_pipeline(self, adapter, dispatch=None):
+        """Create the message pipeline for the platform client (see pipeline.build_pipeline)"""
+        self.pipeline = build_pipeline(
+            adapter, self.continuations, self.rate_limiter, self.generations,
+            summaries=self.summaries, attachments=self.attachments, cache=self.cache,
+            dispatch=dispatch, generator=self.workers, settings=self,
+            background_threads=self.background_threads
+        )
+        return self.pipeline
+
+    def apply(self, config):
+        """Apply a reloaded configuration"""
+        platform_config = config[self.platform]
+
+        ollama_client = create_client(config['ollama'])
+        self.continuations.configure(
+            ollama_client,
+            token_budget=platform_config.get('token_budget', self.default_token_budget),
+            lazy=config['ollama'].get('lazy_generation', False)
+        )
+        self.ollama_client = ollama_client
+        self.router.configure(ollama_client, config)
+        self.scheduler.configure(ollama_client, config.get('scheduler'))
+        if self.long_input is not None:
+            self.long_input.configure(config.get('long_input'))
+        if self.attachments is not None:
+            self.attachments.configure(config.get('attachments'))
+        self.summaries.configure(config.get('summaries'))
+        self.rate_limiter.configure(config.get('rate_limit'))
+        self.deadline = platform_config.get('deadline', 0)
+        self.cache.configure(config.get('cache'))
+        self.warmer.configure(config.get('cache'))
+        self.state.configure(config.get('state'))
+        if self.outbound is not None:
+            self.outbound.configure(config.get('outbound'))
+        if self.workers is not None:
+            self.workers.configure(config)
+        self.config = config
+
+    def drain(self, grace):
+        """Turn away new questions and let in-flight ones finish for up to grace seconds"""
+        logger.info(f"Draining before shutdown (grace period {grace}s)")
+        self.draining = True
+        self.warmer.enabled = False
+        self.pipeline.drain(self.generations, grace)
+
+    def close(self):
+        """Cancel what is still running, send queued replies and save state (blocks)"""
+        self.generations.cancel_all("shutdown")
+        if self.outbound is not None:
+            self.outbound.flush()
+        if self.workers is not None:
+            self.workers.stop()
+        self.state.close()
@@ -2,10 +2,16 @@
 Slack client implementation for the AI bot using Socket Mode
 """
 import logging
-import re
+import threading
 from slack_bolt import App
 from slack_bolt.adapter.socket_mode import SocketModeHandler
-from ollama_client import OllamaClient
+from slack_sdk.errors import SlackApiError
+from continuation import normalize_lines
+from attachments import Attachment
+from pipeline import Request
+from services import Services
+from outbound import RateLimited
+from metrics import metrics
 
 logger = logging.getLogger(__name__)
 
@@ -19,19 +25,28 @@ class SlackBot:
         self.app_token = slack_config['app_token']
         self.channel = slack_config.get('channel', 'general')
         
-        # Initialize Slack Bolt app
-        self.app = App(token=self.token)
-        
-        self.ollama_client = OllamaClient(
-            base_url=config['ollama']['base_url'],
-            model=config['ollama']['model']
+        # Initialize Slack Bolt app. Token verification is done once by
+        # _get_bot_user_id below rather than again inside Bolt.
+        self.app = App(token=self.token, token_verification_enabled=False)
+        
+        # Replies go through the send queue, so chat.postMessage limits don't
+        # hold up Bolt's event threads
+        self.services = Services(
+            config, 'slack',
+            max_length=3800,  # Slack has 4000 char limit
+            prepare=lambda text: normalize_lines(self.format_for_slack(text)),
+            token_budget=1200,
+            send_limit=4000
         )
+        self.generations = self.services.generations
+        self._stopped = threading.Event()
         
-        # Store full responses for continuation
-        self.stored_responses = {}  # key: "user@channel", value: {"full_text": str, "position": int}
+        # Bolt runs each event on its own worker thread, so the whole pipeline runs inline
+        self.pipeline = self.services.build_pipeline(self)
         
-        # Event deduplication - store recent event IDs to prevent duplicates
-        self.processed_events = set()  # Store recent event IDs
+        # Event deduplication - recent event IDs are kept in the state store for
+        # dedup_ttl seconds, so redeliveries after a restart are caught as well
+        self.dedup_ttl = slack_config.get('dedup_ttl', 600)
         
         # Get bot user ID
         self.bot_user_id = None
@@ -42,6 +57,19 @@ class SlackBot:
         
         logger.info("Slack Bot initialized with Socket Mode")
     
+    def apply_config(self, config):
+        """Apply a reloaded configuration without reconnecting"""
+        slack_config = config['slack']
+        
+        if (slack_config['token'], slack_config['app_token']) != (self.token, self.app_token):
+            logger.warning("Changing Slack tokens requires a restart; keeping the current connection")
+        
+        self.services.apply(config)
+        self.bot_name = config['bot_name']
+        self.channel = slack_config.get('channel', 'general')
+        self.dedup_ttl = slack_config.get('dedup_ttl', 600)
+        self.config = config
+    
     def format_for_slack(self, text):
         """Format AI response with Slack markdown"""
         if not text:
@@ -108,25 +136,24 @@ class SlackBot:
             logger.info(f"App mention details: {event}")
             
             # Check for duplicate events
-            if event_id in self.processed_events:
+            if self.is_duplicate(event_id):
                 logger.warning(f"Duplicate app mention event detected and skipped: {event_id}")
                 return
             
-            # Add to processed events (keep last 100 to prevent memory growth)
-            self.processed_events.add(event_id)
-            if len(self.processed_events) > 100:
-                # Remove oldest events (convert to list, remove first 50, convert back)
-                event_list = list(self.processed_events)
-                self.processed_events = set(event_list[50:])
-            
             logger.info(f"Processing app mention: {event_id}")
-            self.handle_mention(event, say)
+            self.submit(event, say, addressed=True)
         
         # Handle direct messages
         @self.app.event("message")
         def handle_message_events(event, say, logger):
-            # Skip if this is a subtype (like bot_message, message_changed, etc.)
-            if event.get("subtype"):
+            # Cancel the generation for a deleted message
+            if event.get("subtype") == "message_deleted":
+                self.generations.cancel_message(event.get("deleted_ts"))
+                return
+            
+            # Skip if this is a subtype (like bot_message, message_changed, etc.);
+            # file_share is a regular message with files attached
+            if event.get("subtype") and event.get("subtype") != "file_share":
                 logger.debug(f"Skipping message subtype: {event.get('subtype')}")
                 return
             
@@ -135,30 +162,30 @@ class SlackBot:
             if self.bot_user_id and f"<@{self.bot_user_id}>" in text:
                 logger.debug(f"Skipping message with bot mention - handled by app_mention: {text}")
                 return
-                
-            # Only handle direct messages (channel type is 'im')
-            if event.get("channel_type") == "im":
-                # Create unique event ID for deduplication
-                event_id = f"{event.get('ts')}:{event.get('user')}:{event.get('channel')}"
-                
-                logger.info(f"Direct message received - Event ID: {event_id}")
-                
-                # Check for duplicate events
-                if event_id in self.processed_events:
-                    logger.warning(f"Duplicate DM event detected and skipped: {event_id}")
-                    return
-                
-                # Add to processed events
-                self.processed_events.add(event_id)
-                if len(self.processed_events) > 100:
-                    event_list = list(self.processed_events)
-                    self.processed_events = set(event_list[50:])
-                
-                logger.info(f"Processing direct message: {event_id}")
-                logger.info(f"DM details: {event}")
-                self.handle_dm(event, say)
-            else:
-                logger.debug(f"Skipping non-DM message in channel {event.get('channel')}")
+            
+            if event.get("channel_type") != "im":
+                # Channel messages feed the rolling summaries (needs channels:history)
+                self.submit(event, say, addressed=False)
+                return
+            
+            # Create unique event ID for deduplication
+            event_id = f"{event.get('ts')}:{event.get('user')}:{event.get('channel')}"
+            
+            logger.info(f"Direct message received - Event ID: {event_id}")
+            
+            # Check for duplicate events
+            if self.is_duplicate(event_id):
+                logger.warning(f"Duplicate DM event detected and skipped: {event_id}")
+                return
+            
+            logger.info(f"Processing direct message: {event_id}")
+            logger.info(f"DM details: {event}")
+            self.submit(event, say, direct=True)
+        
+        # Cancel generations for users leaving a channel
+        @self.app.event("member_left_channel")
+        def handle_member_left(event):
+            self.generations.cancel_where("left", user=event.get("user"), context=event.get("channel"))
         
         # Handle slash commands (optional)
         @self.app.command("/ping")
@@ -170,232 +197,120 @@ class SlackBot:
         def handle_models_command(ack, respond):
             ack()
             try:
-                models = self.ollama_client.get_available_models()
+                models = self.services.ollama_client.catalog.models()
                 model_list = "\n".join([f"• {model}" for model in models])
                 respond(f"Available AI models:\n{model_list}")
             except Exception as e:
                 respond(f"Error getting models: {e}")
-    
-    def is_mentioned(self, text):
-        """Check if bot is mentioned in the message"""
-        if not text:
-            return False
         
-        text_lower = text.lower()
-        bot_name_lower = self.bot_name.lower()
-        
-        # Check for user ID mention
-        if self.bot_user_id and f"<@{self.bot_user_id}>" in text:
-            return True
-        
-        # Check for name mentions
-        mentions = [
-            f"{bot_name_lower}:",
-            f"{bot_name_lower},",
-            f"{bot_name_lower} ",
-            f"@{bot_name_lower}",
-            bot_name_lower
-        ]
-        
-        return any(mention in text_lower for mention in mentions)
+        @self.app.command("/summarize")
+        def handle_summarize_command(ack, respond, command):
+            ack()
+            logger.info(f"Summary requested by {command.get('user_id')} in {command.get('channel_id')}")
+            self.pipeline.submit(Request(
+                'slack', command.get("user_id"), command.get("channel_id"), '!summarize',
+                raw={"respond": respond}
+            ))
+        
+        @self.app.command("/stats")
+        def handle_stats_command(ack, respond):
+            ack()
+            respond(metrics.format_summary())
     
-    def clean_message(self, text):
-        """Remove bot mentions and clean up the message"""
-        if not text:
-            return ""
-        
-        clean_text = text
-        
-        # Remove user ID mention
-        if self.bot_user_id:
-            clean_text = re.sub(f"<@{self.bot_user_id}>", "", clean_text)
-        
-        # Remove text mentions
-        text_lower = text.lower()
-        bot_name_lower = self.bot_name.lower()
-        
-        patterns_to_remove = [
-            f"{bot_name_lower}:",
-            f"{bot_name_lower},",
-            f"@{bot_name_lower}",
-            bot_name_lower
-        ]
-        
-        for pattern in patterns_to_remove:
-            clean_text = re.sub(pattern, "", clean_text, flags=re.IGNORECASE)
-        
-        return clean_text.strip()
+    def is_duplicate(self, event_id):
+        """Check and remember an event ID, since Slack can deliver an event more than once"""
+        return not self.services.state.add_if_absent("slack_events", event_id, ttl=self.dedup_ttl)
     
-    def handle_dm(self, event, say):
-        """Handle direct messages"""
+    def submit(self, event, say, direct=False, addressed=None):
+        """Turn a message event into a pipeline request"""
         user = event.get("user")
-        text = event.get("text", "")
         
         # Skip bot messages
-        if user == self.bot_user_id:
+        if not user or user == self.bot_user_id:
             return
         
-        logger.info(f"DM from {user}: {text}")
-        
-        # Check for continue command
-        if text.lower().strip() in ['continue', 'cont', 'more']:
-            self.handle_continue(say, user, user)  # DM context
-            return
-        
-        try:
-            # Generate AI response
-            full_response = self.ollama_client.generate_full_response(text)
-            formatted_response = self.format_for_slack(full_response)
-            chunked_response = self.get_first_chunk(formatted_response, user, user)
-            
-            # Send response
-            say(chunked_response)
-            
-            logger.info(f"Sent DM response to {user}")
-        
-        except Exception as e:
-            logger.error(f"Error handling DM: {e}")
-            say("Sorry, I encountered an error processing your message.")
-    
-    def handle_mention(self, event, say):
-        """Handle mentions in channels"""
-        user = event.get("user")
         text = event.get("text", "")
-        channel = event.get("channel")
-        
-        # Skip bot messages
-        if user == self.bot_user_id:
-            return
-        
-        clean_text = self.clean_message(text)
+        if self.bot_user_id:
+            text = text.replace(f"<@{self.bot_user_id}>", "")
+        
+        # Private file URLs need the bot token (and the files:read scope)
+        attachments = [
+            Attachment(file.get("id"), file.get("name", ""),
+                       file.get("url_private_download") or file.get("url_private"),
+                       file.get("size"), file.get("mimetype"),
+                       headers={"Authorization": f"Bearer {self.token}"})
+            for file in event.get("files", [])
+            if file.get("url_private_download") or file.get("url_private")
+        ]
         
-        # Check if the cleaned message is a continue command
-        if clean_text.lower().strip() in ['continue', 'cont', 'more']:
-            logger.info(f"Continue command from {user} in {channel}")
-            self.handle_continue(say, user, channel)
+        context = user if direct else event.get("channel")
+        self.pipeline.submit(Request(
+            'slack', user, context, text, direct=direct, addressed=addressed,
+            message_id=event.get("ts"), attachments=attachments, raw={"say": say, "channel": event.get("channel")}
+        ))
+    
+    def channel_allowed(self, context):
+        """The bot only receives events from channels it was added to"""
+        return True
+    
+    def send(self, request, text):
+        """Queue a reply with say(), or respond() for slash commands"""
+        if "respond" in request.raw:
+            respond = request.raw["respond"]
+            self.services.outbound.put(f"respond:{id(respond)}", lambda text: self.deliver(respond, text), text,
+                              mergeable=False)
             return
         
-        logger.info(f"Mentioned in {channel} by {user}: {clean_text}")
-        
-        try:
-            # Generate AI response
-            full_response = self.ollama_client.generate_full_response(clean_text)
-            formatted_response = self.format_for_slack(full_response)
-            chunked_response = self.get_first_chunk(formatted_response, user, channel)
-            
-            # Send response with user mention
-            say(f"<@{user}>: {chunked_response}")
-            
-            logger.info(f"Sent mention response in {channel}")
-        
-        except Exception as e:
-            logger.error(f"Error handling mention: {e}")
-            say(f"<@{user}>: Sorry, I encountered an error processing your message.")
+        if not request.direct:
+            text = f"<@{request.user}>: {text}"
+        say = request.raw["say"]
+        self.services.outbound.put(request.raw["channel"], lambda text: self.deliver(say, text), text)
+        logger.info(f"Queued response to {request.user} in {request.context}")
     
-    def get_first_chunk(self, full_text, user, context):
-        """Get the first chunk of text and store the rest for continuation"""
-        key = f"{user}@{context}"
-        
-        # Preserve markdown formatting - don't collapse newlines completely
-        clean_text = full_text.replace('\r\n', '\n').replace('\r', '\n')
-        # Only normalize excessive whitespace within lines
-        lines = clean_text.split('\n')
-        clean_lines = [' '.join(line.split()) for line in lines]
-        clean_text = '\n'.join(clean_lines)
-        
-        # Reserve space for the continuation message
-        continuation_msg = " (say 'continue' for more)"
-        max_content_length = 3800 - len(continuation_msg)  # Slack has 4000 char limit
-        
-        if len(clean_text) <= max_content_length:
-            # Text fits in one message, no need to store
-            if key in self.stored_responses:
-                del self.stored_responses[key]
-            return clean_text
-        
-        # Find a good break point (prefer ending at word boundary)
-        chunk_end = max_content_length - 3  # Reserve space for "..."
-        
-        # Try to break at a word boundary
-        space_pos = clean_text.rfind(' ', 0, chunk_end)
-        if space_pos > chunk_end - 50:  # Only use word boundary if it's not too far back
-            chunk_end = space_pos
-        
-        # Store full text for continuation
-        self.stored_responses[key] = {
-            "full_text": clean_text,
-            "position": chunk_end
-        }
-        
-        # Return first chunk with continuation indicator
-        first_chunk = clean_text[:chunk_end] + "..."
-        return f"{first_chunk}{continuation_msg}"
+    def deliver(self, reply, text):
+        """Send with say() or respond(), turning HTTP 429s into a retry for the send queue"""
+        try:
+            reply(text)
+        except SlackApiError as e:
+            if e.response.status_code != 429:
+                raise
+            retry_after = next((value for name, value in e.response.headers.items()
+                                if name.lower() == "retry-after"), 1)
+            if isinstance(retry_after, list):
+                retry_after = retry_after[0]
+            # Web API limits are per method across the workspace, so pause every channel
+            raise RateLimited(float(retry_after), is_global=True)
     
-    def handle_continue(self, say, user, context):
-        """Handle continue requests"""
-        key = f"{user}@{context}"
-        
-        if key not in self.stored_responses:
-            response = "No previous message to continue."
-        else:
-            stored = self.stored_responses[key]
-            full_text = stored["full_text"]
-            start_pos = stored["position"]
-            
-            if start_pos >= len(full_text):
-                response = "End of message reached."
-                del self.stored_responses[key]
-            else:
-                # Get next chunk
-                remaining_text = full_text[start_pos:]
-                continuation_msg = " (say 'continue' for more)"
-                max_content_length = 3800 - len(continuation_msg)
-                
-                if len(remaining_text) <= max_content_length:
-                    # This is the last chunk
-                    response = remaining_text
-                    del self.stored_responses[key]
-                else:
-                    # More chunks remain - find good break point
-                    chunk_end = max_content_length - 3  # Reserve space for "..."
-                    
-                    # Try to break at word boundary
-                    space_pos = remaining_text.rfind(' ', 0, chunk_end)
-                    if space_pos > chunk_end - 50:  # Only use word boundary if it's not too far back
-                        chunk_end = space_pos
-                    
-                    chunk = remaining_text[:chunk_end] + "..."
-                    self.stored_responses[key]["position"] = start_pos + chunk_end
-                    response = f"{chunk}{continuation_msg}"
-        
-        # Send continuation response
-        if context == user:  # DM
-            say(response)
-        else:  # Channel
-            say(f"<@{user}>: {response}")
-        
-        logger.info(f"Sent continuation to {user} in {context}")
+    def shutdown(self, grace):
+        """Drain in-flight requests for up to grace seconds, then stop the bot (any thread)"""
+        self.services.drain(grace)
+        # start_bot flushes the send queue and closes the state store on its way out
+        self._stopped.set()
     
     def start_bot(self):
         """Start the Slack bot with Socket Mode"""
         try:
             logger.info("Starting Slack bot with Socket Mode...")
             
-            # Test connection
-            response = self.app.client.auth_test()
-            if not response["ok"]:
+            # The auth check already ran in __init__
+            if not self.bot_user_id:
                 raise Exception("Failed to authenticate with Slack")
             
             logger.info("Successfully connected to Slack")
             
             # Start Socket Mode handler
             handler = SocketModeHandler(self.app, self.app_token)
+            handler.connect()
             logger.info("Socket Mode handler started - bot is now running in real-time!")
-            handler.start()
+            # Runs until shutdown() has drained the pipeline
+            self._stopped.wait()
+            handler.close()
             
         except Exception as e:
             logger.error(f"Error starting Slack bot: {e}")
             raise
+        finally:
+            self.services.close()
 
 def run_slack_bot(config):
     """Function to run the Slack bot"""
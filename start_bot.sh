@@ -8,7 +8,7 @@ echo "=================================="
 source venv/bin/activate
 
 # Start the bot
-python main.py
+python main.py "$@"
 
 # Deactivate when done
 deactivate
\ No newline at end of file
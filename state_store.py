@@ -0,0 +1,277 @@
+"""
+Pluggable storage for bot state that should survive restarts
+
+Continuations, Slack event IDs and cached answers are kept in a state store.
+The default memory store keeps them in process memory as before. The SQLite
+store keeps them in a WAL-mode database file, so stored responses survive
+restarts and several bot processes on one host can share them. Writes are
+buffered and flushed by a background thread in one transaction, so they
+never wait on disk in the reply path; reads check the unflushed writes
+first. Expired entries are compacted in the background.
+"""
+import atexit
+import json
+import logging
+import sqlite3
+import threading
+import time
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+class MemoryStore:
+    """State kept in process memory (lost on restart)"""
+    durable = False
+
+    def __init__(self, config=None):
+        self._lock = threading.Lock()
+        self._entries = {}  # key: (namespace, key), value: (value, expiry time or None)
+        self._last_compaction = time.time()
+        self.configure(config)
+
+    def configure(self, config=None):
+        """Apply [state] settings"""
+        config = config or {}
+        self.ttl = config.get('ttl', 86400)                    # Default lifetime of an entry
+        self.compact_interval = config.get('compact_interval', 300)
+
+    def get(self, namespace, key):
+        """Return a stored value, or None"""
+        with self._lock:
+            entry = self._entries.get((namespace, key))
+        if entry is None or (entry[1] is not None and entry[1] <= time.time()):
+            return None
+        return entry[0]
+
+    def put(self, namespace, key, value, ttl=None):
+        """Store a value for ttl seconds (the store's default if not given)"""
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            self._entries[(namespace, key)] = (value, time.time() + ttl if ttl else None)
+        self._maybe_compact()
+
+    def delete(self, namespace, key):
+        """Remove a value"""
+        with self._lock:
+            self._entries.pop((namespace, key), None)
+
+    def add_if_absent(self, namespace, key, ttl=None):
+        """Record a key, returning False if it was already recorded (for deduplication)"""
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get((namespace, key))
+            if entry is not None and (entry[1] is None or entry[1] > now):
+                return False
+            self._entries[(namespace, key)] = (True, now + ttl if ttl else None)
+        self._maybe_compact()
+        return True
+
+    def close(self):
+        pass
+
+    def _maybe_compact(self):
+        now = time.time()
+        if now - self._last_compaction < self.compact_interval:
+            return
+        self._last_compaction = now
+        with self._lock:
+            expired = [key for key, (_, expires) in self._entries.items() if expires is not None and expires <= now]
+            for key in expired:
+                del self._entries[key]
+        metrics.incr("state_compacted", len(expired))
+
+class SQLiteStore:
+    """State kept in a SQLite database in WAL mode, shareable between processes"""
+    durable = True
+
+    def __init__(self, config=None):
+        config = config or {}
+        self.path = config.get('path', 'bot_state.db')
+        self._lock = threading.Lock()
+        self._pending = {}  # key: (namespace, key), value: (JSON value or None to delete, expiry time)
+        self._local = threading.local()
+        self._wake = threading.Event()
+        self._closed = False
+        self.configure(config)
+
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS state ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires REAL, "
+                "PRIMARY KEY (namespace, key))"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS state_expires ON state (expires)")
+
+        self._writer = threading.Thread(target=self._run, name="state-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+        logger.info(f"Using SQLite state store at {self.path}")
+
+    def configure(self, config=None):
+        """Apply [state] settings (changing the path needs a restart)"""
+        config = config or {}
+        if config.get('path', self.path) != self.path:
+            logger.warning("Changing the state store path requires a restart")
+        self.ttl = config.get('ttl', 86400)
+        self.flush_interval = config.get('flush_interval', 0.5)  # Seconds between batched writes
+        self.compact_interval = config.get('compact_interval', 300)
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=5)
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def _reader(self):
+        # sqlite3 connections can't be shared between threads
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = self._connect()
+        return db
+
+    def _recorder(self):
+        # add_if_absent() writes on its own per-thread connection, so a write
+        # waiting on another process's lock never holds up reads
+        db = getattr(self._local, 'recorder', None)
+        if db is None:
+            db = self._local.recorder = self._connect()
+        return db
+
+    def get(self, namespace, key):
+        """Return a stored value, or None"""
+        with self._lock:
+            pending = self._pending.get((namespace, key))
+        if pending is not None:
+            value, expires = pending
+        else:
+            try:
+                row = self._reader().execute(
+                    "SELECT value, expires FROM state WHERE namespace = ? AND key = ?", (namespace, key)
+                ).fetchone()
+            except sqlite3.Error as e:
+                logger.error(f"Error reading state: {e}")
+                return None
+            if row is None:
+                return None
+            value, expires = row
+
+        if value is None or (expires is not None and expires <= time.time()):
+            return None
+        return json.loads(value)
+
+    def put(self, namespace, key, value, ttl=None):
+        """Store a value for ttl seconds (the store's default if not given); written in the background"""
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            self._pending[(namespace, key)] = (json.dumps(value), time.time() + ttl if ttl else None)
+
+    def delete(self, namespace, key):
+        """Remove a value; written in the background"""
+        with self._lock:
+            self._pending[(namespace, key)] = (None, None)
+
+    def add_if_absent(self, namespace, key, ttl=None):
+        """Record a key, returning False if it was already recorded (for deduplication).
+
+        Unlike put(), this is written right away, so processes sharing the
+        database agree on which of them recorded a key first. The lock is
+        only held to check the unflushed writes, not during the write.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        with self._lock:
+            pending = self._pending.pop((namespace, key), None)
+            if pending is not None and pending[0] is not None and (pending[1] is None or pending[1] > now):
+                self._pending[(namespace, key)] = pending
+                return False
+
+        try:
+            db = self._recorder()
+            with db:
+                # Expired rows (and ones deleted or expired but not yet flushed) don't count
+                db.execute(
+                    "DELETE FROM state WHERE namespace = ? AND key = ? AND (? OR expires <= ?)",
+                    (namespace, key, pending is not None, now)
+                )
+                cursor = db.execute(
+                    "INSERT OR IGNORE INTO state VALUES (?, ?, ?, ?)",
+                    (namespace, key, json.dumps(True), now + ttl if ttl else None)
+                )
+        except sqlite3.Error as e:
+            logger.error(f"Error recording state: {e}")
+            return True  # A rare duplicate is better than dropping the event
+        metrics.incr("state_writes")
+        return cursor.rowcount == 1
+
+    def _flush(self):
+        """Write buffered changes in one transaction"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        start = time.perf_counter()
+        upserts = [(namespace, key, value, expires)
+                   for (namespace, key), (value, expires) in pending.items() if value is not None]
+        deletes = [(namespace, key) for (namespace, key), (value, _) in pending.items() if value is None]
+        try:
+            with self._writer_db:
+                self._writer_db.executemany("INSERT OR REPLACE INTO state VALUES (?, ?, ?, ?)", upserts)
+                self._writer_db.executemany("DELETE FROM state WHERE namespace = ? AND key = ?", deletes)
+        except sqlite3.Error as e:
+            logger.error(f"Error writing state, retrying later: {e}")
+            with self._lock:
+                # Keep newer changes made while this flush was running
+                self._pending = {**pending, **self._pending}
+            return
+
+        metrics.incr("state_writes", len(pending))
+        metrics.observe("state_flush", time.perf_counter() - start)
+
+    def _compact(self):
+        """Delete expired entries"""
+        try:
+            with self._writer_db:
+                removed = self._writer_db.execute(
+                    "DELETE FROM state WHERE expires IS NOT NULL AND expires <= ?", (time.time(),)
+                ).rowcount
+        except sqlite3.Error as e:
+            logger.error(f"Error compacting state: {e}")
+            return
+        metrics.incr("state_compacted", removed)
+
+    def _run(self):
+        self._writer_db = self._connect()
+        last_compaction = 0.0
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self._flush()
+            if self._closed:
+                break
+            if time.monotonic() - last_compaction >= self.compact_interval:
+                last_compaction = time.monotonic()
+                self._compact()
+
+    def close(self):
+        """Flush outstanding writes and stop the writer"""
+        if self._closed:
+            return
+        self._closed = True
+        # The writer does a final flush on its own connection before exiting
+        self._wake.set()
+        self._writer.join(timeout=5)
+
+STORES = {
+    'memory': MemoryStore,
+    'sqlite': SQLiteStore,
+}
+
+def create_state_store(config=None):
+    """Create the store selected by [state] backend"""
+    config = config or {}
+    backend = config.get('backend', 'memory')
+    if backend not in STORES:
+        raise ValueError(f"Unsupported state backend: {backend}")
+    return STORES[backend](config)
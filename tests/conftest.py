@@ -0,0 +1,116 @@
+"""Fakes shared by the pipeline, deadline and shutdown tests"""
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from continuation import ContinuationStore
+from generations import ActiveGenerations
+from metrics import metrics
+from pipeline import build_pipeline
+from rate_limiter import RateLimiter
+
+class FakeBackend:
+    """Backend client that streams a canned answer word by word.
+
+    delay is the time per word; gate, when cleared, holds every generation
+    before its first word until it is set.
+    """
+    model = "fake-model"
+    chars_per_token = 4
+
+    def __init__(self, text="the quick brown fox jumps over the lazy dog", delay=0.0):
+        self.text = text
+        self.delay = delay
+        self.error = False
+        self.prompts = []
+        self.gate = threading.Event()
+        self.gate.set()
+        self._lock = threading.Lock()
+
+    def fit_prompt(self, prompt, model, max_tokens):
+        return prompt, None
+
+    def context_window(self, model):
+        return None
+
+    def generate_partial(self, prompt, max_tokens=500, context=None, handle=None, model=None):
+        with self._lock:
+            self.prompts.append(prompt)
+        result = {"text": "", "context": None, "done": True, "eval_count": 0, "cancelled": False, "error": False}
+        self.gate.wait(10)
+        if self.error:
+            result.update(text="Sorry, I couldn't connect to the AI service.", error=True)
+            return result
+
+        parts = []
+        for word in self.text.split(" "):
+            if handle is not None and handle.cancelled:
+                break
+            time.sleep(self.delay)
+            piece = word if not parts else f" {word}"
+            parts.append(piece)
+            if handle is not None and handle.on_text is not None:
+                handle.on_text(piece)
+        result["text"] = "".join(parts)
+        result["eval_count"] = len(parts)
+        result["cancelled"] = handle is not None and handle.cancelled
+        return result
+
+class FakeAdapter:
+    """Platform adapter that records what the pipeline sends and drops"""
+    bot_name = "aibot"
+
+    def __init__(self, channels=("#chan",), deadline=0):
+        self.channels = set(channels)
+        self.deadline = deadline
+        self.draining = False
+        self.sent = []
+        self.drops = []
+        self.replied = threading.Condition()
+
+    def channel_allowed(self, context):
+        return context in self.channels
+
+    def send(self, request, text):
+        with self.replied:
+            self.sent.append((request.user, request.context, text))
+            self.replied.notify_all()
+
+    def dropped(self, request, stage):
+        self.drops.append((request.text, stage))
+
+    def wait_sent(self, count, timeout=5):
+        with self.replied:
+            assert self.replied.wait_for(lambda: len(self.sent) >= count, timeout), self.sent
+        return self.sent
+
+@pytest.fixture(autouse=True)
+def clean_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+@pytest.fixture
+def backend():
+    return FakeBackend()
+
+@pytest.fixture
+def adapter():
+    return FakeAdapter()
+
+@pytest.fixture
+def make_pipeline(backend, adapter):
+    """Build the standard pipeline around the fake backend and adapter.
+
+    Returns a namespace with the pipeline, its continuation store and its
+    active generations.
+    """
+    def make(rate_limit=None, dispatch=None, **kwargs):
+        continuations = ContinuationStore(backend, max_length=80)
+        generations = ActiveGenerations()
+        pipeline = build_pipeline(adapter, continuations, RateLimiter(rate_limit), generations,
+                                  dispatch=dispatch, **kwargs)
+        return SimpleNamespace(pipeline=pipeline, continuations=continuations, generations=generations)
+    return make
@@ -0,0 +1,104 @@
+"""Tests for attachments.AttachmentStore against a local HTTP server"""
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from attachments import Attachment, AttachmentStore
+
+FILES = {
+    "/notes.txt": ("text/plain", b"line one\nline two\n"),
+    "/copy.txt": ("text/plain", b"line one\nline two\n"),
+    "/big.log": ("text/plain", b"0123456789" * 500),
+    "/long.md": ("text/markdown", b"word " * 400),
+    "/long-copy.md": ("text/markdown", b"word " * 400),
+    "/data.txt": ("text/plain", b"looks like text\x00\x01\x02 but is not"),
+    "/image.png": ("image/png", b"\x89PNG\r\n\x1a\n"),
+}
+
+class FileHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        if self.path not in FILES:
+            self.send_response(404)
+            self.end_headers()
+            return
+        content_type, body = FILES[self.path]
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), FileHandler)
+    httpd.requests = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+def attachment(server, path, file_id=None):
+    content_type = FILES.get(path, ("text/plain", b""))[0]
+    return Attachment(file_id or path, path.lstrip("/"), f"http://127.0.0.1:{server.server_port}{path}",
+                      content_type=content_type)
+
+def test_reads_text_file_into_prompt(server):
+    store = AttachmentStore()
+    prompt = store.add_to_prompt("what is this?", [attachment(server, "/notes.txt")])
+    assert prompt.startswith("what is this?")
+    assert "File notes.txt:" in prompt
+    assert "line one\nline two" in prompt
+
+def test_download_stops_at_max_bytes(server):
+    store = AttachmentStore({"max_bytes": 1024, "max_chars": 100000})
+    content_hash, text, truncated = store.download(attachment(server, "/big.log"))
+    assert truncated
+    assert len(text) == 1024
+    assert "[only the first 1024 bytes were read]" in store.file_context(attachment(server, "/big.log", "other"))
+
+def test_same_file_is_downloaded_once(server):
+    store = AttachmentStore()
+    first = store.file_context(attachment(server, "/notes.txt"))
+    second = store.file_context(attachment(server, "/notes.txt"))
+    assert first == second
+    assert server.requests == ["/notes.txt"]
+
+def test_summary_is_cached_by_content_hash(server):
+    summaries = []
+
+    def summarize(text):
+        summaries.append(text)
+        return "a file full of words"
+
+    store = AttachmentStore({"max_chars": 100}, summarize=summarize)
+    first = store.file_context(attachment(server, "/long.md"))
+    second = store.file_context(attachment(server, "/long-copy.md"))
+    assert first == second == "[summary of a long file]\na file full of words"
+    # Different file IDs with the same content are both downloaded, but summarized once
+    assert server.requests == ["/long.md", "/long-copy.md"]
+    assert len(summaries) == 1
+
+def test_long_file_is_trimmed_without_summarizer(server):
+    store = AttachmentStore({"max_chars": 100})
+    text = store.file_context(attachment(server, "/long.md"))
+    assert text.endswith("[trimmed to 100 characters]")
+
+def test_binary_content_is_skipped(server):
+    store = AttachmentStore()
+    assert store.file_context(attachment(server, "/data.txt")) is None
+    assert store.add_to_prompt("hi", [attachment(server, "/data.txt")]) == "hi"
+
+def test_non_text_files_are_not_downloaded(server):
+    store = AttachmentStore()
+    assert store.add_to_prompt("hi", [attachment(server, "/image.png")]) == "hi"
+    assert server.requests == []
+
+def test_failed_download_is_skipped(server):
+    store = AttachmentStore()
+    assert store.file_context(attachment(server, "/missing.txt")) is None
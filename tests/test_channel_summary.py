@@ -0,0 +1,95 @@
+"""Tests for channel_summary.ChannelSummaries"""
+import threading
+import time
+
+from channel_summary import STALE_NOTE, ChannelSummaries
+
+class Backend:
+    """complete() stand-in that records prompts and can fail or block"""
+    def __init__(self):
+        self.prompts = []
+        self.fail = False
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self, prompt, max_tokens):
+        self.release.wait(5)
+        self.prompts.append(prompt)
+        if self.fail:
+            return None
+        return f"summary {len(self.prompts)}"
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+def idle(summaries, channel="#chan"):
+    return not summaries._channels[channel].updating
+
+def say(summaries, count, start=0, channel="#chan"):
+    for index in range(start, start + count):
+        summaries.record(channel, "alice", f"message {index}")
+
+def test_summarize_folds_in_only_new_messages():
+    backend = Backend()
+    summaries = ChannelSummaries({"update_every": 0}, complete=backend)
+    say(summaries, 3)
+    assert summaries.summarize("#chan") == "summary 1"
+    say(summaries, 2, start=3)
+    assert summaries.summarize("#chan") == "summary 2"
+    assert "summary 1" in backend.prompts[1]
+    assert "message 2" not in backend.prompts[1]
+    assert "message 3" in backend.prompts[1]
+
+def test_background_update_every_n_messages():
+    backend = Backend()
+    summaries = ChannelSummaries({"update_every": 5}, complete=backend)
+    say(summaries, 4)
+    assert backend.prompts == []
+    say(summaries, 1, start=4)
+    wait_for(lambda: backend.prompts and idle(summaries))
+    assert summaries._channels["#chan"].summarized == 5
+
+def test_failed_background_update_is_retried():
+    backend = Backend()
+    backend.fail = True
+    summaries = ChannelSummaries({"update_every": 3}, complete=backend)
+    say(summaries, 3)
+    wait_for(lambda: len(backend.prompts) == 1 and idle(summaries))
+
+    # Past the threshold now, so the next message tries again
+    backend.fail = False
+    say(summaries, 1, start=3)
+    wait_for(lambda: len(backend.prompts) == 2 and idle(summaries))
+    assert summaries._channels["#chan"].summarized == 4
+
+def test_only_one_background_update_at_a_time():
+    backend = Backend()
+    backend.release.clear()
+    summaries = ChannelSummaries({"update_every": 2}, complete=backend)
+    say(summaries, 10)
+    backend.release.set()
+    wait_for(lambda: idle(summaries))
+    assert len(backend.prompts) == 1
+    # The update that was running when the backlog grew is followed by another on the next message
+    say(summaries, 1, start=10)
+    wait_for(lambda: len(backend.prompts) == 2 and idle(summaries))
+
+def test_failed_summarize_reports_the_stale_summary():
+    backend = Backend()
+    summaries = ChannelSummaries({"update_every": 0}, complete=backend)
+    say(summaries, 2)
+    assert summaries.summarize("#chan") == "summary 1"
+    backend.fail = True
+    say(summaries, 2, start=2)
+    assert summaries.summarize("#chan") == f"summary 1\n{STALE_NOTE}"
+
+def test_failed_first_summary():
+    backend = Backend()
+    backend.fail = True
+    summaries = ChannelSummaries({"update_every": 0}, complete=backend)
+    say(summaries, 2)
+    assert summaries.summarize("#chan") == "Sorry, I couldn't summarize this channel right now."
+    assert summaries.summarize("#quiet") == "I haven't seen any messages here yet."
@@ -0,0 +1,88 @@
+"""Tests for partial replies when generation outlasts the adapter's deadline"""
+import time
+
+from continuation import PARTIAL_MSG, PENDING_MSG, STILL_WORKING_MSG
+from pipeline import Request
+from response_cache import ResponseCache
+
+LONG_ANSWER = " ".join(f"word{index}" for index in range(40))
+
+def message(text, user="alice", context="#chan"):
+    return Request("irc", user, context, text)
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+def settled(bot, user="alice", context="#chan"):
+    """Whether the generation behind a partial reply has been stored (or discarded)"""
+    entry = bot.continuations.responses.get(f"{user}@{context}")
+    return entry is None or not entry.get("pending")
+
+def test_answer_within_the_deadline_is_sent_whole(make_pipeline, backend, adapter):
+    adapter.deadline = 5
+    bot = make_pipeline()
+    bot.pipeline.run(message("aibot: hello"))
+    assert adapter.sent == [("alice", "#chan", backend.text)]
+
+def test_partial_reply_at_the_deadline_then_continue(make_pipeline, backend, adapter):
+    backend.text = LONG_ANSWER
+    backend.delay = 0.05
+    adapter.deadline = 0.3
+    bot = make_pipeline()
+    start = time.perf_counter()
+    bot.pipeline.run(message("aibot: tell me a lot"))
+    assert time.perf_counter() - start < 1
+
+    partial = adapter.sent[0][2]
+    assert partial.startswith("word0") and partial.endswith(PARTIAL_MSG)
+    sent = partial[:-len(f"...{PARTIAL_MSG}")]
+
+    # Still generating: continue asks the user to wait
+    bot.pipeline.run(message("continue"))
+    assert adapter.sent[1][2] == PENDING_MSG
+
+    wait_for(lambda: settled(bot))
+    bot.pipeline.run(message("continue"))
+    # The rest picks up right after the last word of the partial reply
+    last = int(sent.split()[-1][len("word"):])
+    assert adapter.sent[2][2].startswith(f"word{last + 1} ")
+
+def test_nothing_generated_by_the_deadline(make_pipeline, backend, adapter):
+    backend.gate.clear()
+    adapter.deadline = 0.1
+    bot = make_pipeline()
+    bot.pipeline.run(message("aibot: hello"))
+    assert adapter.sent == [("alice", "#chan", STILL_WORKING_MSG)]
+
+    backend.gate.set()
+    wait_for(lambda: settled(bot) and not len(bot.generations))
+    bot.pipeline.run(message("continue"))
+    assert adapter.sent[1][2] == backend.text
+
+def test_errors_behind_a_partial_reply_are_not_stored(make_pipeline, backend, adapter):
+    backend.gate.clear()
+    backend.error = True
+    adapter.deadline = 0.1
+    bot = make_pipeline()
+    bot.pipeline.run(message("aibot: hello"))
+    assert adapter.sent == [("alice", "#chan", STILL_WORKING_MSG)]
+
+    backend.gate.set()
+    wait_for(lambda: settled(bot) and not len(bot.generations))
+    bot.pipeline.run(message("aibot: continue"))
+    assert adapter.sent[1][2] == "No previous message to continue."
+
+def test_answer_finished_behind_a_partial_reply_is_cached(make_pipeline, backend, adapter):
+    backend.gate.clear()
+    adapter.deadline = 0.1
+    bot = make_pipeline(cache=ResponseCache({"enabled": True}))
+    bot.pipeline.run(message("aibot: hello"))
+    backend.gate.set()
+    wait_for(lambda: settled(bot) and not len(bot.generations))
+
+    bot.pipeline.run(message("aibot: hello", user="bob"))
+    assert adapter.sent[1] == ("bob", "#chan", backend.text)
+    assert backend.prompts == ["hello"]
@@ -0,0 +1,155 @@
+"""Tests for health.CircuitBreaker and how backend clients use it"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import health
+from health import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from ollama_client import OllamaClient
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(health.time, "monotonic", clock)
+    return clock
+
+def breaker(**settings):
+    return CircuitBreaker("test", **{"failure_threshold": 3, "reset_timeout": 30, "success_threshold": 2, **settings})
+
+def open_breaker(clock):
+    circuit = breaker()
+    for _ in range(3):
+        circuit.record_failure()
+    return circuit
+
+def test_opens_after_consecutive_failures(clock):
+    circuit = breaker()
+    circuit.record_failure()
+    circuit.record_failure()
+    assert circuit.state == CLOSED
+    assert circuit.allow_request()
+    circuit.record_failure()
+    assert circuit.state == OPEN
+    assert not circuit.allow_request()
+
+def test_success_resets_the_failure_count(clock):
+    circuit = breaker()
+    circuit.record_failure()
+    circuit.record_failure()
+    circuit.record_success()
+    circuit.record_failure()
+    circuit.record_failure()
+    assert circuit.state == CLOSED
+
+def test_goes_half_open_after_reset_timeout(clock):
+    circuit = open_breaker(clock)
+    clock.now += 29
+    assert circuit.state == OPEN
+    clock.now += 1
+    assert circuit.state == HALF_OPEN
+
+def test_half_open_lets_one_trial_request_through(clock):
+    circuit = open_breaker(clock)
+    clock.now += 30
+    assert circuit.allow_request()
+    assert not circuit.allow_request()
+    circuit.record_success()
+    # Still half-open until success_threshold successes, with room for the next trial
+    assert circuit.state == HALF_OPEN
+    assert circuit.allow_request()
+
+def test_half_open_closes_after_enough_successes(clock):
+    circuit = open_breaker(clock)
+    clock.now += 30
+    circuit.record_success()
+    circuit.record_success()
+    assert circuit.state == CLOSED
+    assert circuit.allow_request()
+    assert circuit.allow_request()
+
+def test_failure_while_half_open_reopens(clock):
+    circuit = open_breaker(clock)
+    clock.now += 30
+    assert circuit.allow_request()
+    circuit.record_failure()
+    assert circuit.state == OPEN
+    # The reset timeout starts over
+    clock.now += 29
+    assert circuit.state == OPEN
+    clock.now += 1
+    assert circuit.state == HALF_OPEN
+
+def test_configure_changes_thresholds(clock):
+    circuit = breaker()
+    circuit.configure(failure_threshold=1, reset_timeout=5, success_threshold=1)
+    circuit.record_failure()
+    assert circuit.state == OPEN
+    clock.now += 5
+    circuit.record_success()
+    assert circuit.state == CLOSED
+
+class BackendHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        self.send_response(self.server.status)
+        self.end_headers()
+
+    def do_POST(self):
+        self.server.requests.append(self.path)
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        body = json.dumps({"response": "hello", "done": True}).encode()
+        self.send_response(self.server.status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), BackendHandler)
+    httpd.requests = []
+    httpd.status = 200
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+def test_open_breaker_fails_requests_without_calling_the_backend(server, clock):
+    client = OllamaClient(f"http://127.0.0.1:{server.server_port}", model="test")
+    client.breaker.configure(failure_threshold=2, reset_timeout=30, success_threshold=1)
+    server.status = 500
+    for _ in range(2):
+        assert client.generate_partial("hi")["error"]
+    assert client.breaker.state == OPEN
+    assert not client.is_available()
+
+    requests_sent = len(server.requests)
+    result = client.generate_partial("hi")
+    assert result["error"]
+    assert "unavailable" in result["text"]
+    assert len(server.requests) == requests_sent
+
+def test_probe_closes_the_breaker_when_the_backend_recovers(server, clock):
+    client = OllamaClient(f"http://127.0.0.1:{server.server_port}", model="test")
+    client.breaker.configure(failure_threshold=1, reset_timeout=30, success_threshold=1)
+    server.status = 500
+    assert not client.probe()
+    assert client.breaker.state == OPEN
+
+    server.status = 200
+    clock.now += 30
+    assert client.probe()
+    assert client.breaker.state == CLOSED
+    assert client.generate_partial("hi")["text"] == "hello"
@@ -0,0 +1,84 @@
+"""Tests for connecting irc_client.IRCBot's networks off the reactor thread"""
+import socket
+import threading
+import time
+
+import pytest
+
+import irc_client
+from irc_client import IRCBot
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+@pytest.fixture
+def server():
+    listener = socket.create_server(("127.0.0.1", 0))
+    yield listener
+    listener.close()
+
+@pytest.fixture
+def stalled(monkeypatch):
+    """Make connections to stalled.invalid hang until released, then succeed"""
+    release = threading.Event()
+    opened = []
+    create_connection = socket.create_connection
+
+    def connect(address, timeout=None):
+        if address[0] != "stalled.invalid":
+            return create_connection(address, timeout=timeout)
+        release.wait(10)
+        sock, other = socket.socketpair()
+        opened.append((sock, other))
+        return sock
+
+    monkeypatch.setattr(irc_client.socket, "create_connection", connect)
+    yield release, opened
+    release.set()
+    for pair in opened:
+        for sock in pair:
+            sock.close()
+
+@pytest.fixture
+def bot(server):
+    config = {
+        "bot_name": "aibot",
+        "ollama": {"base_url": "http://127.0.0.1:9", "model": "test-model"},
+        "irc": {
+            "channels": ["#chan"],
+            "nickname": "aibot",
+            "networks": {
+                "stalled": {"server": "stalled.invalid", "port": 6667, "connect_timeout": 0.5},
+                "local": {"server": "127.0.0.1", "port": server.getsockname()[1]},
+            },
+        },
+    }
+    bot = IRCBot(config)
+    bot.base_reconnect_delay = 60  # Keep retries out of the test
+    thread = threading.Thread(target=bot.start_bot, daemon=True)
+    thread.start()
+    yield bot
+    bot.should_stop = True
+    thread.join(5)
+    bot.services.close()
+
+def test_stalled_network_does_not_hold_up_the_others(server, stalled, bot):
+    server.settimeout(2)
+    peer, _ = server.accept()
+    with peer:
+        peer.settimeout(2)
+        assert b"NICK aibot" in peer.recv(1024)
+
+def test_stalled_connect_is_abandoned_after_connect_timeout(stalled, bot):
+    release, opened = stalled
+    network = bot.networks["stalled"]
+    wait_for(lambda: network.reconnect_attempts == 1)
+    assert network.connecting is None and network.reconnect_scheduled
+
+    # The socket that turns up late is closed rather than used
+    release.set()
+    wait_for(lambda: opened and opened[0][0].fileno() == -1)
+    assert not network.connection.is_connected()
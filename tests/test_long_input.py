@@ -0,0 +1,71 @@
+"""Tests for long_input map-reduce handling"""
+import threading
+
+import pytest
+
+from long_input import DEFAULT_REQUEST, LongInputProcessor, split_request
+
+class FakeClient:
+    chars_per_token = 4
+
+    def context_window(self, model):
+        return 0
+
+    def fit_prompt(self, prompt, model, max_tokens):
+        return prompt, None
+
+def result(text, error=False, cancelled=False):
+    return {"text": text, "context": None, "done": True, "eval_count": 1, "cancelled": cancelled, "error": error}
+
+class Backend:
+    """Answers map prompts with notes, failing the pieces listed in fail"""
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.prompts = []
+        self.lock = threading.Lock()
+
+    def __call__(self, prompt, max_tokens, handle):
+        with self.lock:
+            self.prompts.append(prompt)
+        if prompt.startswith("The user sent a long text") and "Notes on each part" in prompt:
+            return result("final answer")
+        index = int(prompt.split("Here is part ")[1].split(" ")[0])
+        if index in self.fail:
+            return result("Sorry, I couldn't connect to the AI service.", error=True)
+        return result(f"notes {index}")
+
+@pytest.fixture
+def processor():
+    return LongInputProcessor({"enabled": True, "min_tokens": 10, "chunk_tokens": 10, "parallel": 2})
+
+def long_text(lines=8):
+    return "\n".join(f"log line {index} " + "x" * 30 for index in range(lines))
+
+def test_pieces_are_reduced_into_one_answer(processor):
+    backend = Backend()
+    answer = processor.run(FakeClient(), "model", long_text() + "\nwhat failed?", 100, backend)
+    assert answer["text"] == "final answer"
+    reduce_prompt = backend.prompts[-1]
+    assert "Part 1: notes 1" in reduce_prompt
+    assert "what failed?" in reduce_prompt
+
+def test_failed_piece_aborts_without_reducing(processor):
+    backend = Backend(fail={2})
+    answer = processor.run(FakeClient(), "model", long_text(), 100, backend)
+    assert answer["error"]
+    assert answer["text"] == "Sorry, I couldn't connect to the AI service."
+    assert not any("Notes on each part" in prompt for prompt in backend.prompts)
+
+def test_cancelled_input_is_not_reduced(processor):
+    class Handle:
+        cancelled = True
+
+    backend = Backend()
+    answer = processor.run(FakeClient(), "model", long_text(), 100, backend, handle=Handle())
+    assert answer["cancelled"]
+    assert backend.prompts == []
+
+def test_split_request_prefers_a_trailing_question():
+    assert split_request("what is this?\nline\nwhy did it fail?") == ("why did it fail?", "what is this?\nline")
+    assert split_request("explain this log\nline one\nline two") == ("explain this log", "line one\nline two")
+    assert split_request("line one\nline two") == (DEFAULT_REQUEST, "line one\nline two")
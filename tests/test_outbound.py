@@ -0,0 +1,121 @@
+"""Tests for outbound.SendQueue's pacing, merging and rate limit handling"""
+import threading
+import time
+
+import pytest
+
+from metrics import metrics
+from outbound import RateLimited, SendQueue
+
+class Destination:
+    """deliver() stand-in that records each send and can be told to rate limit"""
+    def __init__(self):
+        self.sent = []
+        self.limits = []  # RateLimited errors raised by the next sends
+        self.condition = threading.Condition()
+
+    def __call__(self, text):
+        with self.condition:
+            if self.limits:
+                raise self.limits.pop(0)
+            self.sent.append((time.monotonic(), text))
+            self.condition.notify_all()
+
+    def wait_sent(self, count, timeout=5):
+        with self.condition:
+            assert self.condition.wait_for(lambda: len(self.sent) >= count, timeout), self.sent
+        return [text for _, text in self.sent]
+
+@pytest.fixture
+def make_queue():
+    queues = []
+
+    def make(max_length=100, **config):
+        queue = SendQueue("test", max_length, config)
+        queues.append(queue)
+        return queue
+
+    yield make
+    for queue in queues:
+        queue.flush(timeout=1)
+
+def test_messages_to_one_destination_are_paced(make_queue):
+    queue = make_queue(channel_interval=0.3, merge=False)
+    chan, other = Destination(), Destination()
+    queue.start()
+    start = time.monotonic()
+    queue.put("#chan", chan, "one")
+    queue.put("#chan", chan, "two")
+    queue.put("#other", other, "three")
+
+    assert chan.wait_sent(2) == ["one", "two"]
+    assert chan.sent[1][0] - chan.sent[0][0] >= 0.3
+    # Other destinations aren't held up by #chan's pacing
+    other.wait_sent(1)
+    assert other.sent[0][0] - start < 0.3
+
+def test_queued_replies_are_merged_when_they_fit(make_queue):
+    queue = make_queue(max_length=10, channel_interval=0)
+    chan = Destination()
+    for text in ("one", "two", "three", "four"):
+        queue.put("#chan", chan, text)
+    queue.put("#chan", chan, "five", mergeable=False)
+    queue.start()
+
+    assert chan.wait_sent(3) == ["one\ntwo", "three\nfour", "five"]
+    assert metrics.get("send_merged:test") == 2
+
+def test_merging_can_be_turned_off(make_queue):
+    queue = make_queue(merge=False, channel_interval=0)
+    chan = Destination()
+    queue.put("#chan", chan, "one")
+    queue.put("#chan", chan, "two")
+    queue.start()
+    assert chan.wait_sent(2) == ["one", "two"]
+
+def test_rate_limited_messages_are_requeued_in_order(make_queue):
+    queue = make_queue(merge=False, channel_interval=0)
+    chan = Destination()
+    chan.limits.append(RateLimited(0.3))
+    queue.put("#chan", chan, "one")
+    queue.put("#chan", chan, "two")
+    start = time.monotonic()
+    queue.start()
+
+    assert chan.wait_sent(2) == ["one", "two"]
+    assert chan.sent[0][0] - start >= 0.3
+    assert metrics.get("send_rate_limited:test") == 1
+
+def test_global_rate_limit_holds_every_destination(make_queue):
+    queue = make_queue(channel_interval=0, threads=1)
+    chan, other = Destination(), Destination()
+    chan.limits.append(RateLimited(0.3, is_global=True))
+    start = time.monotonic()
+    queue.start()
+    queue.put("#chan", chan, "one")
+    time.sleep(0.05)
+    queue.put("#other", other, "two")
+
+    other.wait_sent(1)
+    chan.wait_sent(1)
+    assert other.sent[0][0] - start >= 0.3
+
+def test_message_is_dropped_after_max_attempts(make_queue):
+    queue = make_queue(channel_interval=0, max_attempts=2)
+    chan = Destination()
+    chan.limits.extend([RateLimited(0.05), RateLimited(0.05)])
+    queue.put("#chan", chan, "one")
+    queue.put("#chan", chan, "two", mergeable=False)
+    queue.start()
+
+    assert chan.wait_sent(1) == ["two"]
+    assert metrics.get("send_failures:test") == 1
+
+def test_flush_sends_what_is_queued(make_queue):
+    queue = make_queue(merge=False, channel_interval=0)
+    chan = Destination()
+    queue.start()
+    for index in range(5):
+        queue.put("#chan", chan, f"message {index}")
+    queue.flush(timeout=5)
+    assert [text for _, text in chan.sent] == [f"message {index}" for index in range(5)]
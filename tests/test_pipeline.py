@@ -0,0 +1,126 @@
+"""Tests for the shared message pipeline's stage order, drops and replies"""
+from channel_summary import ChannelSummaries
+from pipeline import ERROR_REPLY, RESTARTING_REPLY, Request
+from response_cache import ResponseCache
+
+def message(text, user="alice", context="#chan", **kwargs):
+    return Request("irc", user, context, text, **kwargs)
+
+def test_stage_order(make_pipeline):
+    bot = make_pipeline(cache=ResponseCache({"enabled": True}))
+    assert [stage.name for stage in bot.pipeline.stages] == [
+        "filter", "parse", "drain", "rate-limit", "cache", "generate", "format", "chunk", "send"
+    ]
+    assert "cache" not in [stage.name for stage in make_pipeline().pipeline.stages]
+
+def test_mention_is_answered(make_pipeline, backend, adapter):
+    bot = make_pipeline()
+    bot.pipeline.run(message("aibot: what is a fox?"))
+    assert backend.prompts == ["what is a fox?"]
+    assert adapter.sent == [("alice", "#chan", backend.text)]
+
+def test_chatter_is_dropped_after_being_recorded(make_pipeline, backend, adapter):
+    summaries = ChannelSummaries({"update_every": 0})
+    bot = make_pipeline(summaries=summaries)
+    bot.pipeline.run(message("just chatting"))
+    assert adapter.sent == []
+    assert adapter.drops == [("just chatting", "parse")]
+    assert backend.prompts == []
+    assert summaries._channels["#chan"].seen == 1
+
+def test_other_channels_are_dropped_but_direct_messages_are_not(make_pipeline, backend, adapter):
+    bot = make_pipeline()
+    bot.pipeline.run(message("aibot: hello", context="#elsewhere"))
+    assert adapter.drops == [("aibot: hello", "filter")]
+    bot.pipeline.run(message("hello", context="alice", direct=True))
+    assert adapter.sent == [("alice", "alice", backend.text)]
+
+def test_empty_message_is_dropped(make_pipeline, adapter):
+    make_pipeline().pipeline.run(message(""))
+    assert adapter.drops == [("", "filter")]
+
+def test_continue_delivers_the_rest_of_a_long_answer(make_pipeline, backend, adapter):
+    backend.text = " ".join(f"word{index}" for index in range(40))
+    bot = make_pipeline()
+    bot.pipeline.run(message("aibot: tell me a lot"))
+    first = adapter.sent[0][2]
+    assert first.endswith("(say 'continue' for more)")
+    # A bare 'continue' works without a mention when there is something to continue
+    bot.pipeline.run(message("continue"))
+    assert adapter.sent[1][2].startswith("word")
+    assert adapter.sent[1][2] != first
+
+def test_bare_continue_without_a_stored_response_is_ignored(make_pipeline, adapter):
+    bot = make_pipeline()
+    bot.pipeline.run(message("continue"))
+    assert adapter.sent == []
+    assert adapter.drops == [("continue", "parse")]
+
+def test_addressed_or_direct_continue_without_a_stored_response_is_answered(make_pipeline, adapter):
+    bot = make_pipeline()
+    bot.pipeline.run(message("aibot: continue"))
+    bot.pipeline.run(message("more", context="alice", direct=True))
+    assert [text for _, _, text in adapter.sent] == ["No previous message to continue."] * 2
+
+def test_stats_command_skips_generation(make_pipeline, backend, adapter):
+    bot = make_pipeline()
+    bot.pipeline.run(message("!stats"))
+    assert backend.prompts == []
+    assert len(adapter.sent) == 1
+
+def test_rate_limited_user_gets_the_limit_message(make_pipeline, backend, adapter):
+    bot = make_pipeline(rate_limit={"enabled": True, "user_burst": 1})
+    bot.pipeline.run(message("aibot: one"))
+    bot.pipeline.run(message("aibot: two"))
+    assert backend.prompts == ["one"]
+    assert adapter.sent[1][2].startswith("You're sending requests a little fast.")
+
+def test_draining_turns_away_new_questions_but_not_continue(make_pipeline, backend, adapter):
+    backend.text = " ".join(f"word{index}" for index in range(40))
+    bot = make_pipeline()
+    bot.pipeline.run(message("aibot: tell me a lot"))
+    adapter.draining = True
+    bot.pipeline.run(message("aibot: another question"))
+    bot.pipeline.run(message("continue"))
+    assert adapter.sent[1][2] == RESTARTING_REPLY
+    assert adapter.sent[2][2].startswith("word")
+    assert len(backend.prompts) == 1
+
+def test_stage_error_sends_the_error_reply(make_pipeline, backend, adapter, monkeypatch):
+    def fail(*args, **kwargs):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(backend, "generate_partial", fail)
+    make_pipeline().pipeline.run(message("aibot: hello"))
+    assert adapter.sent == [("alice", "#chan", ERROR_REPLY)]
+
+def test_repeated_question_is_answered_from_the_cache(make_pipeline, backend, adapter):
+    bot = make_pipeline(cache=ResponseCache({"enabled": True}))
+    bot.pipeline.run(message("aibot: What is a fox?"))
+    bot.pipeline.run(message("aibot: what is a   fox?", user="bob"))
+    assert backend.prompts == ["What is a fox?"]
+    assert adapter.sent[1] == ("bob", "#chan", backend.text)
+
+def test_backend_errors_are_sent_but_not_cached(make_pipeline, backend, adapter):
+    bot = make_pipeline(cache=ResponseCache({"enabled": True}))
+    backend.error = True
+    bot.pipeline.run(message("aibot: hello"))
+    backend.error = False
+    bot.pipeline.run(message("aibot: hello"))
+    assert adapter.sent[0][2] == "Sorry, I couldn't connect to the AI service."
+    assert adapter.sent[1][2] == backend.text
+
+def test_only_blocking_stages_are_dispatched(make_pipeline, backend, adapter):
+    dispatched = []
+    bot = make_pipeline(dispatch=dispatched.append)
+    bot.pipeline.submit(message("chatter"))
+    bot.pipeline.submit(message("aibot: hello"))
+    # Filtering and parsing ran on the calling thread; generation waits for the dispatcher
+    assert adapter.drops == [("chatter", "parse")]
+    assert len(dispatched) == 1
+    assert backend.prompts == [] and adapter.sent == []
+    assert not bot.pipeline.wait_idle(0)
+
+    dispatched[0]()
+    assert adapter.sent == [("alice", "#chan", backend.text)]
+    assert bot.pipeline.wait_idle(0)
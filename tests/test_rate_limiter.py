@@ -0,0 +1,104 @@
+"""Tests for rate_limiter.RateLimiter token buckets"""
+import pytest
+
+import rate_limiter
+from rate_limiter import RateLimiter
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limiter.time, "monotonic", clock)
+    return clock
+
+def limiter(**settings):
+    return RateLimiter({"enabled": True, **settings})
+
+def test_disabled_limiter_allows_everything(clock):
+    limits = RateLimiter({"user_burst": 1})
+    assert all(limits.check("alice", "#chan") == 0 for _ in range(20))
+
+def test_user_burst_then_retry_after(clock):
+    limits = limiter(user_per_minute=6, user_burst=2)
+    assert limits.check("alice", "#chan") == 0
+    assert limits.check("alice", "#chan") == 0
+    # One token every 10 seconds
+    assert limits.check("alice", "#chan") == pytest.approx(10)
+    clock.now += 4
+    assert limits.check("alice", "#chan") == pytest.approx(6)
+    clock.now += 6
+    assert limits.check("alice", "#chan") == 0
+
+def test_scopes_have_separate_user_buckets(clock):
+    limits = limiter(user_burst=1, channel_burst=10)
+    assert limits.check("alice", "libera/#chan", scope="libera/") == 0
+    assert limits.check("alice", "libera/#chan", scope="libera/") > 0
+    # The same nick on another network is someone else
+    assert limits.check("alice", "oftc/#chan", scope="oftc/") == 0
+
+def test_channel_bucket_is_shared_by_users(clock):
+    limits = limiter(user_burst=5, channel_burst=2)
+    assert limits.check("alice", "#chan") == 0
+    assert limits.check("bob", "#chan") == 0
+    assert limits.check("carol", "#chan") > 0
+    assert limits.check("carol", "#other") == 0
+
+def test_direct_messages_skip_the_channel_bucket(clock):
+    limits = limiter(user_burst=3, channel_burst=1)
+    assert limits.check("alice", "alice") == 0
+    assert limits.check("alice", "libera/alice", scope="libera/") == 0
+    assert limits.check("alice", "alice") == 0
+
+def test_rejected_request_does_not_drain_other_buckets(clock):
+    limits = limiter(user_burst=1, channel_burst=2)
+    assert limits.check("alice", "#chan") == 0
+    assert limits.check("alice", "#chan") > 0
+    assert limits.check("alice", "#chan") > 0
+    # alice's rejected requests didn't use up the channel's second token
+    assert limits.check("bob", "#chan") == 0
+
+def test_global_bucket_limits_everyone(clock):
+    limits = limiter(global_burst=2)
+    assert limits.check("alice", "#a") == 0
+    assert limits.check("bob", "#b") == 0
+    assert limits.check("carol", "#c") > 0
+
+def test_exempt_users_match_with_or_without_scope(clock):
+    limits = limiter(user_burst=1, exempt_users=["admin", "oftc/ops"])
+    assert all(limits.check("admin", "#chan", scope="libera/") == 0 for _ in range(5))
+    assert all(limits.check("ops", "#chan", scope="oftc/") == 0 for _ in range(5))
+    assert limits.check("ops", "#chan", scope="libera/") == 0
+    assert limits.check("ops", "#chan", scope="libera/") > 0
+
+def test_tracked_keys_are_bounded(clock):
+    limits = limiter(user_burst=1, max_tracked=10)
+    for index in range(100):
+        limits.check(f"user{index}", "#chan")
+    assert len(limits._buckets) == 10
+
+def test_evicted_user_starts_with_a_full_bucket(clock):
+    limits = limiter(user_burst=1, channel_burst=100, global_burst=100, max_tracked=3)
+    assert limits.check("alice", "#chan") == 0
+    assert limits.check("alice", "#chan") > 0
+    limits.check("bob", "#chan")
+    limits.check("carol", "#chan")
+    assert limits.check("alice", "#chan") == 0
+
+def test_configure_keeps_bucket_state(clock):
+    limits = limiter(user_burst=1)
+    assert limits.check("alice", "#chan") == 0
+    limits.configure({"enabled": True, "user_burst": 1, "message": "slow down"})
+    assert limits.check("alice", "#chan") > 0
+    assert limits.limit_message(3) == "slow down"
+
+def test_limit_message_rounds_up(clock):
+    limits = limiter()
+    assert limits.limit_message(2.1) == "You're sending requests a little fast. Please try again in 3s."
+    assert limits.limit_message(0.2).endswith("in 1s.")
+    assert limits.limit_message(float("inf")).endswith("in 60s.")
@@ -0,0 +1,127 @@
+"""Tests for scheduler.GenerationScheduler model affinity and fairness"""
+import threading
+import time
+
+import pytest
+
+from metrics import metrics
+from scheduler import GenerationScheduler
+
+class FakeClient:
+    """Stands in for the backend client; only /api/ps is asked for"""
+    def __init__(self, resident=()):
+        self.resident = list(resident)
+
+    def running_models(self):
+        return self.resident
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+class Recorder:
+    """Queues jobs behind a blocking first job and records the order they run in"""
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.order = []
+        self.release = threading.Event()
+        self.threads = []
+
+    def block(self, model):
+        self.submit(model, wait=self.release)
+        wait_for(lambda: self.order)
+
+    def submit(self, model, wait=None):
+        def job():
+            self.order.append(model)
+            if wait is not None:
+                wait.wait(5)
+            return model
+
+        depth = self.scheduler.queue_depth()
+        thread = threading.Thread(target=self.scheduler.run, args=(model, job))
+        thread.start()
+        self.threads.append(thread)
+        if wait is None:
+            # Keep arrival order deterministic
+            wait_for(lambda: self.scheduler.queue_depth() == depth + 1)
+
+    def finish(self):
+        self.release.set()
+        for thread in self.threads:
+            thread.join(5)
+        return self.order
+
+@pytest.fixture(autouse=True)
+def clean_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+def scheduler(client=None, **settings):
+    return GenerationScheduler(client or FakeClient(), {"enabled": True, "slots": 1, **settings})
+
+def test_disabled_scheduler_runs_inline():
+    generations = GenerationScheduler(FakeClient())
+    caller = threading.current_thread()
+    assert generations.run("a", lambda: threading.current_thread() is caller)
+
+def test_result_and_errors_are_returned_to_the_caller():
+    generations = scheduler()
+    assert generations.run("a", lambda: 42) == 42
+
+    def fail():
+        raise ValueError("backend down")
+
+    with pytest.raises(ValueError, match="backend down"):
+        generations.run("a", fail)
+
+def test_loaded_model_runs_before_earlier_requests_for_another_model():
+    recorder = Recorder(scheduler())
+    recorder.block("a")
+    recorder.submit("b")
+    recorder.submit("a")
+    recorder.submit("b")
+    recorder.submit("a")
+    assert recorder.finish() == ["a", "a", "a", "b", "b"]
+    assert metrics.get("scheduler_affinity_picks") == 2
+    assert metrics.get("model_swaps") == 2  # Loading "a", then switching to "b" once
+
+def test_models_resident_in_the_backend_are_preferred():
+    recorder = Recorder(scheduler(FakeClient(resident=["c"])))
+    recorder.block("a")
+    recorder.submit("b")
+    recorder.submit("c")
+    assert recorder.finish() == ["a", "c", "b"]
+
+def test_requests_past_the_fairness_window_go_first():
+    recorder = Recorder(scheduler(fairness_window=0.2))
+    recorder.block("a")
+    recorder.submit("b")
+    recorder.submit("a")
+    time.sleep(0.3)
+    assert recorder.finish() == ["a", "b", "a"]
+    assert metrics.get("scheduler_fairness_picks") == 1
+
+def test_jobs_run_on_the_configured_number_of_slots():
+    generations = scheduler(slots=2)
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def job():
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.pop()
+
+    threads = [threading.Thread(target=generations.run, args=("a", job)) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert max(peak) == 2
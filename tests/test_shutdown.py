@@ -0,0 +1,112 @@
+"""Tests for draining the pipeline on shutdown and the SIGTERM handler"""
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import toml
+
+from continuation import PARTIAL_MSG
+from pipeline import INTERRUPTED_NOTE, INTERRUPTED_REPLY, RESTARTING_REPLY, Request
+
+LONG_ANSWER = " ".join(f"word{index}" for index in range(40))
+
+def message(text, user="alice", context="#chan"):
+    return Request("irc", user, context, text)
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+@pytest.fixture
+def executor():
+    executor = ThreadPoolExecutor(max_workers=4)
+    yield executor
+    executor.shutdown(wait=True)
+
+def test_draining_turns_away_new_questions(make_pipeline, backend, adapter, executor):
+    bot = make_pipeline(dispatch=executor.submit)
+    adapter.draining = True
+    bot.pipeline.submit(message("aibot: hello"))
+    assert adapter.sent == [("alice", "#chan", RESTARTING_REPLY)]
+    assert bot.pipeline.drain(bot.generations, grace=1) == 0
+    assert backend.prompts == []
+
+def test_in_flight_requests_finish_within_the_grace_period(make_pipeline, backend, adapter, executor):
+    backend.delay = 0.02
+    bot = make_pipeline(dispatch=executor.submit)
+    bot.pipeline.submit(message("aibot: hello"))
+    bot.pipeline.submit(message("aibot: hi", user="bob"))
+    wait_for(lambda: len(backend.prompts) == 2)
+
+    adapter.draining = True
+    assert bot.pipeline.drain(bot.generations, grace=5) == 0
+    assert sorted(adapter.sent) == [("alice", "#chan", backend.text), ("bob", "#chan", backend.text)]
+
+def test_generations_still_running_after_the_grace_period_are_cancelled(make_pipeline, backend, adapter,
+                                                                         executor):
+    backend.text = LONG_ANSWER
+    backend.delay = 0.1
+    bot = make_pipeline(dispatch=executor.submit)
+    bot.pipeline.submit(message("aibot: tell me a lot"))
+    wait_for(lambda: backend.prompts)
+
+    adapter.draining = True
+    start = time.monotonic()
+    assert bot.pipeline.drain(bot.generations, grace=0.3) == 1
+    assert time.monotonic() - start < 3
+    assert adapter.sent == [("alice", "#chan", INTERRUPTED_REPLY)]
+
+def test_answer_behind_a_partial_reply_is_kept_for_continue(make_pipeline, backend, adapter):
+    backend.text = LONG_ANSWER
+    backend.delay = 0.05
+    adapter.deadline = 0.2
+    bot = make_pipeline()
+    bot.pipeline.run(message("aibot: tell me a lot"))
+    assert adapter.sent[0][2].endswith(PARTIAL_MSG)
+
+    adapter.draining = True
+    assert bot.pipeline.drain(bot.generations, grace=0) == 1
+    entry = bot.continuations.responses["alice@#chan"]
+    assert entry["raw_text"].startswith("word0 ") and entry["raw_text"].endswith(INTERRUPTED_NOTE)
+    # 'continue' still works while draining
+    bot.pipeline.run(message("continue"))
+    assert adapter.sent[1][2].startswith("word")
+
+class Bot:
+    """Platform bot stand-in that records shutdown calls"""
+    def __init__(self):
+        self.graces = []
+        self.stopped = threading.Event()
+
+    def shutdown(self, grace):
+        self.graces.append(grace)
+        self.stopped.set()
+
+def test_sigterm_drains_the_bot_once(tmp_path):
+    from main import AIBot
+
+    config_file = tmp_path / "config.toml"
+    config_file.write_text(toml.dumps({
+        "platform": "irc",
+        "bot_name": "aibot",
+        "ollama": {"base_url": "http://127.0.0.1:9", "model": "test-model"},
+        "irc": {"server": "127.0.0.1", "port": 6667, "nickname": "aibot", "channels": ["#chan"]},
+        "shutdown": {"grace": 7},
+    }))
+    ai_bot = AIBot(str(config_file))
+    ai_bot.bot = Bot()
+    previous = signal.getsignal(signal.SIGTERM)
+    try:
+        ai_bot.install_shutdown_handler()
+        os.kill(os.getpid(), signal.SIGTERM)
+        assert ai_bot.bot.stopped.wait(5)
+        os.kill(os.getpid(), signal.SIGTERM)
+        time.sleep(0.2)
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+    assert ai_bot.bot.graces == [7]
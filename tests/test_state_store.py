@@ -0,0 +1,126 @@
+"""Tests for state_store's memory and SQLite stores"""
+import multiprocessing
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import state_store
+from state_store import MemoryStore, SQLiteStore, create_state_store
+
+@pytest.fixture
+def sqlite_store(tmp_path):
+    store = SQLiteStore({"path": str(tmp_path / "state.db"), "flush_interval": 60})
+    yield store
+    store.close()
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    store = create_state_store({"backend": request.param, "path": str(tmp_path / "state.db")})
+    yield store
+    store.close()
+
+def test_put_get_delete(store):
+    store.put("responses", "alice@#chan", {"text": "hello"})
+    assert store.get("responses", "alice@#chan") == {"text": "hello"}
+    store.delete("responses", "alice@#chan")
+    assert store.get("responses", "alice@#chan") is None
+
+def test_entries_expire(store, monkeypatch):
+    store.put("cache", "key", "value", ttl=10)
+    later = time.time() + 11
+    monkeypatch.setattr(state_store.time, "time", lambda: later)
+    assert store.get("cache", "key") is None
+
+def test_add_if_absent_records_once(store):
+    assert store.add_if_absent("events", "Ev1")
+    assert not store.add_if_absent("events", "Ev1")
+    assert store.add_if_absent("events", "Ev2")
+
+def test_add_if_absent_after_expiry(store, monkeypatch):
+    assert store.add_if_absent("events", "Ev1", ttl=10)
+    later = time.time() + 11
+    monkeypatch.setattr(state_store.time, "time", lambda: later)
+    assert store.add_if_absent("events", "Ev1")
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        create_state_store({"backend": "redis"})
+
+def test_sqlite_reads_unflushed_writes_and_persists_them(tmp_path, sqlite_store):
+    sqlite_store.put("responses", "alice@#chan", [1, 2, 3])
+    assert sqlite_store.get("responses", "alice@#chan") == [1, 2, 3]
+    sqlite_store.close()
+
+    reopened = SQLiteStore({"path": str(tmp_path / "state.db")})
+    try:
+        assert reopened.get("responses", "alice@#chan") == [1, 2, 3]
+    finally:
+        reopened.close()
+
+def test_sqlite_add_if_absent_sees_unflushed_writes(sqlite_store):
+    sqlite_store.put("events", "Ev1", True)
+    assert not sqlite_store.add_if_absent("events", "Ev1")
+    sqlite_store.delete("events", "Ev1")
+    assert sqlite_store.add_if_absent("events", "Ev1")
+
+def test_sqlite_add_if_absent_does_not_block_reads(tmp_path, sqlite_store):
+    sqlite_store.put("responses", "alice@#chan", "stored")
+    # Another process holds the database's write lock
+    other = sqlite3.connect(str(tmp_path / "state.db"), timeout=5, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    recorded = []
+    recorder = threading.Thread(target=lambda: recorded.append(sqlite_store.add_if_absent("events", "Ev1")))
+    recorder.start()
+    try:
+        time.sleep(0.2)  # add_if_absent is now waiting on the write lock
+        start = time.monotonic()
+        assert sqlite_store.get("responses", "alice@#chan") == "stored"
+        sqlite_store.put("responses", "bob@#chan", "also stored")
+        assert time.monotonic() - start < 1
+    finally:
+        other.execute("COMMIT")
+        other.close()
+    recorder.join(10)
+    assert recorded == [True]
+
+def record_keys(path, keys, start, results):
+    store = SQLiteStore({"path": path})
+    start.wait()
+    results.put(sum(store.add_if_absent("events", key) for key in keys))
+    store.close()
+
+def test_sqlite_add_if_absent_is_atomic_across_processes(tmp_path):
+    path = str(tmp_path / "state.db")
+    SQLiteStore({"path": path}).close()  # Create the schema up front
+    context = multiprocessing.get_context("spawn")
+    start = context.Event()
+    results = context.Queue()
+    keys = [f"Ev{index}" for index in range(200)]
+    processes = [context.Process(target=record_keys, args=(path, keys, start, results)) for _ in range(4)]
+    for process in processes:
+        process.start()
+    start.set()
+    recorded = [results.get(timeout=60) for _ in processes]
+    for process in processes:
+        process.join(10)
+    # Every key was recorded by exactly one of the processes
+    assert sum(recorded) == len(keys)
+
+def test_memory_store_add_if_absent_is_atomic_across_threads():
+    store = MemoryStore()
+    results = []
+    lock = threading.Lock()
+
+    def record():
+        recorded = sum(store.add_if_absent("events", f"Ev{index}") for index in range(500))
+        with lock:
+            results.append(recorded)
+
+    threads = [threading.Thread(target=record) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(results) == 500
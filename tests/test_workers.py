@@ -0,0 +1,133 @@
+"""Tests for workers.WorkerPool against a local Ollama-like HTTP server"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from continuation import ContinuationStore
+from llm_client import GenerationHandle
+from providers import create_client
+from workers import FAILED_REPLY, WorkerPool, worker_slots
+
+WORDS = ["alpha", "beta", "gamma", "delta", "epsilon"]
+
+class OllamaHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = json.dumps({"models": [{"name": "test-model"}]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path != "/api/generate":
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.server.generations.append(time.monotonic())
+        self.server.release.wait(30)
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.end_headers()
+            for word in WORDS:
+                # Padded so each line reaches the client as soon as it is written
+                line = {"response": f"{word} ", "done": False, "padding": " " * 600}
+                self.wfile.write((json.dumps(line) + "\n").encode())
+                self.wfile.flush()
+                time.sleep(0.1)
+            self.wfile.write((json.dumps({"response": "", "done": True, "eval_count": len(WORDS)}) + "\n").encode())
+        except OSError:
+            pass  # The worker was stopped mid-stream
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), OllamaHandler)
+    httpd.generations = []
+    httpd.release = threading.Event()
+    httpd.release.set()
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.release.set()
+    httpd.shutdown()
+    httpd.server_close()
+
+@pytest.fixture
+def pool(server):
+    config = {
+        "ollama": {"base_url": f"http://127.0.0.1:{server.server_port}", "model": "test-model"},
+        "irc": {},
+        "workers": {"enabled": True, "processes": 1, "threads": 1},
+    }
+    continuations = ContinuationStore(create_client(config["ollama"]), max_length=400)
+    pool = WorkerPool(config, "irc", continuations)
+    pool.start()
+    yield pool
+    pool.stop(timeout=1)
+
+def test_slots_are_split_between_workers():
+    config = {"scheduler": {"slots": 5}}
+    assert [worker_slots(config, index, 2) for index in range(2)] == [3, 2]
+    assert [worker_slots(config, index, 5) for index in range(5)] == [1] * 5
+    # Every worker needs at least one slot
+    assert [worker_slots({"scheduler": {"slots": 2}}, index, 3) for index in range(3)] == [1, 1, 1]
+
+def test_generated_text_is_streamed_back(pool):
+    pieces = []
+    handle = GenerationHandle("alice", "#chan")
+    handle.on_text = pieces.append
+    result = pool.generate_response("#chan", "hello", handle)
+    assert not result["error"]
+    assert result["text"] == "".join(f"{word} " for word in WORDS)
+    assert "".join(pieces) == result["text"]
+    # Batched rather than one message per piece
+    assert 1 < len(pieces) < len(WORDS)
+
+def test_stop_answers_jobs_that_never_finish(pool, server):
+    server.release.clear()
+    results = []
+
+    def ask(prompt):
+        results.append(pool.generate_response("#chan", prompt, GenerationHandle("alice", "#chan")))
+
+    threads = [threading.Thread(target=ask, args=(prompt,)) for prompt in ("running", "queued")]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 30
+    while not server.generations:
+        assert time.monotonic() < deadline, "the worker never started the job"
+        time.sleep(0.05)
+
+    start = time.monotonic()
+    pool.stop(timeout=0.5)
+    for thread in threads:
+        thread.join(10)
+    assert time.monotonic() - start < 10
+    assert [result["text"] for result in results] == [FAILED_REPLY, FAILED_REPLY]
+    assert all(result["error"] for result in results)
+
+def test_queue_depth_counts_queued_and_running_jobs(pool, server):
+    server.release.clear()
+    threads = [
+        threading.Thread(target=pool.generate_response, args=("#chan", prompt, GenerationHandle("alice", "#chan")))
+        for prompt in ("running", "queued")
+    ]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 30
+    while not server.generations:
+        assert time.monotonic() < deadline, "the worker never started the job"
+        time.sleep(0.05)
+    assert pool.queue_depth() == 2
+
+    server.release.set()
+    for thread in threads:
+        thread.join(30)
+    assert pool.queue_depth() == 0
@@ -0,0 +1,410 @@
+"""
+Generation worker processes
+
+With [workers] enabled, the platform client's process only keeps the chat
+connection, parsing and formatting, and generation (backend streaming, long
+input map-reduce, routing) runs in a pool of separate worker processes. Jobs
+go to the workers over a bounded queue: when it is full the user gets an
+immediate "busy" reply instead of piling up more work. A supervisor thread
+restarts crashed workers, failing only the jobs they had taken, so the
+platform connection is never dropped. Worker metrics are shipped back to the
+platform process so !stats still covers everything. Generated text is
+streamed back in small batches when the caller wants progress (for slash
+command previews and partial replies at a deadline).
+
+Each worker runs its own generation scheduler with a share of [scheduler]
+slots, so the backend still gets at most that many generations at once.
+Model affinity is decided per worker, though: two workers can ask for
+different models at the same time where a single scheduler would have
+grouped them.
+"""
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+BUSY_REPLY = "I'm handling a lot of requests right now. Please try again in a moment."
+FAILED_REPLY = "Sorry, I encountered an error processing your message."
+STREAM_INTERVAL = 0.2  # Seconds between batches of streamed text sent back from a worker
+
+def worker_count(config):
+    """Number of worker processes: configured, or scaled with cores and backends"""
+    processes = config.get('workers', {}).get('processes', 0)
+    if processes:
+        return processes
+    backends = 1 + len(config.get('providers', {}))
+    slots = config.get('scheduler', {}).get('slots', 2)
+    return max(1, min(os.cpu_count() or 1, backends * slots))
+
+def worker_slots(config, index, count):
+    """Scheduler slots for one worker: [scheduler] slots split between the workers.
+
+    Each worker schedules its own jobs, so splitting the slots keeps the
+    total number of generations sent to the backend at [scheduler] slots
+    (at least one per worker).
+    """
+    slots = max(1, config.get('scheduler', {}).get('slots', 2))
+    return max(1, slots // count + (1 if index < slots % count else 0))
+
+def create_worker_pool(config, platform, continuations):
+    """Start a WorkerPool if [workers] is enabled, otherwise return None"""
+    if not config.get('workers', {}).get('enabled', False):
+        return None
+    pool = WorkerPool(config, platform, continuations)
+    pool.start()
+    return pool
+
+class WorkerPool:
+    def __init__(self, config, platform, continuations):
+        self.platform = platform
+        self.continuations = continuations  # The platform's store; supplies budgets and resolves clients
+        self._context = multiprocessing.get_context('spawn')
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._pending = {}    # key: job ID, value: [Future, worker index or None, cancel reason or None, on_text]
+        self._processes = []  # Index: worker number
+        self._count = 0       # Worker processes started
+        self._controls = []   # Per-worker queues for cancel and configure messages
+        self._stopping = threading.Event()  # Set on stop(); no more restarts
+        self._exited = threading.Event()    # Set once the processes are gone; results are drained
+        self._collector = None
+        self.configure(config)
+
+    def configure(self, config):
+        """Apply [workers] settings and pass the configuration to running workers"""
+        workers_config = config.get('workers', {})
+        self.config = config
+        self.threads = workers_config.get('threads', 2)          # Concurrent jobs per worker
+        self.max_queued = workers_config.get('max_queued', 32)   # Jobs waiting before users get "busy"
+        self.job_timeout = workers_config.get('job_timeout', 300)
+
+        if self._processes and worker_count(config) != len(self._processes):
+            logger.warning("Changing the number of worker processes requires a restart")
+        for index, control in enumerate(self._controls):
+            control.put(("configure", self._worker_settings(index)))
+
+    def _worker_settings(self, index):
+        return {
+            'config': self.config,
+            'platform': self.platform,
+            'token_budget': self.continuations.token_budget,
+            'lazy': self.continuations.lazy,
+            'threads': self.threads,
+            'slots': worker_slots(self.config, index, self._count),
+        }
+
+    def start(self):
+        """Start the worker processes and the threads that collect their results"""
+        count = worker_count(self.config)
+        scheduler_config = self.config.get('scheduler', {})
+        if scheduler_config.get('enabled', False) and count > scheduler_config.get('slots', 2):
+            logger.warning(f"{count} worker processes but [scheduler] slots = {scheduler_config.get('slots', 2)}: "
+                           f"each worker needs a slot, so up to {count} generations can run at once")
+        self._count = count
+        self._jobs = self._context.Queue(maxsize=self.max_queued)
+        self._results = self._context.Queue()
+        for index in range(count):
+            self._controls.append(self._context.Queue())
+            self._processes.append(None)
+            self._spawn(index)
+
+        self._collector = threading.Thread(target=self._collect, name="worker-results", daemon=True)
+        self._collector.start()
+        threading.Thread(target=self._supervise, name="worker-supervisor", daemon=True).start()
+        logger.info(f"Started {count} generation worker processes")
+
+    def _spawn(self, index):
+        process = self._context.Process(
+            target=_worker_main,
+            args=(index, self._worker_settings(index), self._jobs, self._results, self._controls[index]),
+            name=f"generation-worker-{index}",
+            daemon=True
+        )
+        process.start()
+        self._processes[index] = process
+        metrics.set_gauge("workers_alive", sum(1 for p in self._processes if p is not None and p.is_alive()))
+
+    def generate_response(self, context, prompt, handle=None):
+        """Generate on a worker process, with the same contract as ContinuationStore.generate_response"""
+        if handle is not None and handle.cancelled:
+            return None
+
+        job_id = next(self._ids)
+        future = Future()
+        on_text = handle.on_text if handle is not None else None
+        with self._lock:
+            self._pending[job_id] = [future, None, None, on_text]
+        try:
+            self._jobs.put_nowait(
+                (job_id, handle.user if handle is not None else None, context, prompt, on_text is not None)
+            )
+        except queue.Full:
+            with self._lock:
+                del self._pending[job_id]
+            metrics.incr("worker_queue_full")
+            return self._reply(BUSY_REPLY)
+        metrics.set_gauge("worker_queue_depth", self._queue_depth())
+
+        start = time.monotonic()
+        cancel_sent = False
+        while True:
+            try:
+                result = future.result(timeout=0.5)
+                break
+            except FutureTimeout:
+                pass
+            if handle is not None and handle.cancelled and not cancel_sent:
+                cancel_sent = self._send_cancel(job_id, handle.cancel_reason)
+            if time.monotonic() - start > self.job_timeout:
+                logger.error(f"Generation job {job_id} timed out on the worker pool")
+                self._send_cancel(job_id, "timeout")
+                with self._lock:
+                    self._pending.pop(job_id, None)
+                return self._reply(FAILED_REPLY)
+
+        if result["cancelled"]:
+            return None
+        if "provider" in result:  # Not for failure replies made in this process
+            # Resume (lazy 'continue') on this process's client for the same backend
+            router = self.continuations.router
+            provider = result.pop("provider")
+            result["client"] = (router.clients.get(provider) if router is not None and provider else None) \
+                or self.continuations.ollama_client
+        return result
+
+    def _reply(self, text):
+        return {"text": text, "context": None, "done": True, "eval_count": 0, "cancelled": False,
+                "error": True, "resume_context": None, "client": self.continuations.ollama_client,
+                "model": None}
+
+    def _send_cancel(self, job_id, reason):
+        """Ask the worker running a job to cancel it (or to cancel it as soon as it starts)"""
+        with self._lock:
+            entry = self._pending.get(job_id)
+            if entry is None:
+                return True
+            entry[2] = reason or "cancelled"
+            worker = entry[1]
+        if worker is not None:
+            self._controls[worker].put(("cancel", job_id, entry[2]))
+        return True
+
+    def queue_depth(self):
+        """Jobs waiting for or running on a worker"""
+        with self._lock:
+            return len(self._pending)
+
+    def _queue_depth(self):
+        try:
+            return self._jobs.qsize()
+        except NotImplementedError:  # macOS
+            return 0
+
+    def _collect(self):
+        """Route worker messages to waiting jobs, until the workers have exited and nothing is left"""
+        while True:
+            try:
+                message = self._results.get(timeout=0.2 if self._exited.is_set() else 1)
+            except queue.Empty:
+                if self._exited.is_set():
+                    return
+                continue
+            kind = message[0]
+            if kind == "metrics":
+                metrics.merge(message[1])
+                continue
+
+            job_id = message[1]
+            with self._lock:
+                entry = self._pending.get(job_id)
+                if entry is None:
+                    continue
+                if kind == "text":
+                    on_text = entry[3]
+                if kind == "started":
+                    entry[1] = message[2]
+                    if entry[2] is not None:
+                        self._controls[entry[1]].put(("cancel", job_id, entry[2]))
+                    continue
+                if kind != "text":
+                    del self._pending[job_id]
+            if kind == "text":
+                try:
+                    on_text(message[2])
+                except Exception as e:
+                    logger.error(f"Error handling streamed text for job {job_id}: {e}")
+            elif kind == "done":
+                entry[0].set_result(message[2])
+            else:
+                logger.error(f"Generation job {job_id} failed on a worker: {message[2]}")
+                entry[0].set_result(self._reply(FAILED_REPLY))
+
+    def _supervise(self):
+        """Restart workers that died, failing the jobs they had taken"""
+        while not self._stopping.wait(1):
+            for index, process in enumerate(self._processes):
+                if process.is_alive():
+                    continue
+                logger.error(f"Generation worker {index} exited with code {process.exitcode}, restarting")
+                metrics.incr("worker_restarts")
+                with self._lock:
+                    lost = [job_id for job_id, entry in self._pending.items() if entry[1] == index]
+                for job_id in lost:
+                    self._results.put(("failed", job_id, f"worker {index} exited"))
+                if self._stopping.is_set():
+                    return
+                self._spawn(index)
+
+    def stop(self, timeout=5):
+        """Stop the workers, letting them finish the jobs they are running.
+
+        Jobs that get no result (queued, or on a worker that had to be
+        terminated) are answered with the failure reply, so no caller is
+        left waiting for its job timeout.
+        """
+        self._stopping.set()
+        for _ in self._processes:
+            try:
+                self._jobs.put(None, timeout=1)
+            except queue.Full:
+                break
+        deadline = time.monotonic() + timeout
+        for process in self._processes:
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.terminate()
+                process.join(1)
+
+        # Deliver the results the workers sent before exiting, then fail the rest
+        self._exited.set()
+        if self._collector is not None:
+            self._collector.join(5)
+        with self._lock:
+            unfinished = list(self._pending.items())
+            self._pending.clear()
+        for job_id, entry in unfinished:
+            logger.warning(f"Generation job {job_id} was still unfinished when the workers stopped")
+            entry[0].set_result(self._reply(FAILED_REPLY))
+
+def _worker_main(index, settings, jobs, results, control):
+    """Entry point of a worker process"""
+    # The platform process handles signals and tells the workers what to do
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    if not logging.getLogger().handlers:
+        logging.basicConfig(level=logging.INFO,
+                            format=f'%(asctime)s - worker{index} - %(name)s - %(levelname)s - %(message)s')
+
+    # Imported here so the platform process doesn't pay for them twice
+    from providers import create_client
+    from model_router import ModelRouter
+    from scheduler import GenerationScheduler
+    from long_input import LongInputProcessor
+    from continuation import ContinuationStore
+    from health import health_monitor
+    from llm_client import GenerationHandle
+
+    def scheduler_config(settings):
+        # This worker's share of the backend's slots
+        return {**settings['config'].get('scheduler', {}), 'slots': settings['slots']}
+
+    config = settings['config']
+    client = create_client(config['ollama'])
+    router = ModelRouter(client, config, settings['platform'])
+    scheduler = GenerationScheduler(client, scheduler_config(settings))
+    long_input = LongInputProcessor(config.get('long_input'))
+    store = ContinuationStore(
+        client, max_length=0, token_budget=settings['token_budget'], lazy=settings['lazy'],
+        router=router, scheduler=scheduler, long_input=long_input
+    )
+    health_monitor.configure(config.get('health', {}))
+    health_monitor.start()
+
+    handles = {}  # key: job ID, value: GenerationHandle
+    handles_lock = threading.Lock()
+
+    def apply(settings):
+        config = settings['config']
+        client = create_client(config['ollama'])
+        store.configure(client, settings['token_budget'], settings['lazy'])
+        router.configure(client, config)
+        scheduler.configure(client, scheduler_config(settings))
+        long_input.configure(config.get('long_input'))
+        health_monitor.configure(config.get('health', {}))
+
+    def listen():
+        while True:
+            message = control.get()
+            if message[0] == "cancel":
+                with handles_lock:
+                    handle = handles.get(message[1])
+                if handle is not None:
+                    handle.cancel(message[2] or "cancelled")
+            elif message[0] == "configure":
+                apply(message[1])
+
+    def report():
+        while True:
+            time.sleep(1)
+            results.put(("metrics", metrics.drain()))
+
+    def run(job_id, user, context, prompt, stream):
+        handle = GenerationHandle(user, context)
+        buffered = []
+        if stream:
+            # Streamed text goes back in batches rather than one message per token
+            sent_at = [time.monotonic()]
+
+            def on_text(piece):
+                buffered.append(piece)
+                if time.monotonic() - sent_at[0] >= STREAM_INTERVAL:
+                    results.put(("text", job_id, "".join(buffered)))
+                    buffered.clear()
+                    sent_at[0] = time.monotonic()
+            handle.on_text = on_text
+        with handles_lock:
+            handles[job_id] = handle
+        try:
+            results.put(("started", job_id, index))
+            result = store.generate_response(context, prompt, handle)
+            if buffered:
+                results.put(("text", job_id, "".join(buffered)))
+            if result is None:
+                result = {"text": "", "context": None, "done": True, "eval_count": 0, "cancelled": True,
+                          "error": False, "resume_context": None, "model": None, "client": None}
+            # Clients hold sessions and locks; send back which backend was used instead
+            client = result.pop("client")
+            result["provider"] = next((name for name, named in router.clients.items() if named is client), None)
+            results.put(("done", job_id, result))
+        except Exception as e:
+            results.put(("failed", job_id, str(e)))
+        finally:
+            with handles_lock:
+                handles.pop(job_id, None)
+            slots.release()
+
+    threading.Thread(target=listen, name="worker-control", daemon=True).start()
+    threading.Thread(target=report, name="worker-metrics", daemon=True).start()
+
+    # Only take a job when a thread is free, so queued jobs go to idle workers
+    slots = threading.Semaphore(settings['threads'])
+    executor = ThreadPoolExecutor(max_workers=settings['threads'], thread_name_prefix=f"worker{index}")
+    while True:
+        slots.acquire()
+        job = jobs.get()
+        if job is None:
+            break
+        executor.submit(run, *job)
+
+    executor.shutdown(wait=True)
+    results.put(("metrics", metrics.drain()))